@@ -0,0 +1,524 @@
+# This file holds the vault agent, a background process that logs in once and answers lookups over a Unix socket
+# Scripts then get a password in well under a millisecond instead of opening the database and logging in every time
+#   $ python ./agent.py start --user bob &
+#   $ python ./agent.py get github --field password
+#   $ python ./agent.py lock
+#   $ python ./agent.py stop
+#
+# How it works:
+#   ^ start logs in (unwrapping the data key once) and keeps the connection, the key and the item cache in memory
+#     ^ The database runs on its own thread through AsyncDatabase so a slow query never holds up other clients
+#   ^ Clients connect to SOCKET_FILE, which only the user running the agent can open
+#   ^ Many clients can be connected at once, each is served by its own asyncio task
+#   ^ After idle_timeout seconds without a request the agent locks itself
+#     ^ The data key and every decrypted item are dropped, requests fail with "locked" until unlock is sent
+#
+# Protocol:
+#   ^ Every message is a 4 byte big endian length followed by that many bytes of JSON (like the frames in exporter.py)
+#   ^ A request is {"op": <name>, ...arguments} and gets exactly one response back on the same connection
+#     ^ {"ok": true, "result": ...} or {"ok": false, "error": <message>, "code": <one of the CODE_ values>}
+#   ^ Operations:
+#     ^ ping                                      {"locked": bool}
+#     ^ unlock  user, password                    logs in again after a lock
+#     ^ lock                                      drops the key and the cache straight away
+#     ^ get     item (id or exact name)           {"id", "item_name", "username", "password"}
+#     ^ list    after_id, limit, folder_id        {"rows": [...], "next_cursor": id or null}
+#     ^ search  query, limit                      [{"id", "item_name", "username"}, ...]
+#     ^ stop                                      shuts the agent down
+#
+# AgentClient keeps one connection open so a script can make many requests without reconnecting
+
+import asyncio
+import json
+import os
+import socket
+import struct
+import time
+from async_database import AsyncDatabase
+from log import get_logger
+
+logger = get_logger(__name__)
+
+SOCKET_FILE = "./data/agent.sock"
+
+# Seconds without a request before the agent locks itself
+IDLE_TIMEOUT = 15 * 60
+
+# Seconds between checks of the idle timeout
+IDLE_CHECK_INTERVAL = 5.0
+
+# Big endian unsigned int used for the length of every message
+FRAME_HEADER = struct.Struct(">I")
+
+# Longer messages are refused and the connection is closed
+MAX_FRAME_SIZE = 1024 * 1024
+
+# Most rows a list or search can ask for at once, so every response fits in one frame
+MAX_PAGE_SIZE = 1000
+
+# Range of an sqlite integer, ids and cursors outside it can't be bound to a query
+SQLITE_MIN_INT = -2 ** 63
+SQLITE_MAX_INT = 2 ** 63 - 1
+
+# Error codes sent back to clients
+CODE_BAD_REQUEST = "bad_request"
+CODE_LOCKED = "locked"
+CODE_LOGIN_FAILED = "login_failed"
+CODE_NOT_FOUND = "not_found"
+CODE_ERROR = "error"
+
+ITEM_FIELDS = ("item_name", "username", "password")
+
+
+class AgentError(Exception):
+    '''Raised for a request that can't be answered, code is one of the CODE_ values'''
+
+    def __init__(self, message: str, code: str = CODE_ERROR):
+        super().__init__(message)
+        self.code = code
+
+
+def encode_frame(message) -> bytes:
+    body = json.dumps(message, separators=(",", ":")).encode()
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+def is_id(value) -> bool:
+    '''Returns True for an int sqlite can store, JSON true and false load as bools which are ints too'''
+    return isinstance(value, int) and not isinstance(value, bool) and SQLITE_MIN_INT <= value <= SQLITE_MAX_INT
+
+
+def get_limit(request: dict, default: int = 50) -> int:
+    limit = request.get("limit", default)
+
+    if not is_id(limit) or not 0 < limit <= MAX_PAGE_SIZE:
+        raise AgentError(f"limit has to be between 1 and {MAX_PAGE_SIZE}", CODE_BAD_REQUEST)
+
+    return limit
+
+
+class VaultAgent:
+    '''Holds an unlocked session and answers requests from clients of the socket'''
+
+    def __init__(self, db: AsyncDatabase, socket_path: str = SOCKET_FILE, idle_timeout: float = IDLE_TIMEOUT):
+        self.db = db
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+
+        # None while locked
+        self.session = None
+        self.last_request = time.monotonic()
+
+        # Set by serve()
+        self.stopped = None
+
+        # The function for every operation
+        self.operations = {
+            "ping": self.op_ping,
+            "unlock": self.op_unlock,
+            "lock": self.op_lock,
+            "get": self.op_get,
+            "list": self.op_list,
+            "search": self.op_search,
+            "stop": self.op_stop,
+        }
+
+    async def unlock(self, user_name: str, password: str) -> bool:
+        '''Logs the user in and keeps the session, returns False if the details are wrong'''
+        session = await self.db.authenticate(user_name, password)
+
+        if session is None:
+            return False
+
+        if self.session is not None and self.session.user_id != session.user_id:
+            await self.lock()
+
+        self.session = session
+        self.last_request = time.monotonic()
+        return True
+
+    async def lock(self):
+        '''Forgets the data key and every decrypted item'''
+        if self.session is None:
+            return
+
+        await self.db.lock_user(self.session.user_id)
+        await self.db.clear_cache()
+        self.session = None
+        logger.info("Agent locked")
+
+    def require_session(self):
+        if self.session is None:
+            raise AgentError("The agent is locked", CODE_LOCKED)
+
+        return self.session
+
+    async def find_item(self, item) -> int:
+        '''Returns the id of the item given by id or exact name, it has to belong to the session'''
+        user_id = self.require_session().user_id
+
+        if is_id(item):
+            if await self.db.get_item_owner(item) != user_id:
+                raise AgentError(f"No item with the id {item}", CODE_NOT_FOUND)
+
+            return item
+
+        if not isinstance(item, str):
+            raise AgentError("item has to be an id or a name", CODE_BAD_REQUEST)
+
+        item_ids = await self.db.find_items(user_id, item)
+
+        if not item_ids:
+            raise AgentError(f"No item named {item!r}", CODE_NOT_FOUND)
+
+        if len(item_ids) > 1:
+            raise AgentError(f"{len(item_ids)} items are named {item!r}, use one of the ids {item_ids}")
+
+        return item_ids[0]
+
+    async def op_ping(self, request: dict):
+        return {"locked": self.session is None}
+
+    async def op_unlock(self, request: dict):
+        user_name = request.get("user")
+        password = request.get("password")
+
+        if not isinstance(user_name, str) or not isinstance(password, str):
+            raise AgentError("unlock needs a user and a password", CODE_BAD_REQUEST)
+
+        if not await self.unlock(user_name, password):
+            raise AgentError("Incorrect username or password", CODE_LOGIN_FAILED)
+
+        return None
+
+    async def op_lock(self, request: dict):
+        await self.lock()
+        return None
+
+    async def op_get(self, request: dict):
+        item_id = await self.find_item(request.get("item"))
+        details = await self.db.get_item_details(item_id)
+
+        if details is None:
+            raise AgentError(f"Item {item_id} could not be decrypted")
+
+        return {"id": item_id, **dict(zip(ITEM_FIELDS, details))}
+
+    async def op_list(self, request: dict):
+        session = self.require_session()
+        after_id = request.get("after_id", 0)
+        folder_id = request.get("folder_id")
+
+        if not is_id(after_id) or not (folder_id is None or is_id(folder_id)):
+            raise AgentError("after_id and folder_id have to be ids", CODE_BAD_REQUEST)
+
+        page = await self.db.get_items_page(session.user_id, ("id", "item_name", "username", "folder_id"),
+                                            after_id, get_limit(request, MAX_PAGE_SIZE), folder_id)
+
+        return {"rows": [row._asdict() for row in page.rows], "next_cursor": page.next_cursor}
+
+    async def op_search(self, request: dict):
+        session = self.require_session()
+        query = request.get("query")
+
+        if not isinstance(query, str):
+            raise AgentError("search needs a query", CODE_BAD_REQUEST)
+
+        rows = await self.db.search_items(session.user_id, query, get_limit(request))
+        return [{"id": item_id, "item_name": item_name, "username": username}
+                for item_id, item_name, username in rows]
+
+    async def op_stop(self, request: dict):
+        self.stopped.set()
+        return None
+
+    async def handle_request(self, request) -> dict:
+        '''Runs one request and returns the response to send back'''
+        if not isinstance(request, dict) or request.get("op") not in self.operations:
+            return {"ok": False, "error": "Unknown operation", "code": CODE_BAD_REQUEST}
+
+        # Pings don't count as use so a status check never keeps the vault unlocked
+        if request["op"] != "ping":
+            self.last_request = time.monotonic()
+
+        try:
+            result = await self.operations[request["op"]](request)
+
+        except AgentError as e:
+            return {"ok": False, "error": str(e), "code": e.code}
+
+        # Anything else (a locked or broken vault, a value sqlite can't take) is answered instead of closing the client
+        except Exception as e:
+            logger.error("Agent request %s failed: %s", request["op"], e)
+            return {"ok": False, "error": str(e), "code": CODE_ERROR}
+
+        return {"ok": True, "result": result}
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        '''Answers the requests of one client until it disconnects'''
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(FRAME_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    # The client closed the connection
+                    break
+
+                length = FRAME_HEADER.unpack(header)[0]
+
+                if length > MAX_FRAME_SIZE:
+                    logger.warning("Closed a client that sent a %s byte message", length)
+                    break
+
+                body = await reader.readexactly(length)
+
+                try:
+                    request = json.loads(body)
+                except ValueError:
+                    response = {"ok": False, "error": "Request isn't valid JSON", "code": CODE_BAD_REQUEST}
+                else:
+                    response = await self.handle_request(request)
+
+                writer.write(encode_frame(response))
+                await writer.drain()
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        except asyncio.CancelledError:
+            # The agent is shutting down while the client is waiting, asyncio logs a cancelled handler as an error
+            pass
+
+        finally:
+            writer.close()
+
+    async def watch_idle(self):
+        '''Locks the agent once no request has come in for idle_timeout seconds'''
+        while True:
+            await asyncio.sleep(min(IDLE_CHECK_INTERVAL, self.idle_timeout))
+
+            if self.session is not None and time.monotonic() - self.last_request >= self.idle_timeout:
+                await self.lock()
+
+    async def serve(self):
+        '''Listens on the socket until a stop request or a signal'''
+        import signal
+
+        self.stopped = asyncio.Event()
+        remove_stale_socket(self.socket_path)
+
+        # Only the user running the agent can connect, the socket is created with these permissions
+        old_umask = os.umask(0o177)
+
+        try:
+            server = await asyncio.start_unix_server(self.handle_client, path=self.socket_path)
+        finally:
+            os.umask(old_umask)
+
+        loop = asyncio.get_running_loop()
+
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, self.stopped.set)
+
+        idle_task = asyncio.create_task(self.watch_idle())
+
+        try:
+            async with server:
+                await self.stopped.wait()
+
+        finally:
+            idle_task.cancel()
+            await self.lock()
+
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def remove_stale_socket(socket_path: str):
+    '''Removes a socket file left behind by an agent that didn't shut down
+    Raises AgentError if an agent is still listening on it'''
+    if not os.path.exists(socket_path):
+        os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+        return
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+
+    raise AgentError(f"An agent is already running on {socket_path}")
+
+
+class AgentClient:
+    '''A blocking connection to the agent, keep it open to make many requests'''
+
+    def __init__(self, socket_path: str = SOCKET_FILE, timeout: float | None = 30.0):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+
+        try:
+            self.sock.connect(socket_path)
+        except OSError:
+            self.sock.close()
+            raise
+
+    def request(self, op: str, **arguments):
+        '''Sends one request and returns its result, raises AgentError if it failed'''
+        self.sock.sendall(encode_frame({"op": op, **arguments}))
+
+        length = FRAME_HEADER.unpack(self.receive(FRAME_HEADER.size))[0]
+        response = json.loads(self.receive(length))
+
+        if not response["ok"]:
+            raise AgentError(response["error"], response["code"])
+
+        return response["result"]
+
+    def receive(self, size: int) -> bytes:
+        data = bytearray()
+
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+
+            if not chunk:
+                raise ConnectionError("The agent closed the connection")
+
+            data += chunk
+
+        return bytes(data)
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def start_agent(args) -> int:
+    from cli import read_secret
+    from database import ITEM_CACHE_SIZE, ITEM_CACHE_TTL
+
+    user_name = args.user or os.environ.get("ARCANUM_USER")
+
+    if not user_name:
+        print("No user given, pass --user or set ARCANUM_USER")
+        return 1
+
+    password = read_secret("ARCANUM_PASSWORD", "Master password: ")
+
+    async def run() -> int:
+        db = AsyncDatabase()
+        agent = VaultAgent(db, args.socket, args.idle_timeout)
+
+        try:
+            cache_size = ITEM_CACHE_SIZE if args.cache_size is None else args.cache_size
+            await db.set_cache_limits(cache_size, ITEM_CACHE_TTL)
+
+            if not await agent.unlock(user_name, password):
+                print("Incorrect username or password")
+                return 1
+
+            print(f"Agent listening on {args.socket}", flush=True)
+            await agent.serve()
+
+        except AgentError as e:
+            print(e)
+            return 1
+
+        finally:
+            db.close()
+
+        return 0
+
+    return asyncio.run(run())
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Keep the vault unlocked in a background process and answer lookups over a Unix socket")
+    parser.add_argument("--socket", default=SOCKET_FILE)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    start = commands.add_parser("start", help="Log in and serve requests until stopped")
+    start.add_argument("--user", help="The user to log in as, defaults to ARCANUM_USER")
+    start.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                       help="Seconds without a request before the agent locks itself")
+    start.add_argument("--cache-size", type=int,
+                       help="Decrypted items kept in memory, 0 turns the cache off (default database.ITEM_CACHE_SIZE)")
+
+    get = commands.add_parser("get", help="Print an item with its password")
+    get.add_argument("item", help="The id or exact name of the item")
+    get.add_argument("--field", choices=ITEM_FIELDS, help="Only print this value")
+
+    search = commands.add_parser("search", help="Search item names and usernames")
+    search.add_argument("query")
+    search.add_argument("--limit", type=int, default=50)
+
+    unlock = commands.add_parser("unlock", help="Log in again after the agent locked itself")
+    unlock.add_argument("--user", help="The user to log in as, defaults to ARCANUM_USER")
+
+    commands.add_parser("list", help="Print every item without passwords")
+    commands.add_parser("status", help="Print whether the agent is locked")
+    commands.add_parser("lock", help="Drop the key and every decrypted item now")
+    commands.add_parser("stop", help="Shut the agent down")
+
+    args = parser.parse_args()
+
+    if args.command == "start":
+        raise SystemExit(start_agent(args))
+
+    try:
+        with AgentClient(args.socket) as client:
+            match args.command:
+                case "get":
+                    item = int(args.item) if args.item.isdigit() else args.item
+                    result = client.request("get", item=item)
+                    print(result[args.field] if args.field else json.dumps(result))
+
+                case "search":
+                    for row in client.request("search", query=args.query, limit=args.limit):
+                        print(json.dumps(row))
+
+                case "list":
+                    after_id = 0
+
+                    while after_id is not None:
+                        page = client.request("list", after_id=after_id)
+
+                        for row in page["rows"]:
+                            print(json.dumps(row))
+
+                        after_id = page["next_cursor"]
+
+                case "unlock":
+                    from cli import read_secret
+                    client.request("unlock", user=args.user or os.environ.get("ARCANUM_USER"),
+                                   password=read_secret("ARCANUM_PASSWORD", "Master password: "))
+
+                case "status":
+                    print(json.dumps(client.request("ping")))
+
+                case "lock" | "stop":
+                    client.request(args.command)
+
+    except AgentError as e:
+        print(json.dumps({"error": str(e), "code": e.code}))
+        raise SystemExit(1)
+
+    except OSError as e:
+        print(json.dumps({"error": f"Can't reach the agent: {e}", "code": CODE_ERROR}))
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# This file holds an async version of the Database for the GUI
+# Every query is run on one dedicated thread that owns its own sqlite connection
+# So the Textual event loop never waits on the disk or on decryption
+#
+# Usage:
+#   ^ Every Database method can be awaited with the same arguments
+#     ^ name = await db.get_item_details(item_id)
+#   ^ Generators like iter_items can't be used through this class
+#     ^ Use a separate Database on a worker thread for those
+#   ^ Callbacks passed to subscribe are called on the event loop and not the database thread
+#   ^ Exceptions a method raises (e.g. database.ConflictError) are raised again where it is awaited
+#
+# Creating one is cheap, nothing is imported or opened until start() or the first query
+# The database module (and the crypto it imports) is loaded on the database thread
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from storage import StorageProfile, get_profile
+
+
+class AsyncDatabase:
+    '''Runs Database methods on a dedicated thread and lets the caller await the result'''
+
+    def __init__(self, database_file: str | None = None, profile: StorageProfile | None = None):
+        # None opens database.DATABASE_FILE
+        self.database_file = database_file
+        # The connection settings, see storage.py
+        self.profile = profile if profile is not None else get_profile()
+
+        # Maps each subscribed callback to the function that forwards events to it
+        self.forwarders = {}
+
+        # Set by start()
+        self.executor = None
+        self.database_future = None
+
+    def start(self):
+        '''Starts opening the database in the background, does nothing if it was already started'''
+        if self.database_future is not None:
+            return
+
+        # One worker so every query runs on the thread that created the connection
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="database")
+
+        # The Database is created on the database thread as its first job
+        self.database_future = self.executor.submit(self.open_database)
+
+    # Only ever runs on the database thread
+    def open_database(self):
+        from database import Database, DATABASE_FILE
+        return Database(self.database_file or DATABASE_FILE, self.profile)
+
+    async def run(self, method_name: str, *args, **kwargs):
+        '''Runs a Database method on the database thread and returns its result'''
+        loop = asyncio.get_running_loop()
+        self.start()
+
+        return await loop.run_in_executor(
+            self.executor, partial(self.call, method_name, *args, **kwargs))
+
+    # Only ever runs on the database thread
+    def call(self, method_name: str, *args, **kwargs):
+        database = self.database_future.result()
+        return getattr(database, method_name)(*args, **kwargs)
+
+    async def subscribe(self, callback):
+        '''callback is called on the event loop with every event from events.py'''
+        loop = asyncio.get_running_loop()
+
+        # Events are published on the database thread, hand them over without waiting
+        def forward(event):
+            loop.call_soon_threadsafe(callback, event)
+
+        self.forwarders[callback] = forward
+        await self.run("subscribe", forward)
+
+    async def unsubscribe(self, callback):
+        forward = self.forwarders.pop(callback, None)
+
+        if forward is not None:
+            await self.run("unsubscribe", forward)
+
+    def __getattr__(self, name: str):
+        # Anything else is looked up on the Database when the query runs
+        # So a name that isn't a Database method fails when it is awaited
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        async def method(*args, **kwargs):
+            return await self.run(name, *args, **kwargs)
+
+        return method
+
+    def close(self):
+        '''Closes the connection and stops the database thread'''
+        # Never started so there is nothing to close
+        if self.database_future is None:
+            return
+
+        self.executor.submit(lambda: self.database_future.result().close())
+        self.executor.shutdown(wait=True)
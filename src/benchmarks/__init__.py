@@ -0,0 +1,3 @@
+# Benchmarks for the slow paths of the app
+# Run them from the src directory so the app modules can be imported
+#   $ python -m benchmarks.<name>
@@ -0,0 +1,107 @@
+# Measures how long a lookup through the vault agent takes compared to a cold cli.py run
+#   $ python -m benchmarks.bench_agent --items 10000 --samples 2000
+#
+# An agent is started on a vault with --items items in a temporary directory
+# One AgentClient connection is kept open and every request is timed from sending to having the response
+# The gets are spread over HOT_ITEMS items, which fit in the item cache of the agent
+# The first round of gets fills the cache, the timed ones are warm
+#
+# --max-ms fails the run if the p50 of a warm get is slower, use it to guard against regressions
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_cli import PASSWORD, USER, make_vault
+from benchmarks.bench_database import print_result, summarise, time_calls
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds to wait for the agent to start listening
+START_TIMEOUT = 30
+
+# Number of different items looked up, smaller than database.ITEM_CACHE_SIZE
+HOT_ITEMS = 100
+
+
+def start_agent(directory: str, env: dict) -> subprocess.Popen:
+    process = subprocess.Popen([sys.executable, os.path.join(SRC_DIR, "agent.py"), "start"],
+                               cwd=directory, env=env, stdout=subprocess.PIPE, text=True)
+
+    # The agent prints one line once it is listening
+    line = process.stdout.readline()
+
+    if "listening" not in line:
+        process.kill()
+        raise SystemExit(f"The agent didn't start: {line.strip()}")
+
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark lookups through the vault agent")
+    parser.add_argument("--items", type=int, default=10_000)
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="Fail if the p50 of a warm get is slower than this")
+    args = parser.parse_args()
+
+    from agent import SOCKET_FILE, AgentClient
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_vault(directory, args.items)
+        env = dict(os.environ, ARCANUM_USER=USER, ARCANUM_PASSWORD=PASSWORD)
+
+        # One cold lookup for comparison, it opens the database and logs in
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(SRC_DIR, "cli.py"), "get", "1"], cwd=directory,
+                       env=env, stdout=subprocess.DEVNULL, check=True)
+        print(f"cli.py get (cold)   {(time.perf_counter() - start) * 1000:9.1f}ms")
+
+        agent = start_agent(directory, env)
+        results = []
+
+        try:
+            with AgentClient(os.path.join(directory, SOCKET_FILE)) as client:
+                random.seed(args.items)
+                hot_ids = random.sample(range(1, args.items + 1), min(HOT_ITEMS, args.items))
+                item_ids = random.choices(hot_ids, k=args.samples)
+
+                # Fills the cache of the agent
+                for item_id in hot_ids:
+                    client.request("get", item=item_id)
+
+                def record(operation: str, times: list[float], rows: int = 1):
+                    result = summarise(args.items, operation, times, rows)
+                    results.append(result)
+                    print_result(result)
+
+                record("ping", time_calls(lambda: client.request("ping"), [()] * args.samples))
+                record("get id warm", time_calls(lambda item: client.request("get", item=item),
+                                                 [(item_id,) for item_id in item_ids]))
+                record("get name warm", time_calls(lambda item: client.request("get", item=f"item {item - 1}"),
+                                                   [(item_id,) for item_id in item_ids]))
+                record("search", time_calls(lambda query: client.request("search", query=query, limit=20),
+                                            [(f"item {item_id}",) for item_id in item_ids]))
+                record("list page", time_calls(lambda after: client.request("list", after_id=after, limit=200),
+                                               [(item_id,) for item_id in item_ids[:200]]), 200)
+
+                client.request("stop")
+
+        finally:
+            agent.wait(timeout=START_TIMEOUT)
+
+    warm_get = next(result for result in results if result["operation"] == "get id warm")
+
+    if args.max_ms is not None and warm_get["p50_ms"] > args.max_ms:
+        print(f"FAIL: warm get p50 {warm_get['p50_ms']:.3f}ms is slower than {args.max_ms:.3f}ms")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# Measures how long cli.py takes to run a command from start to exit
+#   $ python -m benchmarks.bench_cli --runs 10 --max-ms 300
+#
+# Every command is run in a fresh interpreter against a vault with --items items in a temporary directory
+# The time includes interpreter startup, imports, logging in and the query
+#   ^ Logging in unwraps the data key of the user to check the password, so every command but --help
+#     includes one full key derivation
+#
+# It also fails if any command imports Textual or Rich
+# --max-ms fails the run if the median of list or search is slower, use it to guard against regressions
+
+import argparse
+import compileall
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(SRC_DIR, "cli.py")
+
+USER = "bench"
+PASSWORD = "bench-password"
+
+COMMANDS = [
+    ["--help"],
+    ["list"],
+    ["search", "item 1"],
+    ["get", "item 1"],
+]
+
+# Commands held to --max-ms, get also decrypts the item and --help doesn't log in
+FAST_COMMANDS = {"list", "search"}
+
+# Modules the command line interface must never load
+FORBIDDEN_MODULES = ("textual", "rich")
+
+
+def make_vault(directory: str, count: int):
+    '''Creates the user and their items in directory with the same relative paths cli.py uses'''
+    code = f"""
+from database import Database
+db = Database()
+db.add_user({USER!r}, {PASSWORD!r})
+session = db.authenticate({USER!r}, {PASSWORD!r})
+db.add_items(session.user_id, ((f"item {{i}}", "user", "password") for i in range({count})))
+db.close()
+"""
+    subprocess.run([sys.executable, "-c", code], cwd=directory, check=True,
+                   env=dict(os.environ, PYTHONPATH=SRC_DIR))
+
+
+def run_once(directory: str, args: list[str], env: dict) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, CLI, *args], cwd=directory, env=env,
+                   stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def imported_modules(directory: str, args: list[str], env: dict) -> set[str]:
+    '''Returns the top level packages the command imports'''
+    result = subprocess.run([sys.executable, "-X", "importtime", CLI, *args], cwd=directory, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+
+    # Lines look like "import time:   self |   cumulative | module"
+    return {line.rsplit("|", 1)[-1].strip().split(".")[0]
+            for line in result.stderr.splitlines() if line.startswith("import time:")}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the time cli.py takes to run a command")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="Fail if the median time of list or search is slower than this")
+    args = parser.parse_args()
+
+    failed = False
+
+    # Without up to date .pyc files every run would compile the sources again (e.g. with PYTHONDONTWRITEBYTECODE set)
+    compileall.compile_dir(SRC_DIR, quiet=1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_vault(directory, args.items)
+        env = dict(os.environ, ARCANUM_USER=USER, ARCANUM_PASSWORD=PASSWORD)
+
+        for command in COMMANDS:
+            # The first run warms the disk cache and isn't counted
+            run_once(directory, command, env)
+            times = sorted(run_once(directory, command, env) * 1000 for _ in range(args.runs))
+            median = statistics.median(times)
+
+            print(f"{' '.join(command):<16} median {median:7.1f}ms   min {times[0]:7.1f}ms   max {times[-1]:7.1f}ms")
+
+            loaded = imported_modules(directory, command, env).intersection(FORBIDDEN_MODULES)
+
+            if loaded:
+                print(f"FAIL: {' '.join(command)} imported {', '.join(sorted(loaded))}")
+                failed = True
+
+            if args.max_ms is not None and command[0] in FAST_COMMANDS and median > args.max_ms:
+                print(f"FAIL: {' '.join(command)} median {median:.1f}ms is slower than {args.max_ms:.1f}ms")
+                failed = True
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+# Runs several processes against one vault file at once and checks nothing was lost or broken
+#   $ python -m benchmarks.bench_concurrency --processes 8 --seconds 10
+#
+# Every process opens its own Database, logs in as the same user and for --seconds does a random mix of
+#   ^ Reads: get_item_details, a page of get_items_page and search_items
+#   ^ Writes: update_item and delete_item with the version it just read, and add_item
+#     ^ --write-ratio is the share of writes, other processes change items between the read and the write
+#
+# Items are saved with their password equal to their name so every read can check the row isn't mixed up
+#
+# Once every process has stopped the vault is checked against what they report:
+#   ^ No two updates of an item were given the same version, that would mean one overwrote the other unseen
+#   ^ The version of every item is one more than the number of updates it had
+#   ^ The number of items and users.item_changes add up with the adds, deletes and updates
+#   ^ Every password still decrypts and matches its name, and PRAGMA integrity_check and the search index are fine
+#   ^ No Database method logged an error, e.g. a write that stayed locked after every retry
+#
+# It prints the throughput, the read and write latency, the conflicts and how often a write had to wait and retry
+# --min-ops fails the run if fewer operations per second were done than that, use it to guard against regressions
+
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+
+from benchmarks.bench_database import print_result, summarise
+
+USER = "bench"
+PASSWORD = "bench-password"
+
+# Seconds the processes get to start and log in before they all begin at the same moment
+START_DELAY = 3.0
+
+# Share of the writes that are updates and deletes, the rest are adds
+# Deletes are kept rare so most updates still find their item after a few seconds
+UPDATE_SHARE = 0.9
+DELETE_SHARE = 0.02
+
+
+class LogCounter(logging.Handler):
+    '''Counts the errors and busy retries the Database logs in a worker'''
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.errors = []
+        self.busy_retries = 0
+
+    def emit(self, record: logging.LogRecord):
+        if record.levelno >= logging.ERROR:
+            self.errors.append(record.getMessage())
+        elif record.getMessage().startswith("Database is busy"):
+            self.busy_retries += 1
+
+
+def fill_vault(count: int):
+    '''Creates the user and count items with ids 1 to count in the current directory'''
+    from database import Database
+
+    db = Database()
+    db.add_user(USER, PASSWORD)
+    session = db.authenticate(USER, PASSWORD)
+    db.add_items(session.user_id, ((f"item {i}", "user", f"item {i}") for i in range(1, count + 1)))
+    db.close()
+
+
+def worker(index: int, directory: str, args, start_at: float, results):
+    '''Runs the random mix of reads and writes and puts what it did on results'''
+    os.chdir(directory)
+
+    from database import ConflictError, Database
+    from log import ROOT_LOGGER
+
+    log_counter = LogCounter()
+    logging.getLogger(ROOT_LOGGER).addHandler(log_counter)
+
+    db = Database()
+    user_id = db.authenticate(USER, PASSWORD).user_id
+    rng = random.Random(index)
+
+    stats = Counter()
+    mismatches = []
+    # (item id, new version) of every update that was saved
+    updates = []
+    added = []
+    deleted = []
+    read_times = []
+    write_times = []
+
+    def read_version(item_id: int) -> int | None:
+        rows = db.get_items_by_id((item_id,), ("version",))
+        return rows[0].version if rows else None
+
+    time.sleep(max(0.0, start_at - time.time()))
+    end = time.monotonic() + args.seconds
+
+    while time.monotonic() < end:
+        item_id = rng.randint(1, args.items)
+        choice = rng.random()
+        start = time.perf_counter()
+
+        if rng.random() >= args.write_ratio:
+            if choice < 0.6:
+                details = db.get_item_details(item_id)
+
+                if details is not None and details[0] != details[2]:
+                    mismatches.append(item_id)
+            elif choice < 0.9:
+                db.get_items_page(user_id, ("id", "item_name", "version"), item_id, 50)
+            else:
+                db.search_items(user_id, f"item {item_id}", 20)
+
+            read_times.append(time.perf_counter() - start)
+            continue
+
+        try:
+            if choice < UPDATE_SHARE:
+                version = read_version(item_id)
+
+                if version is None:
+                    stats["missing"] += 1
+                    continue
+
+                name = f"item {item_id} v{version + 1} by {index}"
+                new_version = db.update_item(item_id, name, "user", name, version)
+
+                if new_version is not None:
+                    updates.append((item_id, new_version))
+
+            elif choice < UPDATE_SHARE + DELETE_SHARE:
+                version = read_version(item_id)
+
+                if version is not None and db.delete_item(item_id, version):
+                    deleted.append(item_id)
+                else:
+                    stats["missing"] += 1
+
+            else:
+                name = f"new {index}-{len(added)}"
+                new_id = db.add_item(user_id, name, "user", name)
+
+                if new_id is not None:
+                    added.append(new_id)
+
+        except ConflictError:
+            stats["conflicts"] += 1
+
+        write_times.append(time.perf_counter() - start)
+
+    db.close()
+
+    results.put({
+        "stats": stats,
+        "mismatches": mismatches,
+        "updates": updates,
+        "added": added,
+        "deleted": deleted,
+        "read_times": read_times,
+        "write_times": write_times,
+        "errors": log_counter.errors,
+        "busy_retries": log_counter.busy_retries,
+    })
+
+
+def check_vault(items: int, reports: list[dict]) -> list[str]:
+    '''Compares the vault in the current directory with what the workers did, returns every problem found'''
+    from database import Database
+
+    problems = []
+    updates = [update for report in reports for update in report["updates"]]
+    added = [item_id for report in reports for item_id in report["added"]]
+    deleted = [item_id for report in reports for item_id in report["deleted"]]
+
+    for (item_id, version), count in Counter(updates).items():
+        if count > 1:
+            problems.append(f"{count} updates of item {item_id} were all saved as version {version}")
+
+    for item_id, count in Counter(deleted).items():
+        if count > 1:
+            problems.append(f"Item {item_id} was deleted {count} times")
+
+    for report in reports:
+        problems.extend(f"Item {item_id} had a password that doesn't match its name" for item_id in report["mismatches"])
+        problems.extend(f"Logged error: {error}" for error in report["errors"])
+
+    db = Database()
+    session = db.authenticate(USER, PASSWORD)
+    user_id = session.user_id
+
+    rows = {row.id: row for row in db.get_items_page(user_id, ("id", "item_name", "version"), 0, -1).rows}
+    expected_count = items + len(added) - len(deleted)
+
+    if len(rows) != expected_count:
+        problems.append(f"The vault has {len(rows)} items, it should have {expected_count}")
+
+    for item_id in deleted:
+        if item_id in rows:
+            problems.append(f"Item {item_id} was deleted but is still there")
+
+    versions = {}
+
+    for item_id, version in updates:
+        versions.setdefault(item_id, []).append(version)
+
+    for item_id, row in rows.items():
+        expected = [*range(2, row.version + 1)]
+
+        if sorted(versions.get(item_id, [])) != expected:
+            problems.append(f"Item {item_id} is on version {row.version} but had {len(versions.get(item_id, []))} updates")
+
+    item_changes = db.conn.execute("SELECT item_changes FROM users WHERE id=?", (user_id,)).fetchone()[0]
+    # Filling the vault added every item once
+    expected_changes = items + len(added) + len(deleted) + len(updates)
+
+    if item_changes != expected_changes:
+        problems.append(f"item_changes is {item_changes}, it should be {expected_changes}")
+
+    for item_id in rows:
+        details = db.get_item_details(item_id)
+
+        if details is None or details[0] != details[2]:
+            problems.append(f"Item {item_id} doesn't decrypt to its name")
+
+    integrity = db.conn.execute("PRAGMA integrity_check").fetchone()[0]
+
+    if integrity != "ok":
+        problems.append(f"integrity_check: {integrity}")
+
+    try:
+        db.conn.execute("INSERT INTO items_fts(items_fts) VALUES ('integrity-check')")
+    except Exception as e:
+        problems.append(f"The search index doesn't match the items: {e}")
+
+    db.close()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run several processes against one vault and check it stays consistent")
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--write-ratio", type=float, default=0.3)
+    parser.add_argument("--min-ops", type=float, default=None,
+                        help="Fail if fewer operations per second than this were done by all the processes together")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The database and vault key use paths relative to the working directory, keep both in the temporary one
+        os.chdir(directory)
+
+        try:
+            fill_vault(args.items)
+
+            # Spawned processes start clean instead of sharing the sqlite state of this one
+            context = multiprocessing.get_context("spawn")
+            results = context.Queue()
+            start_at = time.time() + START_DELAY
+
+            processes = [context.Process(target=worker, args=(index, directory, args, start_at, results))
+                         for index in range(args.processes)]
+
+            for process in processes:
+                process.start()
+
+            # Read before joining, a process doesn't exit while what it put on the queue is unread
+            reports = [results.get() for _ in processes]
+
+            for process in processes:
+                process.join()
+
+            problems = check_vault(args.items, reports)
+
+        finally:
+            os.chdir(cwd)
+
+    read_times = [t for report in reports for t in report["read_times"]]
+    write_times = [t for report in reports for t in report["write_times"]]
+    stats = sum((report["stats"] for report in reports), Counter())
+    busy_retries = sum(report["busy_retries"] for report in reports)
+    ops_per_s = (len(read_times) + len(write_times)) / args.seconds
+
+    print(f"{args.processes} processes for {args.seconds:g}s on {args.items:,} items, {args.write_ratio:.0%} writes")
+    print(f"  {ops_per_s:,.0f} operations/s  ({len(read_times) / args.seconds:,.0f} reads/s, "
+          f"{len(write_times) / args.seconds:,.0f} writes/s)")
+
+    if read_times:
+        print_result(summarise(args.items, "read", read_times))
+
+    if write_times:
+        print_result(summarise(args.items, "write", write_times))
+
+    print(f"  conflicts {stats['conflicts']}  already deleted {stats['missing']}  busy retries {busy_retries}")
+
+    for problem in problems:
+        print(f"FAIL: {problem}")
+
+    if args.min_ops is not None and ops_per_s < args.min_ops:
+        print(f"FAIL: {ops_per_s:,.0f} operations/s is fewer than {args.min_ops:,.0f}")
+        problems.append("throughput")
+
+    if problems:
+        raise SystemExit(1)
+
+    print("  vault is consistent")
+
+
+if __name__ == "__main__":
+    main()
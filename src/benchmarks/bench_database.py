@@ -0,0 +1,265 @@
+# Measures the Database methods and the crypto functions on synthetic vaults of different sizes
+#   $ python -m benchmarks.bench_database --sizes 1000 100000 1000000 --json results.json
+#   $ python -m benchmarks.bench_database --compare results.json
+#
+# Every vault is made in its own temporary database that is deleted afterwards
+#   ^ The vault key is created in the temporary directory too so the real one is never touched
+#   ^ Vaults are filled with executemany straight into the items table
+#     ^ A pool of pre encrypted passwords is reused so a million rows don't need a million encryptions
+#
+# Every operation is called many times and the p50, p90 and p99 latency and the throughput are printed
+# --json writes the results with the commit they were made on so two commits can be compared
+# --compare runs the benchmark and prints how much faster or slower each operation is than a saved run
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+WORDS = ["github", "gitlab", "google", "amazon", "bank", "mail", "work", "home",
+         "steam", "netflix", "router", "server", "aws", "azure", "slack"]
+
+# Number of different encrypted passwords the synthetic vaults are filled with
+DISTINCT_PASSWORDS = 1000
+
+# Number of rows inserted per transaction while filling a vault
+FILL_BATCH_SIZE = 10_000
+
+# Operations that read the whole vault or derive a key are only run this many times
+WHOLE_VAULT_SAMPLES = 3
+
+
+def percentile(sorted_times: list[float], percent: float) -> float:
+    '''Nearest rank percentile of an already sorted list'''
+    index = round(percent / 100 * (len(sorted_times) - 1))
+    return sorted_times[index]
+
+
+def summarise(size: int, operation: str, times: list[float], rows: int = 1) -> dict:
+    '''Turns the time of every call into the numbers that are printed and saved
+    rows is how many rows one call handles, used for the throughput'''
+    times = sorted(times)
+    total = sum(times)
+
+    return {
+        "size": size,
+        "operation": operation,
+        "samples": len(times),
+        "p50_ms": percentile(times, 50) * 1000,
+        "p90_ms": percentile(times, 90) * 1000,
+        "p99_ms": percentile(times, 99) * 1000,
+        "mean_ms": total / len(times) * 1000,
+        "rows_per_s": rows * len(times) / total if total > 0 else float("inf"),
+    }
+
+
+def time_calls(function, arguments) -> list[float]:
+    '''Calls the function once with each tuple of arguments and returns how long every call took'''
+    times = []
+
+    for args in arguments:
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def make_vault(directory: str, size: int):
+    '''Creates a database holding one user with size items
+    Returns the Database and the id of the user'''
+    from database import Database
+    from encrypt import encrypt
+
+    db = Database(os.path.join(directory, f"vault-{size}.sqlite"))
+    db.add_user("bench", "bench-password")
+    user_id = db.get_user_id("bench")
+
+    passwords = [encrypt(f"password-{i}") for i in range(DISTINCT_PASSWORDS)]
+
+    def rows(start: int, end: int):
+        for i in range(start, end):
+            name = f"{WORDS[i % len(WORDS)]} {WORDS[i // len(WORDS) % len(WORDS)]} {i}"
+            yield (user_id, name, f"user{i}@example.com", passwords[i % DISTINCT_PASSWORDS])
+
+    for start in range(0, size, FILL_BATCH_SIZE):
+        with db.conn:
+            db.conn.executemany(
+                "INSERT INTO items(user_id, item_name, username, password) VALUES (?, ?, ?, ?)",
+                rows(start, min(start + FILL_BATCH_SIZE, size)))
+
+    db.run_maintenance(analyze=True)
+    return db, user_id
+
+
+def bench_vault(directory: str, size: int, samples: int) -> list[dict]:
+    '''Runs every Database benchmark against a new vault with size items'''
+    start = time.perf_counter()
+    db, user_id = make_vault(directory, size)
+    print(f"\n{size:,} items (filled in {time.perf_counter() - start:.1f}s)")
+
+    random.seed(size)
+    ids = [row[0] for row in db.conn.execute("SELECT id FROM items WHERE user_id=?", (user_id,))]
+    some_ids = [(random.choice(ids),) for _ in range(samples)]
+    results = []
+
+    def record(operation: str, times: list[float], rows: int = 1):
+        result = summarise(size, operation, times, rows)
+        results.append(result)
+        print_result(result)
+
+    # Logging in unwraps the data key with a full key derivation so it only runs a few times
+    record("authenticate", time_calls(db.authenticate, [("bench", "bench-password")] * WHOLE_VAULT_SAMPLES))
+
+    record("count_items", time_calls(db.count_items, [(user_id,)] * samples))
+
+    # Cold reads go to the database and decrypt, warm reads come from the item cache
+    def cold_details(item_id):
+        db.clear_cache()
+        db.get_item_details(item_id)
+
+    record("get_item_details cold", time_calls(cold_details, some_ids))
+    record("get_item_details warm", time_calls(db.get_item_details, [some_ids[0]] * samples))
+
+    record("get_items_page", time_calls(
+        db.get_items_page, [(user_id, ("id", "item_name"), after_id - 1, 200) for (after_id,) in some_ids]), 200)
+
+    record("search_items", time_calls(
+        db.search_items, [(user_id, random.choice(WORDS)[:3], 50) for _ in range(samples)]))
+
+    record("get_all_items", time_calls(db.get_all_items, [(user_id,)] * WHOLE_VAULT_SAMPLES), size)
+
+    def walk_vault():
+        for _ in db.iter_items(user_id):
+            pass
+
+    record("iter_items", time_calls(walk_vault, [()] * WHOLE_VAULT_SAMPLES), size)
+
+    added = []
+
+    def add_item(i):
+        added.append(db.add_item(user_id, f"new item {i}", "new-user", "new-password"))
+
+    record("add_item", time_calls(add_item, [(i,) for i in range(samples)]))
+
+    record("update_item", time_calls(
+        db.update_item, [(item_id, "updated item", "new-user", "new-password") for item_id in added]))
+
+    record("delete_item", time_calls(db.delete_item, [(item_id,) for item_id in added]))
+
+    db.close()
+    return results
+
+
+def bench_crypto(samples: int) -> list[dict]:
+    '''Runs the encryption benchmarks, these don't depend on the size of the vault'''
+    from encrypt import decrpyt, decrypt_many, encrypt, encrypt_many
+
+    print("\ncrypto")
+    results = []
+
+    def record(operation: str, times: list[float], rows: int = 1):
+        result = summarise(0, operation, times, rows)
+        results.append(result)
+        print_result(result)
+
+    values = [(f"password-{i}",) for i in range(samples)]
+    record("encrypt", time_calls(encrypt, values))
+
+    tokens = [(encrypt(value),) for (value,) in values]
+    record("decrpyt", time_calls(decrpyt, tokens))
+
+    batch = [value for (value,) in values] * 10
+    record("encrypt_many", time_calls(lambda: list(encrypt_many(batch)), [()]), len(batch))
+
+    batch_tokens = list(encrypt_many(batch))
+    record("decrypt_many", time_calls(lambda: list(decrypt_many(batch_tokens)), [()]), len(batch))
+
+    return results
+
+
+def print_result(result: dict):
+    print(f"  {result['operation']:<24} p50 {result['p50_ms']:9.3f}ms  p90 {result['p90_ms']:9.3f}ms  "
+          f"p99 {result['p99_ms']:9.3f}ms  {result['rows_per_s']:>14,.0f} rows/s")
+
+
+def print_comparison(old: dict, new: dict):
+    '''Prints the p50 of every operation in both runs and how many times faster the new one is'''
+    old_results = {(result["size"], result["operation"]): result for result in old["results"]}
+
+    print(f"\nCompared with {old.get('commit') or 'the saved run'}")
+
+    for result in new["results"]:
+        before = old_results.get((result["size"], result["operation"]))
+
+        if before is None:
+            continue
+
+        speedup = before["p50_ms"] / result["p50_ms"] if result["p50_ms"] > 0 else float("inf")
+        print(f"  {result['size']:>9,} {result['operation']:<24} "
+              f"{before['p50_ms']:9.3f}ms -> {result['p50_ms']:9.3f}ms  {speedup:6.2f}x")
+
+
+def current_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Database methods and encryption on synthetic vaults")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000])
+    parser.add_argument("--samples", type=int, default=200,
+                        help="How many times every operation is called")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Compare against results saved with --json")
+    args = parser.parse_args()
+
+    output = {
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "results": [],
+    }
+
+    # Read before changing directory so relative paths still work
+    old = None
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    working_directory = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The key file is made relative to the working directory
+        os.chdir(directory)
+
+        try:
+            output["results"].extend(bench_crypto(args.samples))
+
+            for size in args.sizes:
+                output["results"].extend(bench_vault(directory, size, args.samples))
+
+        finally:
+            os.chdir(working_directory)
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(output, f, indent=2)
+
+    if old is not None:
+        print_comparison(old, output)
+
+
+if __name__ == "__main__":
+    main()
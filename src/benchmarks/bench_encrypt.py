@@ -0,0 +1,93 @@
+# Measures how the batch encryption functions scale with the number of workers
+#   $ python -m benchmarks.bench_encrypt --items 100000
+#
+# Prints the throughput for the plain one at a time functions
+# And for encrypt_many/decrypt_many with thread and process pools of 1 up to cpu_count workers
+#   ^ With the speedup over one worker, which should grow with the number of cores
+#   ^ --min-speedup fails the run if processes on --max-workers cores don't encrypt at least that much faster
+#
+# Then the time a small batch takes with every core, which should be as fast as one worker since no pool is started
+
+import argparse
+import os
+import time
+from encrypt import PROCESS_POOL_MIN_ITEMS, decrpyt, decrypt_many, encrypt, encrypt_many
+
+# Batch sizes of the small batch latency, a few items saved from the app up to just below the process pool size
+SMALL_BATCHES = (10, 1000, PROCESS_POOL_MIN_ITEMS)
+
+
+def throughput(count: int, seconds: float) -> str:
+    return f"{count / seconds:>12,.0f} items/s  ({seconds:.3f}s)"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the batch encryption functions")
+    parser.add_argument("--items", type=int, default=50_000)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--min-speedup", type=float, default=None,
+                        help="Fail if encrypt_many with --max-workers processes isn't this many times faster than one")
+    args = parser.parse_args()
+
+    data = [f"password-{i}" for i in range(args.items)]
+
+    start = time.perf_counter()
+    tokens = [encrypt(value) for value in data]
+    print(f"encrypt one at a time     {throughput(args.items, time.perf_counter() - start)}")
+
+    start = time.perf_counter()
+    [decrpyt(token) for token in tokens]
+    print(f"decrypt one at a time     {throughput(args.items, time.perf_counter() - start)}")
+
+    workers = 1
+    # Seconds encrypt_many took with one worker, by pool
+    single = {}
+    speedup = 1.0
+
+    while workers <= args.max_workers:
+        for use_processes in (False, True):
+            pool = "processes" if use_processes else "threads"
+
+            start = time.perf_counter()
+            tokens = list(encrypt_many(data, workers=workers, use_processes=use_processes))
+            seconds = time.perf_counter() - start
+            single.setdefault(pool, seconds)
+            print(f"encrypt_many {workers:>2} {pool:<9}  {throughput(args.items, seconds)}  "
+                  f"x{single[pool] / seconds:.2f}")
+
+            if use_processes and workers <= args.max_workers < workers * 2:
+                speedup = single[pool] / seconds
+
+            start = time.perf_counter()
+            result = list(decrypt_many(tokens, workers=workers, use_processes=use_processes))
+            print(f"decrypt_many {workers:>2} {pool:<9}  {throughput(args.items, time.perf_counter() - start)}")
+
+            assert result == data
+
+        workers *= 2
+
+    if (os.cpu_count() or 1) < 2:
+        print("Only one cpu, the speedup with more workers can't be measured here")
+
+    for size in SMALL_BATCHES:
+        batch = data[:size]
+
+        start = time.perf_counter()
+        list(encrypt_many(batch, workers=1))
+        inline = time.perf_counter() - start
+
+        start = time.perf_counter()
+        list(encrypt_many(batch, workers=args.max_workers))
+        pooled = time.perf_counter() - start
+
+        print(f"encrypt_many {len(batch):>6,} items  1 worker {inline * 1000:8.1f}ms  "
+              f"{args.max_workers} workers {pooled * 1000:8.1f}ms")
+
+    if args.min_speedup is not None and speedup < args.min_speedup:
+        print(f"FAIL: {args.max_workers} processes were x{speedup:.2f} faster than one, less than x{args.min_speedup:g}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# Compares the memory and construction time of the ways an item row can be held
+#   $ python -m benchmarks.bench_items --rows 1000000
+#
+# What is compared:
+#   ^ dataclass  the old Item, a @dataclass with a __dict__ per instance
+#   ^ slots      items.Item, a @dataclass(slots=True)
+#   ^ namedtuple the ItemRow rows of Database.get_items_page
+#   ^ tuple      plain sqlite rows, the smallest anything can be
+#
+# Memory is measured with tracemalloc around building the list from rows that already exist
+# So it only counts the objects themselves and not the strings they point to
+# Time is the median of building the list straight from a query on an in memory table
+
+import argparse
+import gc
+import sqlite3
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass
+from itertools import starmap
+
+from items import Item, item_row_type
+
+COLUMNS = ("id", "user_id", "item_name", "username", "password")
+
+
+# items.Item before slots=True, kept here to compare against
+@dataclass()
+class DictItem:
+    id: int
+    user_id: int
+    item_name: str
+    username: str
+    password: str
+
+
+def make_rows(count: int) -> list[tuple]:
+    return [(i, 1, f"item {i}", f"user{i}@example.com", f"token-{i}") for i in range(count)]
+
+
+def make_table(rows: list[tuple]) -> sqlite3.Connection:
+    conn = sqlite3.connect(":memory:")
+    conn.execute(f"CREATE TABLE items ({', '.join(COLUMNS)})")
+    conn.executemany("INSERT INTO items VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    return conn
+
+
+def builders():
+    '''Returns (name, build from rows, build from a cursor) for every representation
+    The cursor builders are the fastest way Database has of making each one'''
+    row_type = item_row_type(COLUMNS)
+
+    return [
+        ("dataclass", lambda rows: [DictItem(*row) for row in rows],
+         lambda cursor: [DictItem(*row) for row in cursor.fetchall()]),
+        ("slots", lambda rows: list(starmap(Item, rows)),
+         lambda cursor: list(starmap(Item, cursor))),
+        ("namedtuple", lambda rows: list(map(row_type._make, rows)),
+         lambda cursor: list(map(row_type._make, cursor))),
+        # tuple(row) would give back the same tuple so a new one is unpacked
+        ("tuple", lambda rows: [(*row,) for row in rows],
+         lambda cursor: cursor.fetchall()),
+    ]
+
+
+def measure_memory(build, rows: list[tuple]) -> int:
+    '''Returns the bytes allocated by building the list from rows'''
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        result = build(rows)
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    del result
+    return size
+
+
+def measure_time(build, conn: sqlite3.Connection, samples: int) -> float:
+    '''Returns the median seconds it takes to query the table and build the list'''
+    times = []
+
+    for _ in range(samples):
+        gc.collect()
+        start = time.perf_counter()
+        result = build(conn.execute(f"SELECT {', '.join(COLUMNS)} FROM items ORDER BY rowid"))
+        times.append(time.perf_counter() - start)
+        del result
+
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the memory and construction time of item row representations")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--samples", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    conn = make_table(rows)
+
+    print(f"{args.rows:,} rows")
+    baseline = None
+
+    for name, from_rows, from_cursor in builders():
+        memory = measure_memory(from_rows, rows)
+        seconds = measure_time(from_cursor, conn, args.samples)
+
+        if baseline is None:
+            baseline = (memory, seconds)
+
+        print(f"  {name:<11} {memory / args.rows:7.1f} bytes/row  {memory / 1024 ** 2:8.1f} MiB  "
+              f"{seconds * 1000:8.0f}ms  ({memory / baseline[0]:.2f}x memory, {seconds / baseline[1]:.2f}x time)")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
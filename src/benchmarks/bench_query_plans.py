@@ -0,0 +1,146 @@
+# Checks that the Database read methods still use the item indexes made by migrations.py
+#   $ python -m benchmarks.bench_query_plans
+#
+# Every method is called once on a vault of --items items shared by USERS users that has been ANALYZEd
+#   ^ With a single user every row matches user_id, so sqlite rightly walks the rowid for get_items_page instead
+#   ^ The statements it runs are recorded with a trace callback, which gets them with the values filled in
+#   ^ Every statement that reads items is run again with EXPLAIN QUERY PLAN
+#
+# A method fails if one of its plans reads items
+#   ^ without an index (SCAN items, or a search through the rowid)
+#   ^ with an index other than the ones it is expected to use
+#   ^ or sorts the rows itself (USE TEMP B-TREE) instead of reading them in index order
+#
+# The run exits with 1 if any method fails, use it to guard against regressions
+
+import argparse
+import os
+import re
+import tempfile
+
+from benchmarks.bench_database import make_vault
+
+# Number of users the items are shared between, the checked user has an even share
+USERS = 5
+
+# A step of a plan that reads the items table itself, not items_fts
+ITEMS_STEP = re.compile(r"\b(SCAN|SEARCH) items\b(?!_)")
+READS_ITEMS = re.compile(r"\b(FROM|JOIN) items\b(?!_)")
+INDEX_USED = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+
+
+def checks(user_id: int, folder_id: int):
+    '''Returns (name, call, the indexes the plan may use) for every read method that is checked'''
+    return [
+        ("get_all_items", lambda db: db.get_all_items(user_id), {"idx_items_user_id"}),
+        ("get_all_items_names", lambda db: db.get_all_items_names(user_id), {"idx_items_user_id"}),
+        ("get_item_id", lambda db: db.get_item_id(user_id, "github github 0"), {"idx_items_user_name"}),
+        ("find_items", lambda db: db.find_items(user_id, "github github 0"), {"idx_items_user_name"}),
+        ("get_items_page", lambda db: db.get_items_page(user_id, ("id", "item_name"), 100, 50),
+         {"idx_items_user_id"}),
+        ("get_items_page folder", lambda db: db.get_items_page(user_id, ("id", "item_name"), 0, 50, folder_id),
+         {"idx_items_user_folder"}),
+        # Counting only needs the user_id so either index covers it
+        ("count_items", lambda db: db.count_items(user_id), {"idx_items_user_id", "idx_items_user_name"}),
+        ("count_items folder", lambda db: db.count_items(user_id, folder_id), {"idx_items_user_folder"}),
+        ("get_item_id_at", lambda db: db.get_item_id_at(user_id, 500), {"idx_items_user_id"}),
+    ]
+
+
+def traced_statements(db, call) -> list[str]:
+    '''Runs call and returns the statements it ran that read items'''
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+
+    try:
+        call(db)
+    finally:
+        db.conn.set_trace_callback(None)
+
+    return [statement for statement in statements
+            if statement.lstrip().upper().startswith(("SELECT", "WITH")) and READS_ITEMS.search(statement)]
+
+
+def plan_problems(db, statement: str, allowed: set[str]) -> tuple[list[str], list[str]]:
+    '''Returns the plan of the statement and what is wrong with it'''
+    plan = [row[3] for row in db.conn.execute(f"EXPLAIN QUERY PLAN {statement}")]
+    problems = []
+
+    for step in plan:
+        if step.startswith("USE TEMP B-TREE"):
+            problems.append(f"sorts the rows itself: {step}")
+            continue
+
+        if not ITEMS_STEP.search(step):
+            continue
+
+        index = INDEX_USED.search(step)
+
+        if index is None:
+            problems.append(f"reads items without an index: {step}")
+        elif index.group(1) not in allowed:
+            problems.append(f"uses {index.group(1)} instead of {' or '.join(sorted(allowed))}: {step}")
+
+    return plan, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fail if a Database read method stops using the item indexes")
+    parser.add_argument("--items", type=int, default=10_000)
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    failed = False
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The vault key is made relative to the working directory, keep it in the temporary one
+        os.chdir(directory)
+
+        try:
+            db, user_id = make_vault(directory, args.items)
+
+            # Hand the items out between the users so user_id narrows the rows down like in a shared vault
+            for other in range(1, USERS):
+                db.add_user(f"other {other}", "other-password")
+
+            for other in range(1, USERS):
+                db.conn.execute("UPDATE items SET user_id=? WHERE id % ? = ?",
+                                (db.get_user_id(f"other {other}"), USERS, other))
+
+            db.conn.commit()
+
+            # Half the items of the user in a folder so the folder plans have something to choose between
+            folder_id = db.add_folder(user_id, "folder")
+            db.conn.execute("UPDATE items SET folder_id=? WHERE user_id=? AND id % 2 = 0", (folder_id, user_id))
+            db.conn.commit()
+            db.run_maintenance(analyze=True)
+
+            for name, call, allowed in checks(user_id, folder_id):
+                statements = traced_statements(db, call)
+
+                if not statements:
+                    print(f"FAIL: {name} ran no query on items")
+                    failed = True
+                    continue
+
+                for statement in statements:
+                    plan, problems = plan_problems(db, statement, allowed)
+                    print(f"{'FAIL' if problems else 'ok':<5} {name:<22} {' / '.join(plan)}")
+
+                    for problem in problems:
+                        print(f"      {problem}")
+
+                    failed = failed or bool(problems)
+
+            db.close()
+
+        finally:
+            os.chdir(cwd)
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# Measures how long the search index takes per keystroke
+#   $ python -m benchmarks.bench_search --items 100000
+#
+# Builds a TrigramIndex from random item names and then types a few queries one letter at a time
+# Prints the build time and the slowest and average time of a keystroke, with the query the slowest one typed
+
+import argparse
+import random
+import string
+import time
+from search import TrigramIndex
+
+WORDS = ["github", "gitlab", "google", "amazon", "bank", "mail", "work", "home",
+         "steam", "netflix", "router", "server", "aws", "azure", "slack"]
+
+QUERIES = ["github", "bank mail", "hub", "netflx", "server wo", "zq"]
+
+
+def random_name() -> str:
+    suffix = "".join(random.choices(string.ascii_lowercase, k=5))
+    return f"{random.choice(WORDS)} {random.choice(WORDS)} {suffix}"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark search as you type")
+    parser.add_argument("--items", type=int, default=100_000)
+    parser.add_argument("--limit", type=int, default=500)
+    args = parser.parse_args()
+
+    random.seed(0)
+    items = [(item_id, random_name()) for item_id in range(args.items)]
+
+    start = time.perf_counter()
+    index = TrigramIndex(items)
+    print(f"build {args.items} items   {time.perf_counter() - start:.3f}s")
+
+    timings = []
+
+    for query in QUERIES:
+        for length in range(1, len(query) + 1):
+            start = time.perf_counter()
+            index.search(query[:length], args.limit)
+            timings.append((time.perf_counter() - start, query[:length]))
+
+    print(f"keystrokes          {len(timings)}")
+    slowest, slowest_query = max(timings)
+    print(f"average keystroke   {sum(seconds for seconds, _ in timings) / len(timings) * 1000:.3f}ms")
+    print(f"slowest keystroke   {slowest * 1000:.3f}ms  ({slowest_query!r})")
+
+
+if __name__ == "__main__":
+    main()
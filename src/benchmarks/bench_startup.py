@@ -0,0 +1,119 @@
+# Measures how long the app takes to start and draw the login page
+#   $ python -m benchmarks.bench_startup --runs 10 --max-ms 500
+#
+# Every run starts a fresh interpreter in an empty temporary directory and times
+#   ^ import    importing main.py and everything it pulls in
+#   ^ paint     from the interpreter starting to the login page being drawn
+#   ^ total     from starting the process to it reporting the paint, includes interpreter startup
+#
+# It also fails if a module that should only be loaded after logging in is imported by main.py
+# --max-ms fails the run if the median total is slower, use it to guard against regressions
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Modules that must not be imported before the login page is shown
+DEFERRED_MODULES = ["cryptography", "database", "encrypt", "gui.main_page"]
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process, prints one line of json once the login page is drawn
+CHILD = """
+import time
+started = time.perf_counter()
+
+import asyncio
+import json
+import sys
+from main import ArcanumApp
+from gui.login import LoginPage
+
+imported = time.perf_counter()
+loaded = [name for name in {deferred!r} if name in sys.modules]
+
+
+async def measure():
+    app = ArcanumApp()
+
+    async with app.run_test() as pilot:
+        while not isinstance(app.screen, LoginPage):
+            await pilot.pause()
+
+        # Wait for the screen to be drawn
+        await pilot.pause()
+        painted = time.perf_counter()
+
+        print(json.dumps({{
+            "import": imported - started,
+            "paint": painted - started,
+            "loaded": loaded,
+        }}), flush=True)
+
+
+asyncio.run(measure())
+"""
+
+
+def run_once() -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, PYTHONPATH=SRC_DIR)
+
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-c", CHILD.format(deferred=DEFERRED_MODULES)],
+            cwd=directory, env=env, stdout=subprocess.PIPE, text=True)
+
+        line = process.stdout.readline()
+        total = time.perf_counter() - start
+
+        process.wait()
+
+    if not line:
+        raise SystemExit("The app exited before drawing the login page")
+
+    result = json.loads(line)
+    result["total"] = total
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the time it takes to show the login page")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="Fail if the median total time is slower than this")
+    args = parser.parse_args()
+
+    # The first run warms the disk cache and isn't counted
+    run_once()
+    results = [run_once() for _ in range(args.runs)]
+
+    for name in ("import", "paint", "total"):
+        times = sorted(result[name] * 1000 for result in results)
+        print(f"{name:<8} median {statistics.median(times):7.1f}ms   min {times[0]:7.1f}ms   max {times[-1]:7.1f}ms")
+
+    failed = False
+    loaded = sorted({name for result in results for name in result["loaded"]})
+
+    if loaded:
+        print(f"FAIL: imported before the login page was shown: {', '.join(loaded)}")
+        failed = True
+
+    median_total = statistics.median(result["total"] * 1000 for result in results)
+
+    if args.max_ms is not None and median_total > args.max_ms:
+        print(f"FAIL: median total {median_total:.1f}ms is slower than {args.max_ms:.1f}ms")
+        failed = True
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# This file holds a small in memory cache used to avoid repeating slow work
+# Entries expire after a time to live and the least recently used entry is dropped when the cache is full
+#
+# The database uses it to keep recently viewed decrypted items
+# So switching between items doesn't run another query or decryption
+# clear() drops every entry and should be called whenever a session ends
+
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    '''A bounded least recently used cache where every entry expires after ttl seconds'''
+
+    def __init__(self, max_size: int = 256, ttl: float = 300, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+
+        # Maps a key to (expiry time, value), the oldest used entry is first
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        '''Returns the value for the key or default if it is missing or expired'''
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return default
+
+        expires_at, value = entry
+
+        if expires_at <= self.clock():
+            del self.entries[key]
+            return default
+
+        # Mark it as the most recently used
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        '''Adds or replaces the value for the key'''
+        self.entries[key] = (self.clock() + self.ttl, value)
+        self.entries.move_to_end(key)
+
+        # Drop the least recently used entries once we are over the limit
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        '''Removes the key from the cache if it is there'''
+        self.entries.pop(key, None)
+
+    def keys(self):
+        '''Returns a list of the keys in the cache, expired entries may still be included'''
+        return list(self.entries)
+
+    def clear(self):
+        '''Removes every entry from the cache'''
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
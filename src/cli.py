@@ -0,0 +1,307 @@
+# This file is a command line interface to the vault for scripts, it never loads the Textual app
+#   $ python ./cli.py --user bob get github --field password
+#   $ python ./cli.py --user bob list
+#   $ python ./cli.py --user bob search git
+#   $ echo hunter2 | python ./cli.py --user bob add github --username bob --password-stdin
+#   $ python ./cli.py --user bob delete 42
+#   $ python ./cli.py --user bob import passwords.csv
+#   $ python ./cli.py --user bob export backup.arcanum
+#
+# Output:
+#   ^ get, add, delete, import and export print one JSON object
+#   ^ list and search print one JSON object per line so large vaults can be streamed
+#   ^ get --field prints only that value so it can be used in $(...)
+#   ^ Errors are printed to stderr as {"error": "..."} with one of the EXIT_ codes below
+#
+# The master password is read from ARCANUM_PASSWORD or asked for on the terminal
+# The user can also come from ARCANUM_USER and the export passphrase from ARCANUM_EXPORT_PASSPHRASE
+#
+# Start up is kept short for scripts:
+#   ^ Only argparse, json and os are imported before the arguments are read
+#   ^ The database and crypto are imported once a command needs them
+#   ^ Logging in still costs one key derivation, that is how the master password is checked
+#     ^ Use agent.py to pay for it once when running many lookups
+
+import argparse
+import json
+import os
+import sys
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+# argparse exits with 2 for bad arguments
+EXIT_LOGIN_FAILED = 3
+EXIT_NOT_FOUND = 4
+
+# Rows read per query by list
+PAGE_SIZE = 1000
+
+ITEM_FIELDS = ("item_name", "username", "password")
+
+
+class CommandError(Exception):
+    '''Raised by a command to stop with an error message and exit code'''
+
+    def __init__(self, message: str, exit_code: int = EXIT_ERROR):
+        super().__init__(message)
+        self.exit_code = exit_code
+
+
+def print_json(value):
+    sys.stdout.write(json.dumps(value) + "\n")
+
+
+def read_secret(variable: str, prompt: str) -> str:
+    '''Returns the environment variable or asks for it on the terminal without echoing it'''
+    value = os.environ.get(variable)
+
+    if value is not None:
+        return value
+
+    return prompt_secret(prompt)
+
+
+def prompt_secret(prompt: str) -> str:
+    '''Asks for a secret on the terminal without echoing it
+    Without a terminal (or on Ctrl+C/Ctrl+D) it fails with a CommandError instead of a traceback'''
+    import getpass
+
+    try:
+        return getpass.getpass(prompt)
+
+    except (EOFError, KeyboardInterrupt):
+        raise CommandError(f"No input for the prompt {prompt.strip()!r}")
+
+
+def log_in(db, user_name: str | None, unlock: bool):
+    '''Returns the Session of the user, unlock=False doesn't keep their data key'''
+    user_name = user_name or os.environ.get("ARCANUM_USER")
+
+    if not user_name:
+        raise CommandError("No user given, pass --user or set ARCANUM_USER")
+
+    session = db.authenticate(user_name, read_secret("ARCANUM_PASSWORD", "Master password: "), unlock=unlock)
+
+    if session is None:
+        raise CommandError("Incorrect username or password", EXIT_LOGIN_FAILED)
+
+    return session
+
+
+def find_item(db, user_id: int, item: str) -> int:
+    '''Returns the id of the users item given by id or by exact name'''
+    if item.isdigit():
+        if db.get_item_owner(int(item)) != user_id:
+            raise CommandError(f"No item with the id {item}", EXIT_NOT_FOUND)
+
+        return int(item)
+
+    item_ids = db.find_items(user_id, item)
+
+    if not item_ids:
+        raise CommandError(f"No item named {item!r}", EXIT_NOT_FOUND)
+
+    if len(item_ids) > 1:
+        raise CommandError(f"{len(item_ids)} items are named {item!r}, use one of the ids {item_ids}")
+
+    return item_ids[0]
+
+
+def command_get(db, session, args):
+    item_id = find_item(db, session.user_id, args.item)
+    details = db.get_item_details(item_id)
+
+    if details is None:
+        raise CommandError(f"Item {item_id} could not be decrypted")
+
+    item = {"id": item_id, **dict(zip(ITEM_FIELDS, details))}
+
+    if args.field:
+        sys.stdout.write(f"{item[args.field]}\n")
+    else:
+        print_json(item)
+
+
+def command_list(db, session, args):
+    columns = ("id", "item_name", "username", "folder_id")
+    after_id = 0
+
+    while after_id is not None:
+        page = db.get_items_page(session.user_id, columns, after_id, PAGE_SIZE, args.folder_id)
+
+        for row in page.rows:
+            print_json(row._asdict())
+
+        after_id = page.next_cursor
+
+
+def command_search(db, session, args):
+    for item_id, item_name, username in db.search_items(session.user_id, args.query, args.limit):
+        print_json({"id": item_id, "item_name": item_name, "username": username})
+
+
+def command_add(db, session, args):
+    if args.password_stdin:
+        password = sys.stdin.readline().rstrip("\n")
+    else:
+        password = prompt_secret("Item password: ")
+
+    # Same check as Database.move_items, an item must never land in a folder of another user
+    if args.folder_id is not None and db.get_folder_owner(args.folder_id) != session.user_id:
+        raise CommandError(f"No folder with the id {args.folder_id}", EXIT_NOT_FOUND)
+
+    item_id = db.add_item(session.user_id, args.name, args.username, password, args.folder_id)
+
+    if item_id is None:
+        raise CommandError("The item could not be added")
+
+    print_json({"id": item_id})
+
+
+def command_delete(db, session, args):
+    item_id = find_item(db, session.user_id, args.item)
+
+    # Another process can delete it between find_item and here
+    if not db.delete_item(item_id):
+        raise CommandError(f"No item with the id {item_id}", EXIT_NOT_FOUND)
+
+    print_json({"deleted": item_id})
+
+
+def command_import(db, session, args):
+    import exporter
+
+    # Backups made by export start with the export magic, anything else is read by importer.py
+    with open(args.file, "rb") as f:
+        is_backup = f.read(len(exporter.MAGIC)) == exporter.MAGIC
+
+    try:
+        if is_backup:
+            passphrase = read_secret("ARCANUM_EXPORT_PASSPHRASE", "Export passphrase: ")
+            imported = exporter.import_vault(db, session.user_id, args.file, passphrase,
+                                             batch_size=args.batch_size)
+        else:
+            import importer
+
+            try:
+                imported = importer.import_file(db, session.user_id, args.file, batch_size=args.batch_size)
+            except (importer.ImportFileError, ValueError) as e:
+                raise CommandError(f"Import failed: {e}")
+
+    except exporter.ExportFileError as e:
+        raise CommandError(f"Import failed: {e}")
+
+    print_json({"imported": imported})
+
+
+def command_export(db, session, args):
+    import exporter
+
+    passphrase = read_secret("ARCANUM_EXPORT_PASSPHRASE", "Export passphrase: ")
+
+    try:
+        exported = exporter.export_vault(db, session.user_id, args.file, passphrase)
+    except exporter.ExportFileError as e:
+        raise CommandError(f"Export failed: {e}")
+
+    print_json({"exported": exported})
+
+
+# The function of every command and whether it needs the data key of the user
+COMMANDS = {
+    "get": (command_get, True),
+    "list": (command_list, False),
+    "search": (command_search, False),
+    "add": (command_add, True),
+    "delete": (command_delete, False),
+    "import": (command_import, True),
+    "export": (command_export, True),
+}
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Read and change the vault from scripts, output is JSON")
+    parser.add_argument("--user", help="The user to log in as, defaults to ARCANUM_USER")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    get = commands.add_parser("get", help="Print an item with its password")
+    get.add_argument("item", help="The id or exact name of the item")
+    get.add_argument("--field", choices=ITEM_FIELDS, help="Only print this value")
+
+    list_items = commands.add_parser("list", help="Print every item without passwords")
+    list_items.add_argument("--folder-id", type=int, help="Only list the items in this folder")
+
+    search = commands.add_parser("search", help="Search item names and usernames")
+    search.add_argument("query")
+    search.add_argument("--limit", type=int, default=50)
+
+    add = commands.add_parser("add", help="Add an item and print its id")
+    add.add_argument("name")
+    add.add_argument("--username", default="")
+    add.add_argument("--folder-id", type=int)
+    add.add_argument("--password-stdin", action="store_true",
+                     help="Read the password from the first line of stdin instead of asking for it")
+
+    delete = commands.add_parser("delete", help="Delete an item")
+    delete.add_argument("item", help="The id or exact name of the item")
+
+    import_items = commands.add_parser("import", help="Import a .csv, .json or .jsonl file or an export")
+    import_items.add_argument("file")
+    import_items.add_argument("--batch-size", type=int, default=1000)
+
+    export = commands.add_parser("export", help="Export the vault to an encrypted file")
+    export.add_argument("file")
+
+    return parser
+
+
+def run(args) -> int:
+    # database imports sqlite3 anyway
+    import sqlite3
+    from database import Database
+
+    function, needs_data_key = COMMANDS[args.command]
+    db = None
+
+    try:
+        # Opening the vault migrates it, a locked or corrupt file fails here
+        db = Database()
+        session = log_in(db, args.user, unlock=needs_data_key)
+        function(db, session, args)
+
+    except CommandError as e:
+        sys.stderr.write(json.dumps({"error": str(e)}) + "\n")
+        return e.exit_code
+
+    except BrokenPipeError:
+        raise
+
+    except (OSError, sqlite3.Error) as e:
+        sys.stderr.write(json.dumps({"error": str(e)}) + "\n")
+        return EXIT_ERROR
+
+    finally:
+        if db is not None:
+            db.close()
+
+    return EXIT_OK
+
+
+def main():
+    args = make_parser().parse_args()
+
+    try:
+        exit_code = run(args)
+        sys.stdout.flush()
+
+    except BrokenPipeError:
+        # The reader went away (e.g. | head), stop quietly without a traceback on exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        exit_code = EXIT_ERROR
+
+    raise SystemExit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
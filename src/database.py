@@ -10,8 +10,8 @@
 # 2 - get_username (Added)
 #   ^ This function will take a user id and return the username of that user
 #
-# 3 - get_password (Added)
-#   ^ This method will take a id and then return the password or an error
+# 3 - get_password (Removed)
+#   ^ Master passwords are no longer stored in a form that can be decrypted, see 22
 #
 # 4 - delete_user (Added)
 #   ^ This function will take a id and delete a user
@@ -35,91 +35,357 @@
 # 8 - is_user_exists (Added)
 #   ^ This function will return true if the user is found false if the user doesnt exists
 #
+# 9 - authenticate (Added)
+#   ^ Takes a user_name and password and checks them with a single query
+#   ^ Returns a Session for the user or None if the details are wrong
+#
+# 10 - Schema migrations (Added)
+#   ^ The tables and indexes are created by migrations.py
+#   ^ Older database files are upgraded in place when they are opened
+#
+# 11 - add_items (Added)
+#   ^ Bulk version of add_item used for imports
+#   ^ Inserts the items in batches with one transaction per batch
+#
+# 12 - iter_items (Added)
+#   ^ Generator version of get_all_items used for exports
+#   ^ Yields the items of a user in chunks so the vault is never fully in memory
+#
+# 13 - run_maintenance (Added)
+#   ^ Runs ANALYZE, PRAGMA optimize and an incremental vacuum
+#   ^ The connection settings themselves live in storage.py
+#
+# 14 - update_item (Added)
+#   ^ Takes an item id and replaces its name, username and password
+#
+# 15 - Item cache (Added)
+#   ^ get_item_details keeps recently viewed decrypted items in a TTL/LRU cache
+#   ^ Editing or deleting an item removes it, clear_cache empties it when a session ends
+#
+# 16 - get_item_names_page (Removed)
+#   ^ The item list reads its (id, item_name) rows with get_items_page, see 19
+#   ^ count_items and get_item_id_at help the list size itself and jump to a page
+#
+# 17 - subscribe (Added)
+#   ^ Adding, deleting and updating items publishes an event from events.py
+#   ^ Callbacks passed to subscribe get every event after it is committed
+#
+# 18 - search_items (Added)
+#   ^ Full text search over item names and usernames using the FTS5 index from migrations.py
+#   ^ Every word of the query matches as a prefix, results are ordered by BM25
+#
+# 19 - get_items_page (Added)
+#   ^ Keyset paginated reader that only selects the columns asked for
+#   ^ Returns an ItemPage of compact named tuple rows and the cursor of the next page
+#   ^ iter_item_pages walks a whole vault with it one page at a time
+#
+# 20 - set_sql_tracing (Added)
+#   ^ Counts the statements the connection runs, see instrumentation.py
+#   ^ The method timings themselves are turned on with instrumentation.enable()
+#
+# 21 - Folders (Added)
+#   ^ add_folder, rename_folder, delete_folder, get_folders and move_items
+#   ^ Folders can hold folders, get_subfolder_ids and count_items_in_subtree walk the tree with a recursive query
+#   ^ Every folder keeps a count of its items that triggers update, so counts never scan the items
+#   ^ count_items, get_items_page and get_item_id_at take a folder_id to only read one folder
+#
+# 22 - Per user data keys (Added)
+#   ^ Every user has a data key their items are encrypted with, wrapped by a key derived from their master password
+#   ^ authenticate unwraps it once and keeps it in data_keys until lock_user, so the key derivation runs once per session
+#   ^ Unwrapping it is also how the master password is checked, only users.data_key depends on the password
+#     ^ Users from before data keys are checked against their old encrypted password the first time they log in
+#     ^ That copy is blanked in the same write that saves their new data key
+#   ^ Items from before a user had a data key still decrypt with the vault key until rotation.py moves them over
+#
+# 23 - find_items (Added)
+#   ^ Takes a user id and an item name and returns the ids of the items with exactly that name
+#   ^ Used by cli.py to look items up by name
+#
+# 24 - Sharing the vault between processes (Added)
+#   ^ Every write runs through write, which takes the write lock up front and tries again with backoff while it is busy
+#   ^ Items have a version, update_item and delete_item raise a ConflictError if the version given is out of date
+#   ^ check_external_changes notices commits from other connections, drops the item cache and tells the app to reload
+#
 
+import hmac
 import sqlite3
-from encrypt import decrpyt, encrypt
-from items import Item
+import time
+from itertools import islice, starmap
+from cryptography.fernet import InvalidToken
+from encrypt import decrpyt, encrypt, encrypt_field, forget_data_key, new_data_key, unwrap_data_key, wrap_data_key
+from items import FolderRow, Item, ItemPage, item_row_type
+from migrations import migrate
+from session import Session
+from storage import StorageProfile, busy_delays, connect, get_profile, is_busy
+from cache import TTLCache
+from events import EventBus, FoldersChanged, ItemsAdded, ItemsDeleted, ItemsMoved, ItemsUpdated
+import instrumentation
+from log import get_logger
 import os
 
+logger = get_logger(__name__)
+
 # Location of our database file
 DATABASE_FILE = "./data/userData.sqlite"
 DIR_PATH = "./data/"
 
 
-def check_data_directory():
-    os.makedirs(DIR_PATH, exist_ok=True)
+# How many decrypted items are kept in memory and for how many seconds
+ITEM_CACHE_SIZE = 256
+ITEM_CACHE_TTL = 300
+
+
+# BM25 weights of the item_name and username columns, a match in the name counts for more
+SEARCH_WEIGHTS = (10.0, 1.0)
+
+
+class ConflictError(Exception):
+    '''Raised when an item was changed or deleted by another connection since the version passed in was read'''
+
+    def __init__(self, item_id: int, version: int | None):
+        if version is None:
+            message = f"Item {item_id} was deleted by someone else"
+        else:
+            message = f"Item {item_id} was changed by someone else, it is now on version {version}"
+
+        super().__init__(message)
+        self.item_id = item_id
+        # The version the item is on now, None if it was deleted
+        self.version = version
+
+
+def check_data_directory(database_file: str = DATABASE_FILE):
+    os.makedirs(os.path.dirname(database_file) or DIR_PATH, exist_ok=True)
+
+
+def folder_filter(folder_id: int | None):
+    '''Returns the extra WHERE condition and its arguments for only reading the items in a folder
+    None means every item of the user no matter what folder it is in'''
+    if folder_id is None:
+        return "", ()
+
+    return " AND folder_id=?", (folder_id,)
+
+
+def make_match_query(query: str) -> str:
+    '''Turns what the user typed into an FTS5 query where every word matches as a prefix
+    Each word is quoted so characters like - : or * are searched for instead of read as syntax'''
+    words = query.split()
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
 
 
 class Database:
 
     # Connects and sets up our database
-    def __init__(self):
+    def __init__(self, database_file: str = DATABASE_FILE, profile: StorageProfile | None = None):
+        # The connection settings, see storage.py
+        self.profile = profile if profile is not None else get_profile()
+
+        # Recently viewed decrypted items keyed by item id
+        # Cleared by clear_cache whenever a session ends
+        self.item_cache = TTLCache(ITEM_CACHE_SIZE, ITEM_CACHE_TTL)
+
+        # Sends out an event every time items are added, deleted or updated, see events.py
+        self.events = EventBus()
+
+        # The unwrapped data key of every user logged in through this connection keyed by user id
+        # Filled in by authenticate and emptied by lock_user
+        self.data_keys = {}
+
         # Connects to our database creates the file if it doesn't exist
         try:
-            check_data_directory()
+            check_data_directory(database_file)
             # Update this so it checks that the data directory exists
             # Or setup some build system
-            self.conn = sqlite3.connect(DATABASE_FILE)
+            self.conn = connect(database_file, self.profile)
 
         except sqlite3.Error as e:
-            print("Database Error: ", e)
+            logger.error("Database error: %s", e)
+            # There is nothing to work with without a connection, let the caller report it
+            raise
 
         cursor = self.conn.cursor()
         cursor.execute("PRAGMA foreign_keys = ON")
+        cursor.close()
 
-        # Create the users table
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_name TEXT NOT NULL UNIQUE,
-                    password TEXT NOT NULL
-                )
-                """)
-
-        # Create the items table, with a foreign key to users
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    item_name TEXT NOT NULL,
-                    username TEXT,
-                    password TEXT,
-                    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-                )
-                """)
+        # Creates the tables and indexes or upgrades an older database file
+        migrate(self.conn)
 
-        cursor.close()
+        # PRAGMA data_version changes whenever another connection commits
+        # The value check_external_changes and drop_stale_cache last saw, each keeps its own
+        self.data_version = self.get_data_version()
+        self.cache_data_version = self.data_version
+        # The item_changes of every user the last time check_external_changes looked, keyed by user id
+        self.item_changes = {}
+        # Changes made through this connection aren't external ones
+        self.events.subscribe(self.note_own_changes)
 
-    # Find a way to handle when a user exists
-    # This will add a user to the database
-    def add_user(self, user_name: str, password: str):
+    def write(self, transaction):
         '''
-        This function adds a new user to the database
-        This function automatically encrypts the users password
+        This function runs transaction(cursor) inside an IMMEDIATE transaction, commits it and returns what it returned
+        The write lock is taken before anything is read so nothing can change between reading and writing
+        If another process holds the lock for longer than busy_timeout the whole transaction is run again
+        with the waits from storage.busy_delays in between, so transaction must be safe to run twice
+        Anything transaction raises rolls it back and is raised again, ConflictError included
         '''
-        # Our insert Statement to add users
-        sql_statment = ''' INSERT INTO users(user_name, password)
-                            VALUES(?,?)'''
+        cursor = self.conn.cursor()
+
+        try:
+            for delay in busy_delays(self.profile):
+                try:
+                    cursor.execute("BEGIN IMMEDIATE")
+
+                    try:
+                        result = transaction(cursor)
+                        self.conn.commit()
+                        return result
+
+                    except BaseException:
+                        self.conn.rollback()
+                        raise
+
+                except sqlite3.OperationalError as e:
+                    if delay is None or not is_busy(e):
+                        raise
+
+                    logger.warning("Database is busy, trying again in %.0fms", delay * 1000)
+                    time.sleep(delay)
+
+        finally:
+            cursor.close()
+
+    def get_data_version(self) -> int:
+        '''Returns a number that changes every time another connection commits to the database file
+        Commits made through this connection leave it as it is'''
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def drop_stale_cache(self):
+        '''Empties the item cache if another connection committed since the last check
+        Another process (or another Database in this one) may have changed or deleted the cached items'''
+        data_version = self.get_data_version()
+
+        if data_version != self.cache_data_version:
+            self.cache_data_version = data_version
+            self.item_cache.clear()
+
+    def note_own_changes(self, event):
+        '''Moves the item_changes check_external_changes compares against past a change made through this connection
+        It is left alone if another connection committed since the last check, so that change is still noticed'''
+        if event.user_id not in self.item_changes:
+            return
+
+        try:
+            if self.get_data_version() != self.data_version:
+                return
 
-        # Create cursor
+            result = self.conn.execute('''SELECT item_changes FROM users WHERE id=?''', (event.user_id,)).fetchone()
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            return
+
+        if result is not None:
+            self.item_changes[event.user_id] = result[0]
+
+    def check_external_changes(self, user_id: int | None = None) -> bool:
+        '''
+        This function returns True if another connection changed the items of the user since the last call
+        The app calls it on a timer and reloads its items when it returns True
+        Re-encrypting passwords (rotation.py) doesn't count as a change as it leaves the versions alone
+        Without a user_id it returns True for any commit from another connection
+        It only reads a counter in memory unless another connection has committed, so it is cheap to call often
+        '''
+        try:
+            data_version = self.get_data_version()
+
+            if data_version == self.data_version:
+                return False
+
+            self.data_version = data_version
+
+            if user_id is None:
+                return True
+
+            result = self.conn.execute('''SELECT item_changes FROM users WHERE id=?''', (user_id,)).fetchone()
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            return False
+
+        # The user was deleted
+        item_changes = result[0] if result is not None else None
+
+        if self.item_changes.get(user_id) == item_changes:
+            return False
+
+        self.item_changes[user_id] = item_changes
+        return True
+
+    def run_maintenance(self, analyze: bool = False):
+        '''
+        This function keeps the database fast over time, the app runs it on a schedule
+        It updates the statistics the query planner uses and gives free pages back to the filesystem
+        Pass analyze=True to rebuild all the statistics instead of only the stale ones
+        '''
         cursor = self.conn.cursor()
 
         try:
-            # Execute the INSERT statement
+            if analyze:
+                cursor.execute("ANALYZE")
+
+            cursor.execute("PRAGMA optimize")
+
+            # Only does anything if the file was created with auto_vacuum=INCREMENTAL
             cursor.execute(
-                sql_statment, (user_name, encrypt(password)))
+                f"PRAGMA incremental_vacuum({int(self.profile.incremental_vacuum_pages)})")
+            cursor.fetchall()
 
             self.conn.commit()
+
         except sqlite3.Error as e:
-            cursor.close()
-            print(f"Error adding user: {e}")
+            logger.error("Database error: %s", e)
 
         finally:
             cursor.close()
 
-        # Commit the changes
-        self.conn.commit()
-        cursor.close()
+    def close(self):
+        '''Runs a last optimize and closes the connection'''
+        self.clear_cache()
+
+        try:
+            self.conn.execute("PRAGMA optimize")
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+
+        finally:
+            self.conn.close()
+
+    def set_sql_tracing(self, on: bool):
+        '''Turns counting of the statements run on this connection on or off
+        Has to run on the thread that owns the connection, AsyncDatabase takes care of that'''
+        instrumentation.trace_connection(self.conn, on)
+
+    # Find a way to handle when a user exists
+    # This will add a user to the database
+    def add_user(self, user_name: str, password: str):
+        '''
+        This function adds a new user to the database
+        The user gets a new data key wrapped with their password, the password itself is not stored
+        '''
+        # Our insert Statement to add users
+        # users.password is NOT NULL from before data keys, it is left blank
+        sql_statment = ''' INSERT INTO users(user_name, password, data_key, key_salt)
+                            VALUES(?,'',?,?)'''
+
+        wrapped_key, salt = wrap_data_key(new_data_key(), password)
+
+        try:
+            # Execute the INSERT statement
+            self.write(lambda cursor: cursor.execute(sql_statment, (user_name, wrapped_key, salt)))
+
+        except sqlite3.Error as e:
+            logger.error("Error adding user: %s", e)
 
     def is_user_exists(self, username: str) -> bool:
         '''
@@ -144,6 +410,125 @@ class Database:
             cursor.close()
             return False
 
+    def authenticate(self, user_name: str, password: str, unlock: bool = True) -> Session | None:
+        '''
+        This function checks a user_name and password against the database
+        It returns a Session for the user if they match and None if they don't
+        The user is looked up through the unique index on user_name in one query
+        The password is checked by unwrapping the data key of the user, which is kept until lock_user is called
+        Pass unlock=False when nothing will be encrypted or decrypted, the key is forgotten and the Session has none
+        '''
+        sql_statement = '''
+        SELECT id, password, data_key, key_salt, item_changes FROM users WHERE user_name=?
+        '''
+
+        cursor = self.conn.cursor()
+
+        try:
+            cursor.execute(sql_statement, (user_name,))
+            result = cursor.fetchone()
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            return None
+
+        finally:
+            cursor.close()
+
+        # The user doesn't exist
+        if result is None:
+            return None
+
+        user_id, encrypted_password, wrapped_key, salt, item_changes = result
+        data_key = self.unlock_data_key(user_id, password, wrapped_key, salt, encrypted_password)
+
+        # The password is wrong
+        if data_key is None:
+            return None
+
+        # check_external_changes compares against what the items were like when the user logged in
+        self.item_changes[user_id] = item_changes
+
+        if not unlock:
+            return Session(user_id=user_id, user_name=user_name)
+
+        self.data_keys[user_id] = data_key
+        return Session(user_id=user_id, user_name=user_name, data_key=data_key)
+
+    def unlock_data_key(self, user_id: int, password: str, wrapped_key: str | None, salt: bytes | None,
+                        encrypted_password: str) -> bytes | None:
+        '''
+        This function unwraps the data key of a user with their password, which is what checks the password
+        Users from before data keys existed are checked against their old encrypted password and get a new key
+        Returns the data key or None if the password is wrong
+        '''
+        if wrapped_key is None:
+            # compare_digest takes the same time no matter where the passwords differ
+            # The password is checked first so a wrong one never pays for the key derivation
+            if not encrypted_password or not hmac.compare_digest(
+                    decrpyt(encrypted_password).encode(), password.encode()):
+                return None
+
+            data_key = new_data_key()
+            new_wrapped_key, new_salt = wrap_data_key(data_key, password)
+
+            def add_data_key(cursor: sqlite3.Cursor):
+                # Only if no other process gave the user a data key since it was read, the encrypted password goes too
+                cursor.execute('''
+                    UPDATE users SET data_key=?, key_salt=?, password=''
+                    WHERE id=? AND data_key IS NULL
+                    ''', (new_wrapped_key, new_salt, user_id))
+
+                if cursor.rowcount == 1:
+                    return None
+
+                # Someone else logged in first, their data key may already be on items so it has to be used
+                return cursor.execute('''SELECT data_key, key_salt FROM users WHERE id=?''', (user_id,)).fetchone()
+
+            try:
+                stored = self.write(add_data_key)
+
+            except sqlite3.Error as e:
+                logger.error("Database error: %s", e)
+                return None
+
+            if stored is None:
+                return data_key
+
+            wrapped_key, salt = stored
+
+            # The user was deleted in the meantime
+            if wrapped_key is None:
+                return None
+
+        try:
+            return unwrap_data_key(wrapped_key, password, salt)
+
+        except InvalidToken:
+            return None
+
+    def set_data_key(self, user_id: int, data_key: bytes | None):
+        '''
+        Gives this connection the data key of a user that logged in through another one
+        Used by the background threads of the app that open their own Database
+        '''
+        if data_key is not None:
+            self.data_keys[user_id] = data_key
+
+    def get_data_key(self, user_id: int) -> bytes | None:
+        '''Returns the data key of the user or None if they aren't logged in on this connection'''
+        return self.data_keys.get(user_id)
+
+    def lock_user(self, user_id: int):
+        '''
+        Forgets the data key of a user, called when their session ends
+        Their items can't be decrypted through this connection again until they log in
+        '''
+        data_key = self.data_keys.pop(user_id, None)
+
+        if data_key is not None:
+            forget_data_key(data_key)
+
     # This function takes a user id and looks for the username
     # In the database
     def get_username(self, id: int):
@@ -169,130 +554,480 @@ class Database:
 
         except sqlite3.Error as e:
             cursor.close()
-            print(f"Database error: {e}")
+            logger.error("Database error: %s", e)
             return None
 
-    # Function makes it easy to get the password of a user that already exists
+    # This function given an id will delete that user
+    def delete_user(self, id: int):
+        sql_statemenet = '''DELETE FROM users WHERE id = ? '''
 
-    def get_password(self, id: int):
-        '''
-        This function allows us to easily get the users password
-        pass the username and it will automatically decrypt the users password and return it
-        '''
-        # SELECT statement
-        sql_statment = ''' SELECT password
-                            From users
-                            WHERE id=? '''
+        try:
+            self.write(lambda cursor: cursor.execute(sql_statemenet, (id,)))
 
-        # Create a cursor
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+
+        finally:
+            # The users items are gone with them
+            self.item_cache.clear()
+            self.lock_user(id)
+
+    # This function given a username will get the id of that user
+    def get_user_id(self, user_name: str) -> int | None:
         cursor = self.conn.cursor()
 
-        # Execute the command
+        sql_statement = '''SELECT id
+        FROM users
+        WHERE user_name = ?
+        '''
+
         try:
-            cursor.execute(sql_statment, (id,))
+            cursor.execute(sql_statement, (user_name,))
 
             result = cursor.fetchone()
 
-            # Something with future error checking?
             if result is None:
                 cursor.close()
                 return None
 
-            return decrpyt(result[0])
+            cursor.close()
+            return result[0]
 
         except sqlite3.Error as e:
-            print(f"Database error: {e}")
-            return None
+            logger.error("Database error: %s", e)
 
         finally:
             cursor.close()
 
-    # This function given an id will delete that user
-    def delete_user(self, id: int):
-        cursor = self.conn.cursor()
+    # The password and user name here aren't for the user account but for the account
+    # The user saving to this item. The password here should also be encrypted
+    def add_item(self, user_id: int, item_name: str, username: str, password: str,
+                 folder_id: int | None = None) -> int | None:
+        '''This function takes the user_id of the logged in user an item name,
+        username and password the password is encrypted
+        with the data key of the user if they are logged in and the vault key if they aren't
+        The item is put in the folder with the id folder_id if one is given
+        Returns the id of the new item'''
+        sql_statemenet = '''INSERT INTO items(user_id, item_name, username, password, folder_id, user_key)
+        VALUES(?, ?, ?, ?, ?, ?)
+        '''
 
-        sql_statemenet = '''DELETE FROM users WHERE id = ? '''
+        data_key = self.data_keys.get(user_id)
+        row = (user_id, item_name, username, encrypt(password, data_key), folder_id, data_key is not None)
+
+        def insert(cursor):
+            cursor.execute(sql_statemenet, row)
+            return cursor.lastrowid
 
         try:
-            cursor.execute(sql_statemenet, (id,))
-            self.conn.commit()
+            item_id = self.write(insert)
 
         except sqlite3.Error as e:
-            print(f"Database error: {e}")
+            logger.error("Database error: %s", e)
+            return None
+
+        self.events.publish(ItemsAdded(user_id, (item_id,), folder_id))
+        return item_id
+
+    def add_items(self, user_id: int, items, batch_size: int = 1000, progress=None,
+                  folder_id: int | None = None) -> int:
+        '''This function adds many items at once for bulk imports
+        items is any iterable of (item_name, username, password) tuples, it is read lazily
+        Rows are encrypted and inserted batch_size at a time with one commit per batch
+        progress is called with the number of items added so far after every batch
+        Every item is put in the folder with the id folder_id if one is given
+        Returns the number of items that were added'''
+
+        sql_statement = '''INSERT INTO items(user_id, item_name, username, password, folder_id, user_key)
+        VALUES(?, ?, ?, ?, ?, ?)
+        '''
+
+        data_key = self.data_keys.get(user_id)
+        user_key = data_key is not None
+
+        # The passwords are encrypted in parallel ahead of the inserts
+        rows = encrypt_field(
+            ((user_id, item_name, username, password, folder_id, user_key)
+             for item_name, username, password in items), 3, data_key=data_key)
+        added = 0
+
+        def insert_batch(cursor, batch):
+            # write takes the write lock straight away
+            # So nobody else can add items between finding the last id and the insert
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM items")
+            last_id = cursor.fetchone()[0]
+
+            cursor.executemany(sql_statement, batch)
+
+            cursor.execute('''SELECT id FROM items WHERE user_id=? AND id>? ORDER BY id''',
+                           (user_id, last_id))
+            return tuple(row[0] for row in cursor.fetchall())
+
+        try:
+            while True:
+                batch = list(islice(rows, batch_size))
+
+                if not batch:
+                    break
+
+                item_ids = self.write(lambda cursor: insert_batch(cursor, batch))
+
+                added += len(batch)
+                self.events.publish(ItemsAdded(user_id, item_ids, folder_id))
+
+                if progress is not None:
+                    progress(added)
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+
+        return added
+
+    def delete_item(self, item_id, version: int | None = None) -> bool:
+        '''This function deletes an item
+        If a version is given the item is only deleted if it is still on that version
+        and a ConflictError is raised if someone else changed it since it was read
+        Deleting an item someone else already deleted does nothing
+        Returns True if the item was deleted by this call'''
+
+        def delete(cursor):
+            cursor.execute('''SELECT user_id, version FROM items WHERE id=?''', (item_id,))
+            result = cursor.fetchone()
+
+            if result is None:
+                return None
+
+            user_id, current_version = result
+
+            if version is not None and current_version != version:
+                raise ConflictError(item_id, current_version)
+
+            cursor.execute('''DELETE FROM items WHERE id=?''', (item_id,))
+
+            # Needed for the event once the item is gone
+            return user_id
+
+        try:
+            user_id = self.write(delete)
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            user_id = None
 
         finally:
-            cursor.close()
+            self.item_cache.invalidate(item_id)
 
-    # This function given a username will get the id of that user
-    def get_user_id(self, user_name: str) -> int | None:
-        cursor = self.conn.cursor()
+        if user_id is None:
+            return False
 
-        sql_statement = '''SELECT id
-        FROM users
-        WHERE user_name = ?
+        self.events.publish(ItemsDeleted(user_id, (item_id,)))
+        return True
+
+    def update_item(self, item_id: int, item_name: str, username: str, password: str,
+                    version: int | None = None) -> int | None:
+        '''This function takes the id of an item and replaces its name, username and password
+        The password is encrypted with the data key of the owner if they are logged in
+        If a version is given the item is only changed if it is still on that version
+        and a ConflictError is raised if someone else changed or deleted it since it was read
+        Returns the new version of the item or None if it doesn't exist'''
+
+        sql_statement = '''
+        UPDATE items
+        SET item_name=?, username=?, password=?, user_key=?, version=version + 1
+        WHERE id=?
         '''
 
+        def update(cursor):
+            cursor.execute('''SELECT user_id, version FROM items WHERE id=?''', (item_id,))
+            result = cursor.fetchone()
+
+            if result is None:
+                if version is not None:
+                    raise ConflictError(item_id, None)
+
+                return None
+
+            user_id, current_version = result
+
+            if version is not None and current_version != version:
+                raise ConflictError(item_id, current_version)
+
+            data_key = self.data_keys.get(user_id)
+            cursor.execute(
+                sql_statement, (item_name, username, encrypt(password, data_key), data_key is not None, item_id))
+
+            return user_id, current_version + 1
+
         try:
-            cursor.execute(sql_statement, (user_name,))
+            result = self.write(update)
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            result = None
+
+        finally:
+            self.item_cache.invalidate(item_id)
+
+        if result is None:
+            return None
+
+        user_id, new_version = result
+        self.events.publish(ItemsUpdated(user_id, (item_id,)))
 
+        return new_version
+
+    def get_item_owner(self, item_id: int) -> int | None:
+        '''This function takes the id of an item and returns the id of the user it belongs to'''
+        cursor = self.conn.cursor()
+
+        try:
+            cursor.execute('''SELECT user_id FROM items WHERE id=?''', (item_id,))
             result = cursor.fetchone()
 
             if result is None:
-                cursor.close()
                 return None
 
-            cursor.close()
             return result[0]
 
         except sqlite3.Error as e:
-            print(f"Database error: {e}")
+            logger.error("Database error: %s", e)
+            return None
 
         finally:
             cursor.close()
 
-    # The password and user name here aren't for the user account but for the account
-    # The user saving to this item. The password here should also be encrypted
-    def add_item(self, user_id: int, item_name: str, username: str, password: str):
-        '''This function takes the user_id of the logged in user an item name,
-        username and password the password is encrypted'''
-        cursor = self.conn.cursor()
+    def add_folder(self, user_id: int, name: str, parent_id: int | None = None) -> int | None:
+        '''This function adds a folder for the user inside the folder parent_id
+        or at the top if parent_id is None
+        Returns the id of the new folder'''
+
+        # A folder can only be put inside a folder of the same user
+        if parent_id is not None and self.get_folder_owner(parent_id) != user_id:
+            logger.error("Folder %s does not belong to user %s", parent_id, user_id)
+            return None
 
-        sql_statemenet = '''INSERT INTO items(user_id, item_name, username, password)
-        VALUES(?, ?, ?, ?)
+        sql_statement = '''
+        INSERT INTO folders(user_id, parent_id, name)
+        VALUES(?, ?, ?)
         '''
 
+        def insert(cursor):
+            cursor.execute(sql_statement, (user_id, parent_id, name))
+            return cursor.lastrowid
+
         try:
-            cursor.execute(
-                sql_statemenet, (user_id, item_name, username, encrypt(password)))
-            self.conn.commit()
+            folder_id = self.write(insert)
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            return None
+
+        self.events.publish(FoldersChanged(user_id))
+        return folder_id
+
+    def rename_folder(self, folder_id: int, name: str):
+        '''This function changes the name of a folder'''
+
+        def rename(cursor):
+            cursor.execute('''UPDATE folders SET name=? WHERE id=?''', (name, folder_id))
+            return cursor.rowcount > 0
+
+        try:
+            renamed = self.write(rename)
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            renamed = False
+
+        if renamed:
+            self.events.publish(FoldersChanged(self.get_folder_owner(folder_id)))
+
+    def delete_folder(self, folder_id: int):
+        '''This function deletes a folder and every folder inside it
+        The items in them are kept and no longer belong to a folder'''
+
+        user_id = self.get_folder_owner(folder_id)
+
+        if user_id is None:
+            return
+
+        # Needed for the event once the folders are gone
+        folder_ids = self.get_subfolder_ids(folder_id)
+
+        def delete(cursor):
+            item_ids = []
+
+            for start in range(0, len(folder_ids), 500):
+                chunk = folder_ids[start:start + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor.execute(f'''SELECT id FROM items WHERE folder_id IN ({placeholders})''', chunk)
+                item_ids.extend(row[0] for row in cursor.fetchall())
+
+            # The folders inside it are deleted by ON DELETE CASCADE
+            # And the items lose their folder by ON DELETE SET NULL
+            cursor.execute('''DELETE FROM folders WHERE id=?''', (folder_id,))
+            return item_ids
+
+        try:
+            item_ids = self.write(delete)
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            return
+
+        if item_ids:
+            self.events.publish(ItemsMoved(user_id, tuple(item_ids), None))
+
+        self.events.publish(FoldersChanged(user_id))
+
+    def move_items(self, item_ids, folder_id: int | None):
+        '''This function puts the items in the folder folder_id or takes them out of their folder if it is None
+        All of them are moved in one transaction'''
+
+        item_ids = list(item_ids)
+
+        if not item_ids:
+            return
+
+        user_id = self.get_item_owner(item_ids[0])
+
+        # Items can only be put in a folder of the user that owns them
+        if folder_id is not None and self.get_folder_owner(folder_id) != user_id:
+            logger.error("Folder %s does not belong to user %s", folder_id, user_id)
+            return
+
+        def move(cursor):
+            # sqlite limits how many ? a statement can have so move them in chunks
+            for start in range(0, len(item_ids), 500):
+                chunk = item_ids[start:start + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor.execute(
+                    f'''UPDATE items SET folder_id=?, version=version + 1
+                    WHERE user_id=? AND id IN ({placeholders})''',
+                    (folder_id, user_id, *chunk))
+
+        try:
+            self.write(move)
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            return
+
+        self.events.publish(ItemsMoved(user_id, tuple(item_ids), folder_id))
+
+    def get_folder_owner(self, folder_id: int) -> int | None:
+        '''This function takes the id of a folder and returns the id of the user it belongs to'''
+        cursor = self.conn.cursor()
+
+        try:
+            cursor.execute('''SELECT user_id FROM folders WHERE id=?''', (folder_id,))
+            result = cursor.fetchone()
+
+            if result is None:
+                return None
+
+            return result[0]
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            return None
+
+        finally:
             cursor.close()
 
+    def get_folders(self, user_id: int) -> list:
+        '''This function returns every folder of the user as FolderRow tuples ordered by name
+        The tree is small so it is read in one query and put together by the caller'''
+
+        sql_statement = '''
+        SELECT id, parent_id, name, item_count FROM folders
+        WHERE user_id=?
+        ORDER BY name COLLATE NOCASE, id
+        '''
+
+        cursor = self.conn.cursor()
+
+        try:
+            cursor.execute(sql_statement, (user_id,))
+            return [FolderRow._make(row) for row in cursor.fetchall()]
+
         except sqlite3.Error as e:
-            print(f"Database error: {e}")
+            logger.error("Database error: %s", e)
+            return []
 
         finally:
             cursor.close()
 
-        cursor.close()
+    def get_subfolder_ids(self, folder_id: int) -> list:
+        '''This function returns the id of the folder and of every folder inside it, however deep'''
+
+        # Walks down the tree one level at a time using the (user_id, parent_id) index
+        sql_statement = '''
+        WITH RECURSIVE subtree(id, user_id) AS (
+            SELECT id, user_id FROM folders WHERE id=?
+            UNION ALL
+            SELECT folders.id, folders.user_id FROM folders
+            JOIN subtree ON folders.user_id = subtree.user_id AND folders.parent_id = subtree.id
+        )
+        SELECT id FROM subtree
+        '''
 
-    def delete_item(self, item_id):
         cursor = self.conn.cursor()
 
-        sql_statemnt = '''
-        DELETE FROM items 
-        WHERE id=?
+        try:
+            cursor.execute(sql_statement, (folder_id,))
+            return [row[0] for row in cursor.fetchall()]
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            return []
+
+        finally:
+            cursor.close()
+
+    def count_items_in_subtree(self, folder_id: int) -> int:
+        '''This function returns how many items are in the folder and every folder inside it
+        It adds up the stored counts of the folders so no item is read'''
+
+        sql_statement = '''
+        WITH RECURSIVE subtree(id, user_id, item_count) AS (
+            SELECT id, user_id, item_count FROM folders WHERE id=?
+            UNION ALL
+            SELECT folders.id, folders.user_id, folders.item_count FROM folders
+            JOIN subtree ON folders.user_id = subtree.user_id AND folders.parent_id = subtree.id
+        )
+        SELECT COALESCE(SUM(item_count), 0) FROM subtree
         '''
 
+        cursor = self.conn.cursor()
+
         try:
-            cursor.execute(sql_statemnt, (item_id,))
-            self.conn.commit()
+            cursor.execute(sql_statement, (folder_id,))
+            return cursor.fetchone()[0]
 
         except sqlite3.Error as e:
-            print(f"Database error: {e}")
+            logger.error("Database error: %s", e)
+            return 0
 
         finally:
             cursor.close()
 
+    def subscribe(self, callback):
+        '''callback is called with an event from events.py every time items change'''
+        self.events.subscribe(callback)
+
+    def unsubscribe(self, callback):
+        self.events.unsubscribe(callback)
+
+    def clear_cache(self):
+        '''Drops every decrypted item held in memory, called when a session ends'''
+        self.item_cache.clear()
+
+    def set_cache_limits(self, max_size: int = ITEM_CACHE_SIZE, ttl: float = ITEM_CACHE_TTL):
+        '''Changes how many decrypted items are kept in memory and for how many seconds
+        A max_size of 0 turns the cache off, whatever was cached is dropped'''
+        self.item_cache = TTLCache(max_size, ttl)
+
     # This is inefficient but exists to allow us to do something
     # Instead of nothing
     # Takes a user id and returns all the tasks relating to that user
@@ -303,8 +1038,9 @@ class Database:
         '''
 
         sql_statement = '''
-        SELECT * FROM items
+        SELECT id, user_id, item_name, username, password FROM items
         WHERE user_id=?
+        ORDER BY id
         '''
 
         cursor = self.conn.cursor()
@@ -312,21 +1048,93 @@ class Database:
         try:
             cursor.execute(sql_statement, (user_id,))
 
-            result = cursor.fetchall()
+            # The items are made straight from the cursor in C without a list of plain rows in between
+            return list(starmap(Item, cursor))
 
-            item_list = []
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
 
-            for item in result:
-                item_list.append(Item(*item))
+        finally:
+            cursor.close()
 
-            return item_list
+    def iter_items(self, user_id: int, chunk_size: int = 500):
+        '''This function takes the id of the user and yields their items
+        chunk_size rows at a time as lists of (item_name, username, password) tuples
+        Only one chunk is held in memory at once so it is safe for very large vaults
+        It does NOT decrypt the passwords that are saved'''
+
+        for page in self.iter_item_pages(user_id, ("item_name", "username", "password"), chunk_size):
+            yield page.rows
+
+    def get_items_page(self, user_id: int, columns=("id", "item_name"), after_id: int = 0, limit: int = 200,
+                       folder_id: int | None = None) -> ItemPage:
+        '''This function returns an ItemPage with up to limit rows of the users items ordered by id
+        starting after the item with the id after_id
+        Only the columns asked for are selected and each row is a named tuple of them
+        Only the items directly in the folder are returned if a folder_id is given
+        A limit of -1 returns every row after after_id in one query
+        Pass the next_cursor of the page as after_id to get the next page'''
+
+        columns = tuple(columns)
+        row_type = item_row_type(columns)
+        folder_sql, folder_args = folder_filter(folder_id)
+
+        # The id is always read to know where the next page starts
+        # If it is one of the columns asked for it isn't selected twice and rows are made straight from the cursor
+        id_index = columns.index("id") if "id" in columns else None
+        selected = columns if id_index is not None else ("id",) + columns
+
+        # Column names are checked by item_row_type so they are safe to put in the statement
+        sql_statement = f'''
+        SELECT {", ".join(selected)} FROM items
+        WHERE user_id=?{folder_sql} AND id>?
+        ORDER BY id
+        LIMIT ?
+        '''
+
+        make_row = row_type._make
+        cursor = self.conn.cursor()
+
+        try:
+            cursor.execute(sql_statement, (user_id, *folder_args, after_id, limit))
+
+            if id_index is not None:
+                rows = list(map(make_row, cursor))
+                last_id = rows[-1][id_index] if rows else None
+            else:
+                result = cursor.fetchall()
+                rows = [make_row(row[1:]) for row in result]
+                last_id = result[-1][0] if result else None
 
         except sqlite3.Error as e:
-            print(f"Database error: {e}")
+            logger.error("Database error: %s", e)
+            return ItemPage([], None)
 
         finally:
             cursor.close()
 
+        # A short page is the last one
+        next_cursor = last_id if len(rows) == limit else None
+
+        return ItemPage(rows, next_cursor)
+
+    def iter_item_pages(self, user_id: int, columns=("id", "item_name"), page_size: int = 500):
+        '''This function yields every page of the users items from get_items_page
+        Each page is its own query so no read is held open while the caller works on a page'''
+
+        after_id = 0
+
+        while True:
+            page = self.get_items_page(user_id, columns, after_id, page_size)
+
+            if page.rows:
+                yield page
+
+            if page.next_cursor is None:
+                break
+
+            after_id = page.next_cursor
+
     def get_all_items_names(self, user_id: int):
         '''This function takes a user id and returns
         the names of all the items linked to that user'''
@@ -334,6 +1142,7 @@ class Database:
         sql_statement = '''
         SELECT item_name FROM items
         WHERE user_id=?
+        ORDER BY id
         '''
 
         cursor = self.conn.cursor()
@@ -345,40 +1154,204 @@ class Database:
 
             return result
         except sqlite3.Error as e:
-            print(f"Database error: {e}")
+            logger.error("Database error: %s", e)
+
+        finally:
+            cursor.close()
+
+    def count_items(self, user_id: int, folder_id: int | None = None) -> int:
+        '''This function takes a user id and returns how many items they have
+        Only the items directly in the folder are counted if a folder_id is given'''
+
+        folder_sql, folder_args = folder_filter(folder_id)
+
+        sql_statement = f'''
+        SELECT COUNT(*) FROM items
+        WHERE user_id=?{folder_sql}
+        '''
+
+        cursor = self.conn.cursor()
+
+        try:
+            cursor.execute(sql_statement, (user_id, *folder_args))
+            return cursor.fetchone()[0]
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            return 0
+
+        finally:
+            cursor.close()
+
+    def search_items(self, user_id: int, query: str, limit: int = 50):
+        '''This function returns up to limit (id, item_name, username) tuples of the users items
+        whose name or username contains words starting with every word in the query
+        The best matches come first'''
+
+        match_query = make_match_query(query)
+
+        if match_query == "":
+            return []
+
+        sql_statement = '''
+        SELECT items.id, items.item_name, items.username
+        FROM items_fts
+        JOIN items ON items.id = items_fts.rowid
+        WHERE items_fts MATCH ? AND items.user_id=?
+        ORDER BY bm25(items_fts, ?, ?), items.id
+        LIMIT ?
+        '''
+
+        cursor = self.conn.cursor()
+
+        try:
+            cursor.execute(sql_statement, (match_query, user_id, *SEARCH_WEIGHTS, limit))
+            return cursor.fetchall()
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            return []
+
+        finally:
+            cursor.close()
+
+    def find_items(self, user_id: int, item_name: str) -> list[int]:
+        '''This function returns the ids of the users items named exactly item_name ordered by id
+        It uses the (user_id, item_name) index so it doesn't scan the vault'''
+
+        cursor = self.conn.cursor()
+
+        try:
+            cursor.execute('''SELECT id FROM items WHERE user_id=? AND item_name=? ORDER BY id''',
+                           (user_id, item_name))
+            return [row[0] for row in cursor.fetchall()]
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            return []
+
+        finally:
+            cursor.close()
+
+    def get_items_by_id(self, item_ids, columns=("id", "item_name")) -> list:
+        '''This function takes a list of item ids and returns named tuple rows
+        of the columns asked for, for the ones that exist, ordered by id'''
+
+        item_ids = list(item_ids)
+        columns = tuple(columns)
+        make_row = item_row_type(columns)._make
+        result = []
+
+        cursor = self.conn.cursor()
+
+        try:
+            # sqlite limits how many ? a statement can have so ask in chunks
+            for start in range(0, len(item_ids), 500):
+                chunk = item_ids[start:start + 500]
+                placeholders = ", ".join("?" * len(chunk))
+
+                sql_statement = f'''
+                SELECT {", ".join(columns)} FROM items
+                WHERE id IN ({placeholders})
+                ORDER BY id
+                '''
+
+                cursor.execute(sql_statement, chunk)
+                result.extend(map(make_row, cursor.fetchall()))
+
+            return result
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            return []
 
         finally:
             cursor.close()
 
-    def get_item_id(self, item_name: str):
+    def get_item_id_at(self, user_id: int, position: int, folder_id: int | None = None) -> int | None:
+        '''This function returns the id of the item at a position in the users list ordered by id
+        It is used to find where a page starts when jumping far down the list
+        It only reads the (user_id, id) or (user_id, folder_id, id) index and never touches the table'''
+
+        folder_sql, folder_args = folder_filter(folder_id)
+
+        sql_statement = f'''
+        SELECT id FROM items
+        WHERE user_id=?{folder_sql}
+        ORDER BY id
+        LIMIT 1 OFFSET ?
+        '''
+
+        cursor = self.conn.cursor()
+
+        try:
+            cursor.execute(sql_statement, (user_id, *folder_args, position))
+            result = cursor.fetchone()
+
+            if result is None:
+                return None
+
+            return result[0]
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            return None
+
+        finally:
+            cursor.close()
+
+    def get_item_id(self, user_id: int, item_name: str):
+        '''This function takes a user id and an item name
+        and returns the id of the first matching item that belongs to that user'''
         sql_statement = '''
         SELECT id FROM items
-        WHERE item_name=?
+        WHERE user_id=? AND item_name=?
+        ORDER BY id
+        LIMIT 1
         '''
         cursor = self.conn.cursor()
 
         try:
-            cursor.execute(sql_statement, (item_name,))
+            cursor.execute(sql_statement, (user_id, item_name))
             result = cursor.fetchone()
 
+            if result is None:
+                return None
+
             return result[0]
         except sqlite3.Error as e:
-            print(f"Database error: {e}")
+            logger.error("Database error: %s", e)
 
         finally:
             cursor.close()
 
     def get_item_details(self, item_id: int):
         '''This function gets the item_name, username and password
-        It decrypts the password (This returns a tuple)'''
+        It decrypts the password (This returns a tuple)
+        Recently viewed items are returned from the cache without a query or decryption
+        unless another connection has committed since they were cached
+        Returns None if the item is encrypted with the data key of a user that isn't logged in'''
+
+        logger.debug("Item details for %s", item_id)
+
+        try:
+            self.drop_stale_cache()
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            return None
+
+        cached = self.item_cache.get(item_id)
 
-        print(f"Item id: {item_id}")
+        if cached is not None:
+            return cached
 
         sql_statement = '''
         SELECT 
             item_name,
             username,
-            password
+            password,
+            user_id
         FROM items
         WHERE
             id=?
@@ -390,15 +1363,23 @@ class Database:
             cursor.execute(sql_statement, (item_id,))
             result = cursor.fetchone()
 
-            print(f"Item detials: {result}")
+            if result is None:
+                return None
 
             item_name = result[0]
             username = result[1]
-            password = decrpyt(result[2])
+            password = decrpyt(result[2], self.data_keys.get(result[3]))
+
+            details = (item_name, username, password)
+            self.item_cache.put(item_id, details)
+
+            return details
+        except InvalidToken:
+            logger.warning("Item %s can't be decrypted, its user isn't logged in", item_id)
+            return None
 
-            return (item_name, username, password)
         except sqlite3.Error as e:
-            print(f"Database error: {e}")
+            logger.error("Database error: %s", e)
 
         finally:
             cursor.close()
@@ -1,7 +1,15 @@
+import base64
 import os
+import threading
+import time
+from collections import deque
+from functools import partial
+from itertools import chain, islice, tee
 
 # Encryption Decryption uses one single key to allow encryption and decryption
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 # from dotenv import load_dotenv  # This will allows us to load env files
 
 # Loads .env file into scope
@@ -9,38 +17,352 @@ from cryptography.fernet import Fernet
 
 KEY_FILE = "./data/fernet.key"
 
+# Number of PBKDF2 rounds used when turning a password into a key
+KDF_ITERATIONS = 480_000
 
-def load_or_create_key():
+# Size of the random salt used when deriving the key that wraps a users data key
+DATA_KEY_SALT_SIZE = 16
+
+# Number of values handed to a worker at once by the batch functions
+BATCH_CHUNK_SIZE = 512
+
+# Fewest values the batch functions start a process pool for, smaller inputs are done inline
+# Spawning the workers takes ~150ms which is about as long as encrypting 15,000 values in one process
+PROCESS_POOL_MIN_ITEMS = 16_384
+
+
+def read_keys() -> list[bytes]:
+    """
+    Returns the keys in the key file, one per line, the first one is the one used to encrypt
+    """
+    with open(KEY_FILE, "rb") as f:
+        return [line.strip() for line in f.read().splitlines() if line.strip()]
+
+
+def write_keys(keys: list[bytes]):
+    """
+    Replaces the key file with the keys, the first one is used to encrypt and all of them to decrypt
+    The new file is written next to the old one and moved over it so a crash never leaves half a file
+    """
+    os.makedirs(os.path.dirname(KEY_FILE), exist_ok=True)
+    temp_path = KEY_FILE + ".tmp"
+
+    # Only the owner can read the keys
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+
+    with os.fdopen(fd, "wb") as f:
+        f.write(b"\n".join(keys) + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(temp_path, KEY_FILE)
+
+
+def load_or_create_keys() -> list[bytes]:
     if os.path.exists(KEY_FILE):
-        with open(KEY_FILE, "rb") as f:
-            return f.read()
+        return read_keys()
     else:
-        key = Fernet.generate_key()
-        os.makedirs(os.path.dirname(KEY_FILE), exist_ok=True)
-        with open(KEY_FILE, "wb") as f:
-            f.write(key)
-        return key
+        keys = [Fernet.generate_key()]
+        write_keys(keys)
+        return keys
+
+
+def load_or_create_key():
+    return load_or_create_keys()[0]
 
 
 # SECRET_KEY = os.getenv('SECRET_KEY')
 # assert SECRET_KEY
 
-FERNET = Fernet(load_or_create_key())
+# The keys are only read (or created) the first time something is encrypted or decrypted
+# So importing this file doesn't touch the disk
+KEYS = None
+FERNET = None
+# Stops two threads from both creating a key file the first time
+KEY_LOCK = threading.Lock()
+
+# The key file is looked at again at most this often in seconds
+# So a key rotated by another process (see rotation.py) is picked up without a restart
+KEY_CHECK_INTERVAL = 1.0
+key_file_mtime = None
+next_key_check = 0.0
+
+# The MultiFernet of every data key in use keyed by the data key, see get_user_fernet
+# Emptied when the vault keys change because every one of them holds the vault keys too
+USER_FERNETS = {}
+
+
+def get_keys() -> list[bytes]:
+    """
+    Returns every vault key, the first one is used to encrypt
+    """
+    global KEYS, key_file_mtime
+
+    with KEY_LOCK:
+        if KEYS is None:
+            KEYS = load_or_create_keys()
+            key_file_mtime = os.stat(KEY_FILE).st_mtime_ns
+
+    return KEYS
+
+
+def get_key() -> bytes:
+    """
+    Returns the key new values are encrypted with
+    """
+    return get_keys()[0]
+
+
+def get_fernet() -> MultiFernet:
+    """
+    Returns a MultiFernet that encrypts with the newest key and decrypts with any of them
+    """
+    global FERNET, next_key_check
+
+    if FERNET is not None and time.monotonic() >= next_key_check:
+        next_key_check = time.monotonic() + KEY_CHECK_INTERVAL
+        reload_keys_if_changed()
+
+    fernet = FERNET
+
+    if fernet is None:
+        fernet = FERNET = MultiFernet([Fernet(key) for key in get_keys()])
+
+    return fernet
+
+
+def reload_keys_if_changed() -> bool:
+    """
+    Reads the key file again if it changed since it was read, returns True if it did
+    """
+    global KEYS, FERNET, key_file_mtime
+
+    try:
+        mtime = os.stat(KEY_FILE).st_mtime_ns
+    except OSError:
+        return False
+
+    with KEY_LOCK:
+        if mtime == key_file_mtime:
+            return False
+
+        KEYS = read_keys()
+        key_file_mtime = mtime
+        FERNET = None
+        USER_FERNETS.clear()
+
+    return True
+
+
+def get_user_fernet(data_key: bytes | None) -> MultiFernet:
+    """
+    Returns a MultiFernet that encrypts with the data key of a user and decrypts with it or any vault key
+    So items saved before the user had a data key can still be read
+    With no data key it is the same as get_fernet
+    """
+    # Called every time so a rotated vault key is still noticed
+    vault_fernet = get_fernet()
+
+    if data_key is None:
+        return vault_fernet
+
+    fernet = USER_FERNETS.get(data_key)
+
+    if fernet is None:
+        fernet = USER_FERNETS[data_key] = MultiFernet(
+            [Fernet(data_key)] + [Fernet(key) for key in get_keys()])
+
+    return fernet
+
+
+def forget_data_key(data_key: bytes):
+    """
+    Drops the MultiFernet kept for a data key, called when the session of its user ends
+    """
+    USER_FERNETS.pop(data_key, None)
 
 
 # Function for easy encryption
 # Pass in the data you want to encrypt and it will return the encrypted data
-def encrypt(data):
+# Pass the data key of a user to encrypt with it instead of the vault key
+def encrypt(data, data_key: bytes | None = None):
     """
     Takes in uncrypted data and returns the encrypted version
     """
-    return FERNET.encrypt(data.encode()).decode()
+    return get_user_fernet(data_key).encrypt(data.encode()).decode()
 
 
 # Function for easy decryption
 # Pass in encrypted data and it will decrypt it
-def decrpyt(data):
+def decrpyt(data, data_key: bytes | None = None):
     """
     Takes in encrypted data and returns decrypted data
     """
-    return FERNET.decrypt(data).decode("utf-8")
+    return get_user_fernet(data_key).decrypt(data).decode("utf-8")
+
+
+# Per user data keys (envelope encryption)
+# Every user has a random data key their items are encrypted with
+# It is stored in the users table wrapped (encrypted) by a key derived from their master password
+# Unwrapping it costs a full key derivation so it is done once at log in and kept for the session
+
+def new_data_key() -> bytes:
+    """
+    Returns a new random data key
+    """
+    return Fernet.generate_key()
+
+
+def wrap_data_key(data_key: bytes, password: str) -> tuple[str, bytes]:
+    """
+    Encrypts a data key with a key derived from the master password
+    Returns the wrapped key and the salt needed to unwrap it
+    """
+    salt = os.urandom(DATA_KEY_SALT_SIZE)
+    return derive_fernet(password, salt).encrypt(data_key).decode(), salt
+
+
+def unwrap_data_key(wrapped_key: str, password: str, salt: bytes) -> bytes:
+    """
+    Decrypts a data key wrapped by wrap_data_key
+    Raises InvalidToken if the password is wrong
+    """
+    return derive_fernet(password, salt).decrypt(wrapped_key.encode())
+
+
+# Function for turning a password into a key
+# The same password and salt always give back the same Fernet
+def derive_fernet(password: str, salt: bytes) -> Fernet:
+    """
+    Takes a password and a random salt and returns a Fernet using a key derived from them
+    """
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=KDF_ITERATIONS,
+    )
+    return Fernet(base64.urlsafe_b64encode(kdf.derive(password.encode())))
+
+
+# Batch functions
+# These take any iterable and yield the results back in the same order
+# The values are split into chunks and the chunks are spread over a pool of workers
+# Only a few chunks per worker are in flight at once so huge inputs are never fully in memory
+#
+# Processes are used by default because Fernet holds the GIL for most of its work
+# With one worker (or one cpu) everything runs inline without starting a pool
+# And so do inputs that fit in one chunk, or that are too small to make up for starting processes
+
+def encrypt_many(data, chunk_size: int = BATCH_CHUNK_SIZE, workers: int | None = None, use_processes: bool = True,
+                 data_key: bytes | None = None):
+    """
+    Takes an iterable of uncrypted data and yields the encrypted versions in order
+    Pass the data key of a user to encrypt with it instead of the vault key
+    """
+    return map_in_chunks(partial(encrypt_chunk, data_key=data_key), data, chunk_size, workers, use_processes)
+
+
+def decrypt_many(data, chunk_size: int = BATCH_CHUNK_SIZE, workers: int | None = None, use_processes: bool = True,
+                 data_key: bytes | None = None):
+    """
+    Takes an iterable of encrypted data and yields the decrypted versions in order
+    Pass the data key of a user to decrypt values encrypted with it
+    """
+    return map_in_chunks(partial(decrypt_chunk, data_key=data_key), data, chunk_size, workers, use_processes)
+
+
+def encrypt_field(rows, index: int, **kwargs):
+    """
+    Takes an iterable of tuples and yields them with the value at index encrypted
+    Accepts the same keyword arguments as encrypt_many
+    """
+    return replace_field(rows, index, encrypt_many, **kwargs)
+
+
+def decrypt_field(rows, index: int, **kwargs):
+    """
+    Takes an iterable of tuples and yields them with the value at index decrypted
+    Accepts the same keyword arguments as decrypt_many
+    """
+    return replace_field(rows, index, decrypt_many, **kwargs)
+
+
+def replace_field(rows, index, batch_function, **kwargs):
+    # tee only buffers the rows the workers are ahead by
+    rows, values = tee(rows)
+    results = batch_function((row[index] for row in values), **kwargs)
+
+    for row, result in zip(rows, results):
+        yield row[:index] + (result,) + row[index + 1:]
+
+
+def encrypt_chunk(chunk, data_key=None):
+    fernet = get_user_fernet(data_key)
+    return [fernet.encrypt(data.encode()).decode() for data in chunk]
+
+
+def decrypt_chunk(chunk, data_key=None):
+    fernet = get_user_fernet(data_key)
+    return [fernet.decrypt(data).decode("utf-8") for data in chunk]
+
+
+# Runs in every worker process so it uses the same keys as the parent
+def init_worker(keys):
+    global KEYS, FERNET, next_key_check
+    KEYS = keys
+    FERNET = MultiFernet([Fernet(key) for key in keys])
+    # The parent already has the newest keys
+    next_key_check = float("inf")
+
+
+def map_in_chunks(function, data, chunk_size, workers, use_processes):
+    # Imported here because only the batch functions need them and they add to the start up time of cli.py
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    data = iter(data)
+
+    if workers > 1:
+        # Look ahead far enough to know if the input is worth starting a pool for
+        min_items = max(PROCESS_POOL_MIN_ITEMS, chunk_size) if use_processes else chunk_size
+        head = list(islice(data, min_items + 1))
+
+        if len(head) <= min_items:
+            workers = 1
+
+        data = chain(head, data)
+
+    chunks = iter(lambda: list(islice(data, chunk_size)), [])
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield from function(chunk)
+        return
+
+    if use_processes:
+        # spawn because forking a process that has other threads running (like the app) isn't safe
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(get_keys(),),
+        )
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers)
+
+    with pool:
+        pending = deque()
+
+        for chunk in chunks:
+            pending.append(pool.submit(function, chunk))
+
+            # Wait for the oldest chunk before queueing too many
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
@@ -0,0 +1,69 @@
+# This file holds the events the database sends out whenever items change
+# Anything that shows items can subscribe and update only what changed instead of reloading everything
+#
+# Events:
+# 1 - ItemsAdded
+# 2 - ItemsDeleted
+# 3 - ItemsUpdated
+#   ^ Each one holds the id of the user that owns the items and the ids of the items
+#   ^ ItemsAdded also holds the folder the items were added to (None for no folder)
+#
+# 4 - ItemsMoved
+#   ^ Items were put in a different folder, holds the folder they were moved to
+#
+# 5 - FoldersChanged
+#   ^ A folder of the user was added, renamed or deleted
+#
+# Subscribers are called on the thread that made the change, straight after it is committed
+
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class ItemsAdded:
+    user_id: int
+    item_ids: tuple[int, ...]
+    folder_id: int | None = None
+
+
+@dataclass(frozen=True)
+class ItemsDeleted:
+    user_id: int
+    item_ids: tuple[int, ...]
+
+
+@dataclass(frozen=True)
+class ItemsUpdated:
+    user_id: int
+    item_ids: tuple[int, ...]
+
+
+@dataclass(frozen=True)
+class ItemsMoved:
+    user_id: int
+    item_ids: tuple[int, ...]
+    folder_id: int | None
+
+
+@dataclass(frozen=True)
+class FoldersChanged:
+    user_id: int
+
+
+class EventBus:
+    '''Keeps a list of callbacks and calls each of them with every published event'''
+
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def publish(self, event):
+        # Copy the list so a subscriber can unsubscribe while being called
+        for callback in list(self.subscribers):
+            callback(event)
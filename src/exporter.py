@@ -0,0 +1,222 @@
+# This file handles exporting a vault to an encrypted backup file and importing it back
+# The vault is read in chunks with Database.iter_items and written to the file one chunk at a time
+# So the memory used stays the same no matter how large the vault is
+#
+# Export file layout:
+#   ^ MAGIC, a version byte and a 16 byte random salt
+#   ^ Any number of frames, each one is a 4 byte length followed by a Fernet token
+#     ^ The token holds one chunk of items encrypted with a key derived from the export passphrase
+#     ^ Every chunk stores its index so missing or reordered frames are caught
+#   ^ A frame with a length of 0 marks the end of the file
+#   ^ Finally a sha256 digest of everything before it so truncated or damaged files are caught
+#
+# This file can also be run on its own
+#   $ python ./exporter.py export --user <user_name> <file>
+#   $ python ./exporter.py import --user <user_name> <file>
+
+import hashlib
+import json
+import os
+import struct
+from itertools import islice
+from cryptography.fernet import InvalidToken
+from encrypt import decrypt_field, derive_fernet
+
+MAGIC = b"ARCANUM-EXPORT"
+VERSION = 1
+SALT_SIZE = 16
+
+# Big endian unsigned int used for the length of every frame
+FRAME_HEADER = struct.Struct(">I")
+
+
+class ExportFileError(Exception):
+    '''Raised when an export file is damaged or the passphrase is wrong'''
+
+
+def export_vault(db, user_id: int, path: str, passphrase: str, chunk_size: int = 500, progress=None) -> int:
+    '''Writes every item of the user to an encrypted export file
+    The passwords are decrypted with the data key of the user and encrypted again with the passphrase
+    The user has to be logged in on db so their data key is known
+    progress is called with the number of items exported so far
+    Returns the number of items exported'''
+
+    salt = os.urandom(SALT_SIZE)
+    fernet = derive_fernet(passphrase, salt)
+    checksum = hashlib.sha256()
+    exported = 0
+
+    # Write to a temporary file first so a failed export never leaves a half written file behind
+    temp_path = path + ".tmp"
+
+    def write(f, data: bytes):
+        checksum.update(data)
+        f.write(data)
+
+    try:
+        with open(temp_path, "wb") as f:
+            write(f, MAGIC + bytes([VERSION]) + salt)
+
+            # The vault passwords are decrypted in parallel and regrouped into chunks
+            rows = decrypt_field(
+                (row for chunk in db.iter_items(user_id, chunk_size) for row in chunk), 2,
+                data_key=db.get_data_key(user_id))
+            chunks = iter(lambda: list(islice(rows, chunk_size)), [])
+
+            for index, chunk in enumerate(chunks):
+                items = [list(row) for row in chunk]
+
+                token = fernet.encrypt(json.dumps(
+                    {"index": index, "items": items}).encode())
+
+                write(f, FRAME_HEADER.pack(len(token)) + token)
+
+                exported += len(items)
+
+                if progress is not None:
+                    progress(exported)
+
+            # End of the frames followed by the checksum of the whole file
+            write(f, FRAME_HEADER.pack(0))
+            f.write(checksum.digest())
+
+        os.replace(temp_path, path)
+
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return exported
+
+
+def read_frames(f):
+    '''Yields the raw tokens from an open export file
+    Checks the checksum once the end of the file is reached'''
+
+    checksum = hashlib.sha256()
+
+    header = f.read(len(MAGIC) + 1 + SALT_SIZE)
+    checksum.update(header)
+
+    while True:
+        length_bytes = f.read(FRAME_HEADER.size)
+
+        if len(length_bytes) != FRAME_HEADER.size:
+            raise ExportFileError("Export file is truncated")
+
+        checksum.update(length_bytes)
+        length = FRAME_HEADER.unpack(length_bytes)[0]
+
+        if length == 0:
+            break
+
+        token = f.read(length)
+
+        if len(token) != length:
+            raise ExportFileError("Export file is truncated")
+
+        checksum.update(token)
+        yield token
+
+    if f.read(checksum.digest_size) != checksum.digest() or f.read(1) != b"":
+        raise ExportFileError("Export file checksum does not match")
+
+
+def read_salt(f) -> bytes:
+    '''Checks the header of an open export file and returns its salt'''
+
+    magic = f.read(len(MAGIC))
+    version = f.read(1)
+
+    if magic != MAGIC:
+        raise ExportFileError("Not an Arcanum export file")
+
+    if version != bytes([VERSION]):
+        raise ExportFileError(f"Unsupported export version: {version!r}")
+
+    salt = f.read(SALT_SIZE)
+    f.seek(0)
+    return salt
+
+
+def verify_export(path: str):
+    '''Reads through an export file and raises ExportFileError if it is damaged
+    This only checks the framing and checksum so it doesn't need the passphrase'''
+
+    with open(path, "rb") as f:
+        read_salt(f)
+
+        for _ in read_frames(f):
+            pass
+
+
+def read_export(path: str, passphrase: str):
+    '''Yields (item_name, username, password) tuples from an export file one chunk at a time'''
+
+    with open(path, "rb") as f:
+        fernet = derive_fernet(passphrase, read_salt(f))
+
+        for expected_index, token in enumerate(read_frames(f)):
+            try:
+                chunk = json.loads(fernet.decrypt(token))
+            except InvalidToken:
+                raise ExportFileError("Wrong passphrase or damaged export file")
+
+            if chunk["index"] != expected_index:
+                raise ExportFileError("Export file frames are out of order")
+
+            for item_name, username, password in chunk["items"]:
+                yield (item_name, username, password)
+
+
+def import_vault(db, user_id: int, path: str, passphrase: str, batch_size: int = 1000, progress=None) -> int:
+    '''Imports every item in an export file into the vault of the user
+    The whole file is checked before anything is added so a damaged file adds nothing
+    Returns the number of items imported'''
+
+    verify_export(path)
+    return db.add_items(user_id, read_export(path, passphrase), batch_size=batch_size, progress=progress)
+
+
+def main():
+    import argparse
+    import getpass
+    from database import Database
+
+    parser = argparse.ArgumentParser(
+        description="Export a vault to an encrypted file or import one back")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("file", help="The export file to write or read")
+    parser.add_argument("--user", required=True,
+                        help="The user whose vault is exported or imported into")
+    args = parser.parse_args()
+
+    db = Database()
+    session = db.authenticate(args.user, getpass.getpass())
+
+    if session is None:
+        print("Incorrect username or password")
+        raise SystemExit(1)
+
+    passphrase = getpass.getpass("Export passphrase: ")
+
+    def progress(count: int):
+        print(f"\r{args.action.capitalize()}ed {count} items", end="", flush=True)
+
+    try:
+        if args.action == "export":
+            count = export_vault(db, session.user_id, args.file,
+                                 passphrase, progress=progress)
+        else:
+            count = import_vault(db, session.user_id, args.file,
+                                 passphrase, progress=progress)
+
+    except (ExportFileError, OSError) as e:
+        print(f"{args.action.capitalize()} failed: {e}")
+        raise SystemExit(1)
+
+    print(f"\r{args.action.capitalize()}ed {count} items")
+
+
+if __name__ == "__main__":
+    main()
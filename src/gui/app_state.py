@@ -1,6 +1,7 @@
 # This file holds all code related to the state of the app or other extra stuff
 
-from database import Database
+from async_database import AsyncDatabase
 
 # Setup our database
-db = Database()
+# Every method has to be awaited, the queries run on their own thread
+db = AsyncDatabase()
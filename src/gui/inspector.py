@@ -0,0 +1,90 @@
+# This file holds the performance inspector, a debug screen with live stats from instrumentation.py
+# It is opened and closed with F12 from anywhere in the app
+#
+# Opening it turns recording on, it stays on after the screen is closed so stats keep building up
+# Press t to turn recording off again (nothing is recorded while it is off) and r to clear the stats
+
+from textual.app import ComposeResult
+from textual.binding import Binding
+from textual.screen import Screen
+from textual.widgets import DataTable, Footer, Label
+import instrumentation
+from gui.app_state import db
+
+# Seconds between refreshes of the table
+REFRESH_INTERVAL = 1.0
+
+COLUMNS = ["name", "calls", "total ms", "mean ms", "p50 ms", "p90 ms", "p99 ms", "max ms", "rows"]
+
+
+class InspectorScreen(Screen):
+    '''Shows the latency histograms, row counts and crypto time recorded by instrumentation.py'''
+
+    BINDINGS = [
+        Binding(key="escape,f12", action="close", description="Close"),
+        Binding(key="t", action="toggle_recording", description="Recording on/off"),
+        Binding(key="r", action="reset", description="Clear stats"),
+    ]
+
+    DEFAULT_CSS = """
+    InspectorScreen DataTable {
+        height: 1fr;
+    }
+    """
+
+    def compose(self) -> ComposeResult:
+        yield Label("", id="inspector_status")
+        yield DataTable(id="inspector_table", cursor_type="row", zebra_stripes=True)
+        yield Footer()
+
+    async def on_mount(self):
+        self.query_one(DataTable).add_columns(*COLUMNS)
+
+        if not instrumentation.enabled:
+            await self.set_recording(True)
+
+        self.update_table()
+        self.set_interval(REFRESH_INTERVAL, self.update_table)
+
+    async def set_recording(self, on: bool):
+        if on:
+            instrumentation.enable()
+        else:
+            instrumentation.disable()
+
+        # The statement counters live on the connection so they are set on the database thread
+        await db.set_sql_tracing(on)
+        self.update_table()
+
+    def update_table(self):
+        table = self.query_one(DataTable)
+        stats = instrumentation.snapshot()
+
+        table.clear()
+
+        for metric in stats:
+            table.add_row(
+                metric.name,
+                f"{metric.count:,}",
+                f"{metric.total_ms:,.1f}",
+                f"{metric.mean_ms:.3f}",
+                f"{metric.p50_ms:.3f}",
+                f"{metric.p90_ms:.3f}",
+                f"{metric.p99_ms:.3f}",
+                f"{metric.max_ms:.3f}",
+                f"{metric.rows:,}",
+            )
+
+        state = "on" if instrumentation.enabled else "off"
+        self.query_one("#inspector_status", Label).update(
+            f"Recording {state}, {len(stats)} metrics")
+
+    def action_close(self):
+        self.app.pop_screen()
+
+    async def action_toggle_recording(self):
+        await self.set_recording(not instrumentation.enabled)
+
+    def action_reset(self):
+        instrumentation.reset()
+        self.update_table()
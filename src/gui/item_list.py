@@ -0,0 +1,314 @@
+# This file holds the list used to show the items of a user
+# It is built to stay fast with hundreds of thousands of items
+#
+# How it works:
+#   ^ No widget is mounted per row, only the lines that are on screen are drawn (Textual's line API)
+#   ^ Rows are loaded from a source one page at a time when they scroll into view
+#   ^ Only MAX_CACHED_PAGES pages are kept in memory, the least recently used are dropped
+#   ^ reload() keeps the scroll position and the cursor so the list doesn't jump after a change
+#   ^ rows_added, rows_deleted and rows_updated apply a change without reloading the whole list
+
+from rich.segment import Segment
+from textual import work
+from textual.binding import Binding
+from textual.geometry import Size
+from textual.message import Message
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+from cache import TTLCache
+from gui.app_state import db
+
+
+class DatabaseItemSource:
+    '''Reads the items of a user from the database one page at a time
+    Pages are found with keyset pagination, each page starts after the last id of the page before it
+    Only the items directly in the folder are read if a folder_id is given'''
+
+    def __init__(self, user_id: int, folder_id: int | None = None):
+        self.user_id = user_id
+        self.folder_id = folder_id
+        self.reset()
+
+    def reset(self):
+        '''Forgets where the pages start, called whenever the items change'''
+        # Maps a page index to the id the page starts after
+        self.page_starts = {0: 0}
+
+    def forget_after(self, item_id: int):
+        '''Forgets the starts of pages that moved because the item was deleted'''
+        # A page only keeps its start if every row before it has a smaller id than the deleted one
+        self.page_starts = {
+            page_index: after_id for page_index, after_id in self.page_starts.items() if after_id < item_id
+        }
+
+    async def count(self) -> int:
+        return await db.count_items(self.user_id, self.folder_id)
+
+    async def get_page(self, page_index: int, page_size: int):
+        '''Returns a list of (id, item_name) tuples for the page'''
+        # Keep hold of the dict so a reset while we wait doesn't get stale starts written into it
+        page_starts = self.page_starts
+        after_id = page_starts.get(page_index)
+
+        # We jumped past the pages we have seen so look up where this page starts
+        if after_id is None:
+            after_id = await db.get_item_id_at(self.user_id, page_index * page_size - 1, self.folder_id)
+
+            if after_id is None:
+                return []
+
+            page_starts[page_index] = after_id
+
+        page = await db.get_items_page(self.user_id, ("id", "item_name"), after_id, page_size, self.folder_id)
+
+        if page.next_cursor is not None:
+            page_starts[page_index + 1] = page.next_cursor
+
+        return page.rows
+
+
+class MemoryItemSource:
+    '''Shows a list of (id, item_name) tuples that is already in memory, used for search results'''
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def reset(self):
+        pass
+
+    def forget_after(self, item_id: int):
+        pass
+
+    async def count(self) -> int:
+        return len(self.rows)
+
+    async def get_page(self, page_index: int, page_size: int):
+        start = page_index * page_size
+        return self.rows[start:start + page_size]
+
+
+class VirtualItemList(ScrollView, can_focus=True):
+    '''A scrolling list of item names that only draws and loads the rows on screen'''
+
+    DEFAULT_CSS = """
+    VirtualItemList {
+        height: 1fr;
+    }
+
+    VirtualItemList > .virtual-item-list--cursor {
+        background: $accent;
+        color: $text;
+    }
+    """
+
+    COMPONENT_CLASSES = {"virtual-item-list--cursor"}
+
+    BINDINGS = [
+        Binding("up", "cursor_up", "Up", show=False),
+        Binding("down", "cursor_down", "Down", show=False),
+        Binding("pageup", "page_up", "Page up", show=False),
+        Binding("pagedown", "page_down", "Page down", show=False),
+        Binding("home", "first", "First", show=False),
+        Binding("end", "last", "Last", show=False),
+        Binding("enter", "select", "Select", show=False),
+    ]
+
+    # Number of rows loaded from the source at once
+    PAGE_SIZE = 200
+    # Number of pages kept in memory
+    MAX_CACHED_PAGES = 50
+
+    class Selected(Message):
+        '''This message is sent whenever a row is clicked or enter is pressed on it'''
+
+        def __init__(self, item_id: int):
+            self.item_id = item_id
+            super().__init__()
+
+    def __init__(self, source=None, id: str | None = None):
+        super().__init__(id=id)
+        self.source = source
+        self.row_count = 0
+        self.cursor = 0
+
+        # Loaded pages of (id, item_name) tuples keyed by page index
+        self.pages = TTLCache(self.MAX_CACHED_PAGES, ttl=float("inf"))
+        self.loading_pages = set()
+
+        # Bumped on every reload so pages that were loading before it are thrown away
+        self.generation = 0
+
+    def set_source(self, source):
+        '''Shows the rows of a different source starting from the top'''
+        self.source = source
+        self.cursor = 0
+        self.scroll_to(y=0, animate=False)
+        self.reload()
+
+    # A newer reload cancels one that is still waiting on the source
+    @work(exclusive=True, group="reload")
+    async def reload(self):
+        '''Reloads the rows from the source, keeping the scroll position and cursor'''
+        if self.source is None:
+            return
+
+        self.source.reset()
+        row_count = await self.source.count()
+
+        self.forget_loading_pages()
+        self.pages.clear()
+        self.set_row_count(row_count)
+
+    # These apply a change to the list without reloading it
+    # Pages that have to change are dropped and loaded again only if they are on screen
+
+    def rows_added(self, item_ids):
+        '''New items always have the highest ids so they go on the end of the list'''
+        old_row_count = self.row_count
+        self.forget_loading_pages()
+
+        # Only the last page grows
+        self.pages.invalidate(old_row_count // self.PAGE_SIZE)
+        self.set_row_count(old_row_count + len(item_ids))
+
+    def rows_deleted(self, item_ids):
+        '''Every row after the first deleted one moves up'''
+        first_id = min(item_ids)
+        self.forget_loading_pages()
+
+        for page_index in self.pages.keys():
+            page = self.pages.get(page_index)
+
+            if not page or page[-1][0] >= first_id:
+                self.pages.invalidate(page_index)
+
+        self.source.forget_after(first_id)
+        self.set_row_count(self.row_count - len(item_ids))
+
+    def rows_updated(self, items):
+        '''Takes (id, item_name) tuples and changes the names of the rows that are loaded'''
+        new_names = dict(items)
+
+        for page_index in self.pages.keys():
+            page = self.pages.get(page_index) or []
+
+            for offset, (item_id, item_name) in enumerate(page):
+                if item_id in new_names:
+                    page[offset] = (item_id, new_names[item_id])
+
+        self.refresh()
+
+    def forget_loading_pages(self):
+        # Pages that are still loading may be from before the change
+        self.generation += 1
+        self.loading_pages.clear()
+
+    def set_row_count(self, row_count: int):
+        self.row_count = max(row_count, 0)
+        self.cursor = max(0, min(self.cursor, self.row_count - 1))
+        # Width 0 so the list never scrolls sideways
+        self.virtual_size = Size(0, self.row_count)
+        self.refresh()
+
+    def get_row(self, row: int):
+        '''Returns the (id, item_name) tuple for a row or None if it isn't loaded yet'''
+        page_index, offset = divmod(row, self.PAGE_SIZE)
+        page = self.pages.get(page_index)
+
+        if page is None:
+            self.request_page(page_index)
+            return None
+
+        if offset >= len(page):
+            return None
+
+        return page[offset]
+
+    def request_page(self, page_index: int):
+        if page_index in self.loading_pages:
+            return
+
+        self.loading_pages.add(page_index)
+        self.run_worker(self.load_page(page_index, self.generation), group="pages")
+
+    async def load_page(self, page_index: int, generation: int):
+        rows = await self.source.get_page(page_index, self.PAGE_SIZE)
+
+        # The list was reloaded while we were waiting
+        if generation != self.generation:
+            return
+
+        self.loading_pages.discard(page_index)
+        self.pages.put(page_index, rows)
+        self.refresh()
+
+    def render_line(self, y: int) -> Strip:
+        row = self.scroll_offset.y + y
+        width = self.scrollable_content_region.width
+
+        if row >= self.row_count:
+            return Strip.blank(width, self.rich_style)
+
+        item = self.get_row(row)
+        text = " ..." if item is None else f" {item[1]}"
+
+        if row == self.cursor:
+            style = self.get_component_rich_style("virtual-item-list--cursor")
+        else:
+            style = self.rich_style
+
+        return Strip([Segment(text, style)]).adjust_cell_length(width, style)
+
+    def move_cursor(self, row: int):
+        if self.row_count == 0:
+            return
+
+        self.cursor = max(0, min(row, self.row_count - 1))
+
+        # Scroll just enough to keep the cursor on screen
+        height = self.scrollable_content_region.height
+        top = self.scroll_offset.y
+
+        if self.cursor < top:
+            self.scroll_to(y=self.cursor, animate=False)
+        elif self.cursor >= top + height:
+            self.scroll_to(y=self.cursor - height + 1, animate=False)
+
+        self.refresh()
+
+    def action_cursor_up(self):
+        self.move_cursor(self.cursor - 1)
+
+    def action_cursor_down(self):
+        self.move_cursor(self.cursor + 1)
+
+    def action_page_up(self):
+        self.move_cursor(self.cursor - self.scrollable_content_region.height)
+
+    def action_page_down(self):
+        self.move_cursor(self.cursor + self.scrollable_content_region.height)
+
+    def action_first(self):
+        self.move_cursor(0)
+
+    def action_last(self):
+        self.move_cursor(self.row_count - 1)
+
+    def action_select(self):
+        item = self.get_row(self.cursor)
+
+        # Rows that haven't loaded yet can't be selected
+        if item is not None:
+            self.post_message(self.Selected(item_id=item[0]))
+
+    def on_click(self, event) -> None:
+        offset = event.get_content_offset(self)
+
+        if offset is None:
+            return
+
+        row = self.scroll_offset.y + offset.y
+
+        if row < self.row_count:
+            self.move_cursor(row)
+            self.action_select()
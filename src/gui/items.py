@@ -2,7 +2,18 @@ from textual.app import ComposeResult
 from textual.containers import Horizontal, VerticalScroll, Container, Vertical
 from textual.reactive import reactive
 from textual.widgets import Input, Label, Button, Static
+from textual import work
+import sqlite3
 from gui.app_state import db
+from database import ConflictError, Database
+from importer import import_file, ImportFileError
+from item_store import SUMMARY_COLUMNS
+from log import get_logger
+
+logger = get_logger(__name__)
+
+# Shown in place of a password that is hidden
+PASSWORD_MASK = "........"
 
 
 # Shows the contents of a selected item
@@ -13,6 +24,7 @@ class ItemView(VerticalScroll):
     # 0 for show nothing
     # 1 for show item details
     # 2 for create new item
+    # 3 for import items
     template_chosen = reactive(0)
 
     def compose(self):
@@ -31,8 +43,6 @@ class ItemView(VerticalScroll):
 
     # Updates our container so it can show the widget we need
     def update_display(self):
-        self.refresh_folder_list()
-
         # Erase all the currently displayed widgets
         self.container.remove_children()
 
@@ -43,6 +53,8 @@ class ItemView(VerticalScroll):
                 self.container.mount(ShowItemDetails())
             case 2:
                 self.container.mount(CreatNewItemScreen())
+            case 3:
+                self.container.mount(ImportItemsScreen())
 
     # This function is called every time the displayed item needs to be updated
     def update_item_details(self, new_id: int):
@@ -55,6 +67,7 @@ class ItemView(VerticalScroll):
         # Refresh so changes can be shown
         item_details.refresh()
 
+    # Only needed after an import, other changes reach the list as events from the database
     def refresh_folder_list(self):
         # Access main page widget
         self.parent.parent.refresh_item_list()
@@ -113,10 +126,6 @@ class CreatNewItemScreen(Vertical):
 
             case "save_button_create_item":
                 self.save_button_logic()
-                # Access out ItemView widget
-                self.parent.parent.template_chosen = 0
-                self.parent.parent.update_display()
-                self.parent.parent.refresh_folder_list()
 
             case "cancel_button_create_item":
                 self.cancel_button_logic()
@@ -124,7 +133,9 @@ class CreatNewItemScreen(Vertical):
             case _:
                 pass
 
-    def save_button_logic(self):
+    # Runs as a worker so saving doesn't block the ui
+    @work(exclusive=True)
+    async def save_button_logic(self):
         '''This function handles getting the inputted name, username and password and saving it to the database'''
 
         item_name = self.query_one(
@@ -143,13 +154,17 @@ class CreatNewItemScreen(Vertical):
             label.update("You must enter a name, username and password!")
             return
 
-        print(f"Item: {item_name}")
-        print(f"Username: {username}")
-        print(f"Password: {password}")
-        print(f"Label: {label}")
+        # Never log the username or password
+        logger.debug("Saving new item")
+
+        # Finally add the item to the database, in the folder that is open
+        await db.add_item(self.app.logged_in_user_id, item_name, username, password,
+                          folder_id=getattr(self.screen, "folder_id", None))
 
-        # Finally add the item to the database
-        db.add_item(self.app.logged_in_user_id, item_name, username, password)
+        # Access out ItemView widget
+        item_view = self.parent.parent
+        item_view.template_chosen = 0
+        item_view.update_display()
 
     def cancel_button_logic(self):
         # Reset all the values to zero
@@ -167,6 +182,89 @@ class CreatNewItemScreen(Vertical):
         self.parent.parent.update_display()
 
 
+# This is the screen displayed whenever the
+# import button is clicked
+class ImportItemsScreen(Vertical):
+    '''Widget that's shown to import items from another password manager'''
+
+    def compose(self) -> ComposeResult:
+        yield Container(
+            Vertical(
+                Label("Import a .csv, .json or .jsonl export"),
+                Input(placeholder="path to file", id="path_input_import"),
+                Label("", id="info_for_user_label_import"),
+
+                id="form_container_import"
+            ),
+
+            Horizontal(
+                Button(label="Import", id="import_button_import"),
+                Button(label="Cancel", id="cancel_button_import"),
+                id="button_row_import"
+            ),
+
+            id="import_container"
+        )
+
+    def on_button_pressed(self, event: Button.Pressed) -> None:
+        match event.button.id:
+            case "import_button_import":
+                path = self.query_one("#path_input_import", Input).value.strip()
+
+                if path == "":
+                    self.update_status("You must enter the path of a file!")
+                    return
+
+                self.query_one("#import_button_import", Button).disabled = True
+                self.import_items(path, self.app.logged_in_user_id)
+
+            case "cancel_button_import":
+                self.parent.parent.template_chosen = 0
+                self.parent.parent.update_display()
+
+    def update_status(self, message: str):
+        self.query_one("#info_for_user_label_import", Label).update(message)
+
+    # Runs on a separate thread so the app stays responsive during large imports
+    @work(thread=True, exclusive=True)
+    def import_items(self, path: str, user_id: int):
+        import_db = None
+        message = "Import failed"
+
+        def progress(imported: int):
+            self.app.call_from_thread(
+                self.update_status, f"Imported {imported} items...")
+
+        try:
+            # sqlite connections can't be shared between threads so the import gets its own
+            import_db = Database()
+            # So the items are encrypted with the data key of the user
+            import_db.set_data_key(user_id, self.app.session.data_key)
+
+            imported = import_file(import_db, user_id, path, progress=progress)
+            message = f"Imported {imported} items"
+
+        except (ImportFileError, OSError, ValueError) as e:
+            message = f"Import failed: {e}"
+
+        except sqlite3.Error as e:
+            logger.error("Database error: %s", e)
+            message = "Import failed: the vault could not be written"
+            self.app.call_from_thread(self.notify, message, severity="error")
+
+        finally:
+            if import_db is not None:
+                import_db.close()
+
+            # The button has to come back even if the import blew up
+            self.app.call_from_thread(self.import_finished, message)
+
+    def import_finished(self, message: str):
+        self.update_status(message)
+        self.query_one("#import_button_import", Button).disabled = False
+        self.parent.parent.refresh_folder_list()
+
+
 # This is the screen shown whenever a
 # Item is selected to show its details
 class ShowItemDetails(VerticalScroll):
@@ -203,13 +301,13 @@ class ShowItemDetails(VerticalScroll):
     def on_mount(self) -> None:
         self.is_mounted = True
         self.show_password = False
-        self.get_item_details()
+        self.show_item()
 
     def on_button_pressed(self, event: Button.Pressed):
         match event.button.id:
             case "edit_button":
                 # Not implemented yet
-                print("Not implemented yet")
+                logger.info("Editing items is not implemented yet")
 
             case "delete_button":
                 self.delete_logic()
@@ -221,34 +319,79 @@ class ShowItemDetails(VerticalScroll):
                 else:
                     self.show_password = False
 
-                self.get_item_details()
+                self.show_item()
 
     # Called whenever the item_id variable is updated
     def watch_item_id(self, old_val, new_val):
         self.show_password = False
         if not self.is_mounted:
-            print("Not mounted")
             return
 
-        self.get_item_details()
+        self.show_item()
+
+    def show_item(self):
+        '''Shows the selected item, the name and username come from the item store of the session
+        The database is only asked when the password is shown or the store hasn't loaded yet'''
+        item = self.app.session.items.get(self.item_id)
+
+        if item is None or self.show_password:
+            self.get_item_details()
+            return
+
+        # Cancels a lookup for the item that was selected before
+        self.workers.cancel_group(self, "item_details")
+        self.update_labels(item.item_name, item.username, None)
+
+    @work(exclusive=True, group="delete_item")
+    async def delete_logic(self):
+        logger.debug("Deleting item %s", self.item_id)
 
-    def delete_logic(self):
-        print(f"item: {self.item_id}")
-        db.delete_item(self.item_id)
+        # Only the version that is shown is deleted, not one another process saved since
+        item = self.app.session.items.get(self.item_id)
+        version = item.version if item is not None else None
 
+        try:
+            await db.delete_item(self.item_id, version)
+
+        except ConflictError as e:
+            logger.warning("%s", e)
+            self.notify("This item was changed somewhere else, check it before deleting it", severity="warning")
+
+            # Show the item as it is now so deleting again deletes what is on screen
+            self.app.session.items.put_many(await db.get_items_by_id((self.item_id,), SUMMARY_COLUMNS))
+            self.show_item()
+            return
+
+        self.close_item()
+
+    def close_item(self):
         self.parent.parent.template_chosen = 0
         self.parent.parent.update_display()
 
-    def get_item_details(self):
+    # Runs as a worker, changing the selected item cancels a lookup that hasn't finished
+    @work(exclusive=True, group="item_details")
+    async def get_item_details(self):
         # Updates the values of name. Username and password
-        name, username, password = db.get_item_details(self.item_id)
+        details = await db.get_item_details(self.item_id)
+
+        if details is None:
+            # The item doesn't exist anymore, e.g. another process deleted it
+            if await db.get_item_owner(self.item_id) is None:
+                self.notify("This item was deleted somewhere else", severity="warning")
+                self.close_item()
+
+            return
+
+        self.update_labels(*details)
 
+    def update_labels(self, name: str, username: str, password: str | None):
         self.query_one("#name_label_details").update(f"Name: {name}")
         self.query_one("#username_label_details", Label).update(
             f"Username: {username}")
 
-        if not self.show_password:
-            password = len(password) * "."
+        # The length of the password isn't given away while it is hidden
+        if password is None or not self.show_password:
+            password = PASSWORD_MASK
 
         self.query_one("#password_label_details", Label).update(
             f"Password: {password}")
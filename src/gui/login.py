@@ -9,10 +9,9 @@ from textual.app import ComposeResult
 from textual.containers import Vertical, Horizontal, Container
 from textual.widgets import Input, Label, Button, Footer
 from textual.screen import Screen
-from utils import convert_to_int
 from gui.app_state import db
-from gui.main_page import MainPage
 from textual.binding import Binding
+from textual import work
 
 
 class LoginPage(Screen):
@@ -86,7 +85,9 @@ class LoginPage(Screen):
                                    Input).password = True
                     self.refresh()
 
-    def handle_login(self):
+    # Runs as a worker so the ui keeps drawing while the user is checked
+    @work(exclusive=True)
+    async def handle_login(self):
         '''This function handles all  related to logging in the user'''
 
         username = self.query_one(
@@ -95,8 +96,11 @@ class LoginPage(Screen):
             "#password_input_login", Input).value.strip()
 
         # Checks if the user exists or has the correct password
-        if self.validate_user(username, password):
+        if await self.validate_user(username, password):
             # Go to the main screen
+            # Imported here so the main page and everything it needs isn't loaded before the login page is shown
+            from gui.main_page import MainPage
+
             self.app.switch_screen(MainPage())
 
         else:
@@ -107,30 +111,19 @@ class LoginPage(Screen):
             self.query_one("#login_label", Label).update(
                 "Incorrect username or password")
 
-    def validate_user(self, username: str, password: str) -> bool:
+    async def validate_user(self, username: str, password: str) -> bool:
         '''This function validates a user given a password and user name
         It will return true if the user is valid and false if not'''
 
-        global logged_in_user_id
-
-        # If the user is found in the database
-        if db.is_user_exists(username):
-            id = db.get_user_id(username)
-
-            # Handle the int|None object
-            id = convert_to_int(id)
-            if id == 0:
-                return False
-
-            # The password of the user we got from the database
-            pass_from_db = db.get_password(id)
+        # Looks up the user and checks the password in one go
+        session = await db.authenticate(username, password)
 
-            # Check if the passwords are equal
-            if password == pass_from_db:
-                self.app.logged_in_user_id = id
-                return True
+        if session is None:
+            return False
 
-        return False
+        self.app.session = session
+        self.app.logged_in_user_id = session.user_id
+        return True
 
 
 # The page where a user can create a new user account
@@ -186,7 +179,8 @@ class NewUserPage(Screen):
                     self.query_one("#new_userpage_password_input",
                                    Input).password = True
 
-    def handle_user_creation(self):
+    @work(exclusive=True)
+    async def handle_user_creation(self):
         '''This function will get the inputs from the user and handle the process of creating a user'''
 
         username = self.query_one(
@@ -210,11 +204,11 @@ class NewUserPage(Screen):
 
         # Check if the account already exists
         # if it does tell the user it exists
-        if db.is_user_exists(username):
+        if await db.is_user_exists(username):
             self.query_one("#user_creation_message", Label).update(
                 "User already exists")
         else:
             # Create the user and add them to the database
-            db.add_user(username, password)
+            await db.add_user(username, password)
             self.app.pop_screen()
             # This comment stops a weird saving bug with my editor
@@ -1,21 +1,159 @@
 from textual.app import ComposeResult
-from textual.containers import Horizontal, VerticalScroll
-from textual.widgets import Label, Button, ListItem, ListView, Footer
+from textual.containers import Horizontal, Vertical
+from textual.widgets import Label, Button, Footer, Input, Tree
 from textual.screen import Screen
 from textual.message import Message
+from textual.binding import Binding
+from textual import work
+import asyncio
+import sqlite3
+from collections import defaultdict
 from gui.app_state import db
-from gui.items import ItemView
+from gui.items import ItemView, ShowItemDetails
+from gui.item_list import DatabaseItemSource, MemoryItemSource, VirtualItemList
+from events import ItemsAdded, ItemsDeleted, ItemsMoved, ItemsUpdated
+from search import TrigramIndex
+from item_store import SUMMARY_COLUMNS
+import instrumentation
+from log import get_logger
 
+logger = get_logger(__name__)
 
-class FolderView(VerticalScroll):
+# Max number of results shown when searching
+SEARCH_LIMIT = 500
+
+
+class FolderView(Vertical):
     '''This widget holds all logic related to displaying the folders'''
 
+    DEFAULT_CSS = """
+    FolderView {
+        width: 32;
+    }
+
+    FolderView Tree {
+        height: 1fr;
+    }
+    """
+
+    # Our message for whenever a folder is selected
+    class Selected(Message):
+        '''This message is sent whenever a folder is selected, folder_id is None for every item'''
+
+        def __init__(self, folder_id: int | None, name: str):
+            self.folder_id = folder_id
+            self.name = name
+            super().__init__()
+
+    def __init__(self):
+        super().__init__()
+
+        # The folder that is selected, None for every item
+        self.folder_id = None
+
     def compose(self) -> ComposeResult:
-        yield Label("Folders go here")
+        yield Tree("All items", id="folder_tree")
+        yield Input(placeholder="new folder", id="new_folder_input")
+        yield Button(label="Delete folder", id="delete_folder_button")
+
+    async def on_mount(self):
+        self.query_one(Tree).root.expand()
+
+        # The counts change whenever items are added, deleted or moved
+        await db.subscribe(self.on_database_event)
+
+        self.load_folders()
+
+    async def on_unmount(self):
+        await db.unsubscribe(self.on_database_event)
+
+    def on_database_event(self, event):
+        if event.user_id == self.app.logged_in_user_id and not isinstance(event, ItemsUpdated):
+            self.load_folders()
+
+    # A newer load cancels one that hasn't finished
+    @work(exclusive=True, group="load_folders")
+    async def load_folders(self):
+        '''Reads every folder with its stored count in one query and redraws the tree'''
+        user_id = self.app.logged_in_user_id
+        folders = await db.get_folders(user_id)
+        total = await db.count_items(user_id)
+
+        self.show_folders(folders, total)
+
+    def show_folders(self, folders, total: int):
+        tree = self.query_one(Tree)
+
+        # Keep the folders that were open open
+        expanded = set()
+        nodes = [tree.root]
+
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.children)
+
+            if node.is_expanded:
+                expanded.add(node.data)
+
+        children = defaultdict(list)
+
+        for folder in folders:
+            children[folder.parent_id].append(folder)
+
+        # A folder shows the items in it and in every folder inside it
+        def subtree_count(folder) -> int:
+            return folder.item_count + sum(subtree_count(child) for child in children[folder.id])
+
+        def add_folders(node, parent_id):
+            for folder in children[parent_id]:
+                child = node.add(f"{folder.name} ({subtree_count(folder)})",
+                                 data=folder.id, expand=folder.id in expanded)
+                add_folders(child, folder.id)
+
+        tree.clear()
+        tree.root.set_label(f"All items ({total})")
+        add_folders(tree.root, None)
+
+        # The selected folder was deleted so go back to every item
+        if self.folder_id is not None and not any(folder.id == self.folder_id for folder in folders):
+            self.select_folder(None, "All items")
+
+    def select_folder(self, folder_id: int | None, name: str):
+        self.folder_id = folder_id
+        self.post_message(self.Selected(folder_id, name))
+
+    def on_tree_node_selected(self, event: Tree.NodeSelected):
+        event.stop()
+        # The label has the count on the end
+        name = str(event.node.label).rsplit(" (", 1)[0]
+        self.select_folder(event.node.data, name)
+
+    # New folders go inside the selected folder
+    @work(group="folder_changes")
+    async def on_input_submitted(self, event: Input.Submitted):
+        if event.input.id != "new_folder_input":
+            return
+
+        name = event.value.strip()
+
+        if name == "":
+            return
+
+        event.input.value = ""
+        await db.add_folder(self.app.logged_in_user_id, name, self.folder_id)
+
+    @work(group="folder_changes")
+    async def on_button_pressed(self, event: Button.Pressed):
+        if event.button.id != "delete_folder_button" or self.folder_id is None:
+            return
+
+        # The items in it are kept, they just aren't in a folder anymore
+        await db.delete_folder(self.folder_id)
 
 
 # Shows the contents of a selected folder
-class FolderContentView(VerticalScroll):
+# The list scrolls itself so this is a Vertical and not a VerticalScroll
+class FolderContentView(Vertical):
     '''This shows the contents of a selected folder'''
 
     # Our message for whenever an item is selected
@@ -23,7 +161,6 @@ class FolderContentView(VerticalScroll):
         '''This message is sent whenever an item from the list is selected'''
 
         def __init__(self, item_id: int):
-            print(f"The item id inside slected: {item_id}")
             self.item_id = item_id
             super().__init__()
 
@@ -33,55 +170,215 @@ class FolderContentView(VerticalScroll):
         def __init__(self):
             super().__init__()
 
+    class ImportItems(Message):
+        '''This message is sent whenever the import button is pressed'''
+
+        def __init__(self):
+            super().__init__()
+
     def __init__(self):
-        print("Sending Message")
         super().__init__()
 
+        # The folder being shown, None for every item
+        self.folder_id = None
+
+        # Built in the background once the view is shown, None until then
+        self.search_index = None
+        # Events that arrive while the items are loading, applied once they are ready
+        self.pending_events = []
+        self.item_source = None
+
     def compose(self) -> ComposeResult:
-        yield Label("Folder content")
-        yield ListView(id="folder_content_list")
+        yield Label("All items", id="folder_name_label")
+        yield Input(placeholder="search", id="search_input")
+        yield VirtualItemList(id="folder_content_list")
         yield Button(label="+", id="create_new_item")
+        yield Button(label="Import", id="import_items")
 
-    def on_mount(self):
-        self.refresh_list()
+    async def on_mount(self):
+        self.item_source = DatabaseItemSource(self.app.logged_in_user_id)
+        self.query_one(VirtualItemList).set_source(self.item_source)
+
+        # Keep the list up to date as items change
+        await db.subscribe(self.on_database_event)
+
+        self.load_items()
+
+    def show_folder(self, folder_id: int | None, name: str):
+        '''Shows the items of a folder, only its rows are read from the database'''
+        self.folder_id = folder_id
+        self.query_one("#folder_name_label", Label).update(name)
+
+        self.item_source = DatabaseItemSource(self.app.logged_in_user_id, folder_id)
+
+        # Search results come from every folder so they stay as they are
+        if not self.searching():
+            self.query_one(VirtualItemList).set_source(self.item_source)
+
+    # A newer load cancels one that hasn't finished
+    @work(exclusive=True, group="load_items")
+    async def load_items(self):
+        '''Loads the item store of the session with one query and builds the search index from it'''
+        store = self.app.session.items
+
+        if not store.loaded:
+            page = await db.get_items_page(self.app.logged_in_user_id, SUMMARY_COLUMNS, 0, -1)
+            store.load(page.rows)
+
+        # Building takes a while for big vaults so keep it off the event loop
+        with instrumentation.timed("gui.build_search_index"):
+            index = await asyncio.to_thread(
+                TrigramIndex, [(item.id, item.item_name) for item in store])
+
+        self.search_index = index
+
+        for event in self.pending_events:
+            self.apply_event(event)
+
+        self.pending_events = []
+        self.show_search_results()
+
+    def searching(self) -> bool:
+        return self.query_one("#search_input", Input).value.strip() != ""
+
+    def on_input_changed(self, event: Input.Changed):
+        if event.input.id == "search_input":
+            self.show_search_results(from_top=True)
+
+    def show_search_results(self, from_top: bool = False):
+        '''Shows the items matching the search box or every item if it is empty'''
+        item_list = self.query_one(VirtualItemList)
+
+        if not self.searching():
+            if item_list.source is not self.item_source:
+                item_list.set_source(self.item_source)
+            return
+
+        # The index is still being built, this is called again once it's ready
+        if self.search_index is None:
+            results = []
+        else:
+            with instrumentation.timed("gui.search"):
+                results = self.search_index.search(
+                    self.query_one("#search_input", Input).value, SEARCH_LIMIT)
+
+        if from_top:
+            item_list.set_source(MemoryItemSource(results))
+        else:
+            # Keeps the cursor where it is
+            item_list.source = MemoryItemSource(results)
+            item_list.reload()
+
+    @work(group="apply_event")
+    async def apply_event(self, event):
+        '''Applies a change from the database to the item store and the search index'''
+        store = self.app.session.items
+
+        match event:
+            case ItemsAdded() | ItemsUpdated():
+                items = await db.get_items_by_id(event.item_ids, SUMMARY_COLUMNS)
+
+                # reload_items can drop the index before this starts or while it waits for the items
+                if self.wait_for_index(event):
+                    return
+
+                store.put_many(items)
+                self.search_index.add_many((item.id, item.item_name) for item in items)
+            case ItemsDeleted():
+                if self.wait_for_index(event):
+                    return
+
+                store.remove_many(event.item_ids)
+
+                for item_id in event.item_ids:
+                    self.search_index.remove(item_id)
+
+        if self.searching():
+            self.show_search_results()
+        elif isinstance(event, ItemsUpdated):
+            # The names on screen are changed now that the store has them
+            self.query_one(VirtualItemList).rows_updated(
+                (item_id, store.get(item_id).item_name) for item_id in event.item_ids if item_id in store)
+
+    def wait_for_index(self, event) -> bool:
+        '''Keeps the event for load_items if the items are being loaded again, returns True if it did
+        Applying it twice is harmless so it doesn't matter if the new load already has the change'''
+        if self.search_index is not None:
+            return False
+
+        self.pending_events.append(event)
+        return True
+
+    async def on_unmount(self):
+        await db.unsubscribe(self.on_database_event)
+
+    def on_database_event(self, event):
+        '''Applies a change from the database to the list, see events.py'''
+        if event.user_id != self.app.logged_in_user_id:
+            return
+
+        if self.search_index is None:
+            self.pending_events.append(event)
+        else:
+            self.apply_event(event)
+
+        # The search results are redone once the index has the change
+        if self.searching():
+            return
+
+        item_list = self.query_one(VirtualItemList)
+
+        # Updated rows are renamed once the store has their new names
+        match event:
+            case ItemsAdded():
+                # Items added to another folder aren't in this list
+                if self.folder_id is None or event.folder_id == self.folder_id:
+                    item_list.rows_added(event.item_ids)
+            case ItemsDeleted():
+                # Every deleted item was in the list of every item but maybe not in this folder
+                if self.folder_id is None:
+                    item_list.rows_deleted(event.item_ids)
+                else:
+                    item_list.reload()
+            case ItemsMoved():
+                # The list of every item doesn't change when items change folder
+                if self.folder_id is not None:
+                    item_list.reload()
+
+    def reload_items(self):
+        '''Loads every item again, used when another process changed them
+        Events only come for changes made through this app so the store can't be patched up'''
+        self.app.session.items.loaded = False
+
+        # Events that arrive during the load wait for the new index
+        self.search_index = None
+        self.load_items()
+        self.query_one(VirtualItemList).reload()
 
     def refresh_list(self):
         '''This is a function that will refresh the list and should be
         called every time a new item is created or an item is deleted'''
-        print("Refreshing list")
-        list = self.query_one("#folder_content_list")
-        list.clear()
-
-        # Get all of our item names and turn them into a list item
-        for item in db.get_all_items_names(self.app.logged_in_user_id):
-            print(f"ITem: {item}")
-            # Change this to where it only gets the names
-            list.append(ListItem(Label(*item)))
+        logger.debug("Refreshing list")
+        # Only the rows on screen are loaded again
+        self.query_one(VirtualItemList).reload()
 
     # Called whenever one of the list items is clicked
-    def on_list_view_selected(self, event: ListView.Selected):
+    def on_virtual_item_list_selected(self, event: VirtualItemList.Selected):
         '''
         This is called whenever an item from the list is selected
         '''
-
-        # Gets the label that holds our selected item name
-
-        label = event.item.query_one(Label)
-        item_name = label.renderable
-
-        # Get the id of the item from the database
-        print(f"Item name: {item_name}")
-        id = db.get_item_id(item_name)
-
-        print(f"The collected item id: {id}")
-
-        self.post_message(self.Selected(item_id=id))
+        # Every row already knows the id of its item so there is nothing to look up
+        event.stop()
+        self.post_message(self.Selected(item_id=event.item_id))
 
     # Called Whenever a button is pressed in this widget
     def on_button_pressed(self, event: Button.Pressed):
-        # Whenever the create new user button is pressed
         # Send the message to update the ItemView
-        self.post_message(self.CreateNewItem())
+        match event.button.id:
+            case "create_new_item":
+                self.post_message(self.CreateNewItem())
+            case "import_items":
+                self.post_message(self.ImportItems())
 
 
 # This is the screen where everything in this file is displayed
@@ -94,14 +391,48 @@ class MainPage(Screen):
     CSS_PATH = ["../assets/new_user_page.tcss",
                 "../assets/creat_new_item.tcss"]
 
+    BINDINGS = [
+        Binding(key="ctrl+l", action="logout", description="Log out"),
+        Binding(key="ctrl+k", action="rotate_key", description="Rotate key"),
+    ]
+
+    # The folder new items are added to, None for no folder
+    folder_id = None
+
     def compose(self) -> ComposeResult:
         yield Footer()
         yield Horizontal(
-            # FolderView(), Not enough time to implement this
+            FolderView(),
             FolderContentView(),
             ItemView(),
         )
 
+    def on_mount(self):
+        # Finish a key rotation that was stopped part way, e.g. by the app being closed
+        self.rotate_key(resume=True)
+        self.move_to_data_key(self.app.logged_in_user_id, self.app.session.data_key)
+
+        # Other windows, cli.py or agent.py can change the vault file while this one shows it
+        self.set_interval(db.profile.change_check_interval, self.check_external_changes)
+
+    async def check_external_changes(self):
+        '''Reloads the items, folders and the shown item if another process changed the items of the user'''
+        if not await db.check_external_changes(self.app.logged_in_user_id):
+            return
+
+        logger.info("Items were changed by another process, reloading them")
+
+        self.query_one(FolderContentView).reload_items()
+        self.query_one(FolderView).load_folders()
+
+        for item_details in self.query(ShowItemDetails):
+            item_details.get_item_details()
+
+    # Whenever a folder is selected
+    def on_folder_view_selected(self, message: FolderView.Selected) -> None:
+        self.folder_id = message.folder_id
+        self.query_one(FolderContentView).show_folder(message.folder_id, message.name)
+
     # Whenever the show item details message is sent
     def on_folder_content_view_selected(self, message: FolderContentView.Selected) -> None:
         # Get our item view widget
@@ -109,12 +440,11 @@ class MainPage(Screen):
 
         # Call the update function
         id = message.item_id
-        print(f"ID inside mina_page message receiver: {id}")
+        logger.debug("Showing item %s", id)
         item_view.update_item_details(id)
 
     # This function refreshes the list that shows the contents of a folder
     def refresh_item_list(self):
-        print("MainPage redfreshlist")
         self.query_one(FolderContentView).refresh_list()
 
     # Whenever the create new message is sent out
@@ -124,3 +454,81 @@ class MainPage(Screen):
         # Set the current template to the create new item template
         item_view.template_chosen = 2
         item_view.refresh()
+
+    # Whenever the import message is sent out
+    def on_folder_content_view_import_items(self, message: FolderContentView.ImportItems) -> None:
+        item_view = self.query_one(ItemView)
+
+        # Set the current template to the import items template
+        item_view.template_chosen = 3
+        item_view.refresh()
+
+    def action_rotate_key(self):
+        self.rotate_key()
+
+    # Re-encrypts the vault with a new key on a separate thread, the app can be used while it runs
+    @work(thread=True, exclusive=True, group="rotate_key")
+    def rotate_key(self, resume: bool = False):
+        # Imported here so the rotation code is only loaded when it is needed
+        from database import Database
+        import rotation
+
+        # sqlite connections can't be shared between threads so the rotation gets its own
+        rotation_db = Database()
+
+        try:
+            if resume:
+                rotated = rotation.resume_rotation(rotation_db)
+            else:
+                self.app.call_from_thread(self.notify, "Rotating the vault key...")
+                rotated = rotation.rotate_keys(rotation_db)
+
+        except (sqlite3.Error, OSError) as e:
+            logger.error("Key rotation failed: %s", e)
+            self.app.call_from_thread(
+                self.notify, "Key rotation failed, it will carry on next time", severity="error")
+            return
+
+        finally:
+            rotation_db.close()
+
+        if rotated or not resume:
+            self.app.call_from_thread(self.notify, f"Re-encrypted {rotated} passwords with the new key")
+
+    # Encrypts the items saved before the user had a data key with it on a separate thread
+    # Does nothing once every item has been moved
+    @work(thread=True, exclusive=True, group="move_to_data_key")
+    def move_to_data_key(self, user_id: int, data_key: bytes | None):
+        if data_key is None:
+            return
+
+        from database import Database
+        import rotation
+
+        move_db = Database()
+
+        try:
+            moved = rotation.move_to_data_key(move_db, user_id, data_key)
+
+        except sqlite3.Error as e:
+            logger.error("Moving items to the data key failed: %s", e)
+            return
+
+        finally:
+            move_db.close()
+
+        if moved:
+            logger.info("Moved %s items to the data key of user %s", moved, user_id)
+
+    # Ends the session and goes back to the login page
+    async def action_logout(self) -> None:
+        # Imported here because the login page imports this file
+        from gui.login import LoginPage
+
+        # Nothing decrypted is kept around once the user has logged out
+        await db.clear_cache()
+        await db.lock_user(self.app.logged_in_user_id)
+
+        self.app.session = None
+        self.app.logged_in_user_id = 0
+        self.app.switch_screen(LoginPage())
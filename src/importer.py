@@ -0,0 +1,196 @@
+# This file handles importing items exported from other password managers
+# Files are read lazily one row at a time so large exports never have to fit in memory
+# The rows are handed to Database.add_items which encrypts and inserts them in batches
+#
+# Supported formats:
+# 1 - CSV (Bitwarden, LastPass, Chrome, Firefox, 1Password, KeePass and anything with similar headers)
+# 2 - JSON Lines, one object per line with name, username and password keys
+# 3 - JSON (Bitwarden exports or a list of objects with name, username and password keys)
+#   ^ JSON has to be parsed in one go, use CSV or JSON Lines for very large vaults
+#
+# This file can also be run on its own to import without opening the app
+#   $ python ./importer.py --user <user_name> <file>
+
+import csv
+import json
+import os
+
+# The header names other password managers use for each of our fields
+# They are checked in order and compared in lower case
+NAME_HEADERS = ("name", "title", "account", "item", "url")
+USERNAME_HEADERS = ("username", "login_username", "login name", "login", "user", "email")
+PASSWORD_HEADERS = ("password", "login_password", "pass")
+
+
+class ImportFileError(Exception):
+    '''Raised when a file can't be understood'''
+
+
+def find_column(headers: list[str], candidates) -> str | None:
+    '''Returns the first header that matches one of the candidate names'''
+    lowered = {header.strip().lower(): header for header in headers}
+
+    for candidate in candidates:
+        if candidate in lowered:
+            return lowered[candidate]
+
+    return None
+
+
+def read_csv(path: str):
+    '''Yields (item_name, username, password) tuples from a csv export'''
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+
+        if reader.fieldnames is None:
+            return
+
+        name_column = find_column(reader.fieldnames, NAME_HEADERS)
+        username_column = find_column(reader.fieldnames, USERNAME_HEADERS)
+        password_column = find_column(reader.fieldnames, PASSWORD_HEADERS)
+
+        if name_column is None or password_column is None:
+            raise ImportFileError(
+                f"Could not find a name and password column in {path}")
+
+        try:
+            for row in reader:
+                item = make_item(
+                    row.get(name_column),
+                    row.get(username_column) if username_column else None,
+                    row.get(password_column),
+                )
+
+                if item is not None:
+                    yield item
+
+        except csv.Error as e:
+            raise ImportFileError(
+                f"Line {reader.line_num} of {path} is not valid csv: {e}")
+
+
+def read_json_lines(path: str):
+    '''Yields (item_name, username, password) tuples from a JSON Lines file'''
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+
+            if line == "":
+                continue
+
+            item = item_from_object(json.loads(line))
+
+            if item is not None:
+                yield item
+
+
+def read_json(path: str):
+    '''Yields (item_name, username, password) tuples from a JSON export'''
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    # Bitwarden puts everything under an items key
+    if isinstance(data, dict):
+        data = data.get("items", [])
+
+    if not isinstance(data, list):
+        raise ImportFileError(f"Could not find a list of items in {path}")
+
+    for obj in data:
+        item = item_from_object(obj)
+
+        if item is not None:
+            yield item
+
+
+def item_from_object(obj: dict):
+    '''Turns one JSON object into an item tuple'''
+    if not isinstance(obj, dict):
+        return None
+
+    # Bitwarden keeps the credentials inside a login object
+    login = obj.get("login") or {}
+
+    if not isinstance(login, dict):
+        raise ImportFileError(f"The login of an item is not an object: {login!r}")
+
+    fields = (
+        obj.get("name") or obj.get("title"),
+        obj.get("username") or login.get("username"),
+        obj.get("password") or login.get("password"),
+    )
+
+    for field in fields:
+        if field is not None and not isinstance(field, str):
+            raise ImportFileError(f"An item has a field that is not text: {field!r}")
+
+    return make_item(*fields)
+
+
+def make_item(item_name, username, password):
+    '''Cleans up the fields of an item, rows without a name are skipped'''
+    item_name = (item_name or "").strip()
+
+    if item_name == "":
+        return None
+
+    return (item_name, (username or "").strip(), password or "")
+
+
+def read_items(path: str):
+    '''Picks the right reader based on the file extension'''
+    extension = os.path.splitext(path)[1].lower()
+
+    match extension:
+        case ".csv":
+            return read_csv(path)
+        case ".jsonl":
+            return read_json_lines(path)
+        case ".json":
+            return read_json(path)
+        case _:
+            raise ImportFileError(f"Unsupported file type: {extension}")
+
+
+def import_file(db, user_id: int, path: str, batch_size: int = 1000, progress=None) -> int:
+    '''Imports every item in the file into the vault of the user
+    progress is called with the number of items imported so far
+    Returns the number of items imported'''
+    return db.add_items(user_id, read_items(path), batch_size=batch_size, progress=progress)
+
+
+def main():
+    import argparse
+    import getpass
+    from database import Database
+
+    parser = argparse.ArgumentParser(
+        description="Import items from another password manager")
+    parser.add_argument("file", help="The .csv, .json or .jsonl file to import")
+    parser.add_argument("--user", required=True,
+                        help="The user to import the items for")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    db = Database()
+    session = db.authenticate(args.user, getpass.getpass())
+
+    if session is None:
+        print("Incorrect username or password")
+        raise SystemExit(1)
+
+    def progress(imported: int):
+        print(f"\rImported {imported} items", end="", flush=True)
+
+    try:
+        imported = import_file(db, session.user_id, args.file,
+                               batch_size=args.batch_size, progress=progress)
+    except (ImportFileError, OSError, ValueError) as e:
+        print(f"Import failed: {e}")
+        raise SystemExit(1)
+
+    print(f"\rImported {imported} items")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# This file records where time goes while the app runs
+# Nothing is recorded until enable() is called and turning it off puts everything back
+# So when it is off there is no extra work at all, not even a check on every call
+#
+# What is recorded:
+#   ^ db.<method>     latency of every public Database method and the rows it returned
+#   ^ crypto.<call>   time spent in Fernet encrypting and decrypting
+#     ^ Only in this process, the workers of encrypt_many/decrypt_many aren't counted
+#   ^ sql.<statement> how many SELECT, INSERT, ... statements sqlite ran (sqlite trace callback)
+#   ^ sql.vm_steps    thousands of sqlite virtual machine steps (sqlite progress handler)
+#     ^ The sql ones need Database.set_sql_tracing(True) because they are set on the connection
+#   ^ Anything else can be timed with record() or the timed() context manager
+#
+# Latencies go into histograms with one bucket per power of two microseconds
+# So recording is a few integer operations and percentiles are read back from the buckets
+#
+# Usage:
+#   ^ instrumentation.enable()
+#   ^ instrumentation.snapshot() returns a MetricSnapshot for every name recorded so far
+#   ^ instrumentation.disable()
+
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import wraps
+
+# Number of histogram buckets, the last one holds everything slower than about 35 minutes
+BUCKET_COUNT = 32
+
+# Number of sqlite virtual machine steps between calls of the progress handler
+PROGRESS_STEPS = 1000
+
+# Database methods that are never timed
+# Generators are skipped too, they only do their work after they return so timing the call says nothing
+SKIPPED_METHODS = {"close", "subscribe", "unsubscribe", "set_sql_tracing", "debug_user"}
+
+enabled = False
+
+# Every recorded name maps to a Metric, the lock guards it
+metrics = {}
+lock = threading.Lock()
+
+# The original functions replaced by enable(), put back by disable()
+patched = []
+
+
+class Metric:
+    '''The histogram and totals for one name'''
+
+    __slots__ = ("count", "total", "max", "rows", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.buckets = [0] * BUCKET_COUNT
+
+
+@dataclass(frozen=True)
+class MetricSnapshot:
+    name: str
+    count: int
+    total_ms: float
+    mean_ms: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    max_ms: float
+    rows: int
+
+
+def record(name: str, seconds: float = 0.0, rows: int = 0):
+    '''Adds one call that took seconds and returned rows to the metric name'''
+    # Buckets are upper bounds of 1, 2, 4, 8, ... microseconds
+    bucket = min(int(seconds * 1_000_000).bit_length(), BUCKET_COUNT - 1)
+
+    with lock:
+        metric = metrics.get(name)
+
+        if metric is None:
+            metric = metrics[name] = Metric()
+
+        metric.count += 1
+        metric.total += seconds
+        metric.rows += rows
+        metric.buckets[bucket] += 1
+
+        if seconds > metric.max:
+            metric.max = seconds
+
+
+@contextmanager
+def timed(name: str):
+    '''Records how long the body of the with statement took, does nothing while disabled'''
+    if not enabled:
+        yield
+        return
+
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def bucket_percentile(metric: Metric, percent: float) -> float:
+    '''Returns the upper bound in seconds of the bucket holding the percentile'''
+    needed = metric.count * percent / 100
+    seen = 0
+
+    for bucket, count in enumerate(metric.buckets):
+        seen += count
+
+        if count and seen >= needed:
+            # The slowest call is a tighter bound for the last bucket
+            return min((1 << bucket) / 1_000_000, metric.max)
+
+    return metric.max
+
+
+def snapshot() -> list[MetricSnapshot]:
+    '''Returns the stats of every name recorded so far, sorted by total time'''
+    with lock:
+        result = [
+            MetricSnapshot(
+                name=name,
+                count=metric.count,
+                total_ms=metric.total * 1000,
+                mean_ms=metric.total / metric.count * 1000 if metric.count else 0.0,
+                p50_ms=bucket_percentile(metric, 50) * 1000,
+                p90_ms=bucket_percentile(metric, 90) * 1000,
+                p99_ms=bucket_percentile(metric, 99) * 1000,
+                max_ms=metric.max * 1000,
+                rows=metric.rows,
+            )
+            for name, metric in metrics.items()
+        ]
+
+    result.sort(key=lambda stats: stats.total_ms, reverse=True)
+    return result
+
+
+def reset():
+    '''Forgets everything recorded so far'''
+    with lock:
+        metrics.clear()
+
+
+def count_rows(result) -> int:
+    # Lists of rows and ItemPages, anything else counts as no rows
+    if isinstance(result, list):
+        return len(result)
+
+    rows = getattr(result, "rows", None)
+    return len(rows) if isinstance(rows, list) else 0
+
+
+def timed_function(name: str, function):
+    '''Returns a wrapper around the function that records every call under name'''
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        record(name, time.perf_counter() - start, count_rows(result))
+        return result
+
+    return wrapper
+
+
+class TimedFernet:
+    '''Wraps a Fernet and records the time of every encrypt and decrypt'''
+
+    def __init__(self, fernet):
+        self.fernet = fernet
+
+    def encrypt(self, data):
+        start = time.perf_counter()
+        token = self.fernet.encrypt(data)
+        record("crypto.encrypt", time.perf_counter() - start)
+        return token
+
+    def decrypt(self, token):
+        start = time.perf_counter()
+        data = self.fernet.decrypt(token)
+        record("crypto.decrypt", time.perf_counter() - start)
+        return data
+
+    def rotate(self, token):
+        start = time.perf_counter()
+        token = self.fernet.rotate(token)
+        record("crypto.rotate", time.perf_counter() - start)
+        return token
+
+
+def patch(owner, name: str, replacement):
+    patched.append((owner, name, getattr(owner, name)))
+    setattr(owner, name, replacement)
+
+
+def enable():
+    '''Starts recording Database and crypto calls'''
+    global enabled
+
+    if enabled:
+        return
+
+    import encrypt
+    from database import Database
+
+    for name, function in list(vars(Database).items()):
+        if name.startswith("_") or name in SKIPPED_METHODS or not inspect.isfunction(function):
+            continue
+
+        if inspect.isgeneratorfunction(function):
+            continue
+
+        patch(Database, name, timed_function(f"db.{name}", function))
+
+    # Everything in encrypt gets its Fernet from get_fernet or get_user_fernet so wrapping what they return covers them all
+    get_fernet = encrypt.get_fernet
+    get_user_fernet = encrypt.get_user_fernet
+    patch(encrypt, "get_fernet", lambda: TimedFernet(get_fernet()))
+    patch(encrypt, "get_user_fernet", lambda data_key: (
+        encrypt.get_fernet() if data_key is None else TimedFernet(get_user_fernet(data_key))))
+
+    enabled = True
+
+
+def disable():
+    '''Stops recording and puts back every function enable() replaced, what was recorded is kept'''
+    global enabled
+
+    while patched:
+        owner, name, original = patched.pop()
+        setattr(owner, name, original)
+
+    enabled = False
+
+
+def trace_connection(conn, on: bool = True):
+    '''Counts the statements and virtual machine steps of a sqlite connection
+    Has to be called on the thread that owns the connection'''
+    if not on:
+        conn.set_trace_callback(None)
+        conn.set_progress_handler(None, 0)
+        return
+
+    def trace(statement: str):
+        # Statements run by triggers are passed in as comments
+        if statement.startswith("--"):
+            record("sql.TRIGGER")
+            return
+
+        # The first word is enough to tell the kind of statement apart
+        words = statement.split(None, 1)
+        record(f"sql.{words[0].upper() if words else 'EMPTY'}")
+
+    def progress():
+        record("sql.vm_steps")
+        # Returning 0 lets the statement carry on
+        return 0
+
+    conn.set_trace_callback(trace)
+    conn.set_progress_handler(progress, PROGRESS_STEPS)
@@ -0,0 +1,56 @@
+# This file holds the item store, a copy of what the app needs to know about every item of the logged in user
+# It lives on the Session so it is thrown away when the user logs out
+#
+# How it is used:
+#   ^ It is loaded with one query right after logging in
+#   ^ Database events keep it up to date, only the changed items are read again
+#   ^ Widgets look items up by id here instead of asking the database
+#     ^ Selecting an item shows its name and username without a query
+#   ^ Passwords are never kept here, they are only read and decrypted when shown
+#   ^ The version of every item is kept so deleting it can tell if another process changed it first
+#
+# The items are kept in id order, the same order as the list
+
+from items import item_row_type
+
+# The columns kept for every item
+SUMMARY_COLUMNS = ("id", "item_name", "username", "version")
+ItemSummary = item_row_type(SUMMARY_COLUMNS)
+
+
+class ItemStore:
+    '''Maps item ids to an ItemSummary of the item'''
+
+    def __init__(self):
+        self.items = {}
+        # True once the first load has finished
+        self.loaded = False
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item_id: int):
+        return item_id in self.items
+
+    def __iter__(self):
+        return iter(self.items.values())
+
+    def get(self, item_id: int) -> ItemSummary | None:
+        return self.items.get(item_id)
+
+    def load(self, rows):
+        '''Replaces everything in the store with the rows'''
+        self.items = {row.id: row for row in rows}
+        self.loaded = True
+
+    def put_many(self, rows):
+        '''Adds new items or replaces the summaries of existing ones'''
+        items = self.items
+
+        for row in rows:
+            # New items always have the highest ids so adding them to the end keeps the order
+            items[row.id] = row
+
+    def remove_many(self, item_ids):
+        for item_id in item_ids:
+            self.items.pop(item_id, None)
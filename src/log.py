@@ -0,0 +1,118 @@
+# This file sets up logging for the app, use it instead of print
+#   ^ logger = get_logger(__name__)
+#   ^ logger.debug("Loaded item %s", item_id)
+#     ^ Pass the values as arguments instead of using an f-string
+#     ^ The message is then only built if the level is turned on, so debug calls cost almost nothing
+#
+# setup_logging() is called by the app once at start up
+#   ^ Records are put on a queue and written by a background thread so the ui thread never waits on the disk
+#   ^ They go to LOG_FILE (rotated once it gets big) and to a ring buffer holding the newest RING_SIZE records
+#   ^ Nothing is written to the terminal because that would draw over the Textual display
+#
+# Without setup_logging (the command line tools) warnings and errors go to stderr like print used to
+#
+# The level is WARNING unless the ARCANUM_LOG_LEVEL environment variable says otherwise
+#   $ ARCANUM_LOG_LEVEL=DEBUG python ./main.py
+
+import logging
+import os
+from collections import deque
+
+LOG_FILE = "./data/arcanum.log"
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# The log file is rotated at this size and this many old files are kept
+MAX_LOG_BYTES = 1024 * 1024
+LOG_BACKUPS = 3
+
+# Number of records kept in memory
+RING_SIZE = 1000
+
+# Every logger of the app is below this one
+ROOT_LOGGER = "arcanum"
+
+# Set by setup_logging
+ring_buffer = None
+listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+class RingBufferHandler(logging.Handler):
+    '''Keeps the newest records in memory, they are only formatted when they are read'''
+
+    def __init__(self, size: int = RING_SIZE):
+        super().__init__()
+        self.records = deque(maxlen=size)
+
+    def emit(self, record: logging.LogRecord):
+        self.records.append(record)
+
+    def recent(self, count: int | None = None) -> list[str]:
+        '''Returns the newest count records formatted, oldest first'''
+        records = list(self.records)
+
+        if count is not None:
+            records = records[-count:]
+
+        return [self.format(record) for record in records]
+
+
+def get_level(level: str | None = None) -> int:
+    name = (level or os.environ.get("ARCANUM_LOG_LEVEL") or "WARNING").upper()
+    value = logging.getLevelName(name)
+
+    # getLevelName gives back a string for names it doesn't know
+    return value if isinstance(value, int) else logging.WARNING
+
+
+def setup_logging(level: str | None = None, log_file: str = LOG_FILE):
+    '''Sends the logs of the app to the log file and the ring buffer from a background thread'''
+    global ring_buffer, listener
+
+    if listener is not None:
+        return
+
+    # Imported here because they pull in socket and pickle, which the command line tools never need
+    import logging.handlers
+    import queue
+
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(get_level(level))
+    # Keep the records away from the terminal
+    logger.propagate = False
+
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=MAX_LOG_BYTES, backupCount=LOG_BACKUPS, delay=True)
+    file_handler.setFormatter(formatter)
+
+    ring_buffer = RingBufferHandler()
+    ring_buffer.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(records))
+
+    listener = logging.handlers.QueueListener(records, file_handler, ring_buffer)
+    listener.start()
+
+
+def shutdown_logging():
+    '''Writes out the records still on the queue and stops the background thread'''
+    global listener
+
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+def recent_logs(count: int | None = None) -> list[str]:
+    '''Returns the newest records from the ring buffer, empty if setup_logging wasn't called'''
+    if ring_buffer is None:
+        return []
+
+    return ring_buffer.recent(count)
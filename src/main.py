@@ -2,6 +2,8 @@ from textual.app import App
 from gui.login import LoginPage
 from textual.widgets import Footer
 from textual.binding import Binding
+from gui.app_state import db
+from log import setup_logging, shutdown_logging
 
 
 class ArcanumApp(App):
@@ -11,6 +13,7 @@ class ArcanumApp(App):
     # Key binds for actions
     BINDINGS = [
         Binding(key="q", action="quit", description="Quit the app"),
+        Binding(key="f12", action="inspector", description="Performance"),
     ]
 
     def compose(self):
@@ -20,12 +23,41 @@ class ArcanumApp(App):
     def on_mount(self) -> None:
         # Setup variable
         self.logged_in_user_id = 0
+        # Set to a Session once the user logs in
+        self.session = None
+
+        # Keep the query planner statistics fresh and reclaim free space while the app runs
+        self.set_interval(db.profile.maintenance_interval, self.run_maintenance)
+
+    async def run_maintenance(self) -> None:
+        await db.run_maintenance()
+
+    # Close the database cleanly when the app quits
+    async def on_unmount(self) -> None:
+        db.close()
+
+    # Shows the performance inspector
+    def action_inspector(self) -> None:
+        # Imported here so it isn't loaded unless it's opened
+        from gui.inspector import InspectorScreen
+
+        if not isinstance(self.screen, InspectorScreen):
+            self.push_screen(InspectorScreen())
 
     def on_ready(self) -> None:
         # Show the login page first
         self.push_screen(LoginPage())
 
+        # Open the database in the background once the login page has been drawn
+        self.call_after_refresh(db.start)
+
 
 if __name__ == "__main__":
-    app = ArcanumApp()
-    app.run()
+    # Logs go to a file from a background thread instead of over the display
+    setup_logging()
+
+    try:
+        app = ArcanumApp()
+        app.run()
+    finally:
+        shutdown_logging()
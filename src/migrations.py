@@ -0,0 +1,309 @@
+# This file holds the schema migrations for the database
+# The version of the schema is stored inside the database file using PRAGMA user_version
+# Every time the database is opened any migration that hasn't been applied yet is run in order
+#
+# Adding a migration:
+#   ^ Write a function that takes a cursor and upgrades the schema by one step
+#   ^ Append it to the end of MIGRATIONS (never reorder or remove old ones)
+#   ^ The position of the function in the list + 1 is the version it upgrades to
+#
+# Each migration runs inside its own transaction so a crash half way through
+# leaves the database on the previous version and the migration is simply run again
+# The transaction takes the write lock before reading the version
+# So when two processes open an old file at once only one of them runs each migration
+
+import sqlite3
+
+
+# Version 1
+# The original tables, these used to be created directly in Database.__init__
+# IF NOT EXISTS lets this run on databases that were created before migrations existed
+def create_base_tables(cursor: sqlite3.Cursor):
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_name TEXT NOT NULL UNIQUE,
+                password TEXT NOT NULL
+            )
+            """)
+
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                item_name TEXT NOT NULL,
+                username TEXT,
+                password TEXT,
+                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+            """)
+
+
+# Version 2
+# Every item query is scoped to a user so the indexes lead with user_id
+# (user_id, item_name) is used for looking up items by name
+# (user_id, id) is used for listing a users items in order
+def add_item_indexes(cursor: sqlite3.Cursor):
+    cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_items_user_name
+            ON items(user_id, item_name)
+            """)
+
+    cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_items_user_id
+            ON items(user_id, id)
+            """)
+
+
+# Version 3
+# A full text index over the item names and usernames used by Database.search_items
+# It is an external content table so the text isn't stored twice, items is the content
+# The triggers keep it in sync with items on every insert, update and delete
+# prefix='2 3' adds extra indexes so short prefix searches don't scan every term
+def add_item_search(cursor: sqlite3.Cursor):
+    cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+                item_name,
+                username,
+                content='items',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+            """)
+
+    cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN
+                INSERT INTO items_fts(rowid, item_name, username)
+                VALUES (new.id, new.item_name, new.username);
+            END
+            """)
+
+    # External content tables need the old values to remove a row from the index
+    cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN
+                INSERT INTO items_fts(items_fts, rowid, item_name, username)
+                VALUES ('delete', old.id, old.item_name, old.username);
+            END
+            """)
+
+    # Only re-index when the searched columns change, not on every password change
+    cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE OF item_name, username ON items BEGIN
+                INSERT INTO items_fts(items_fts, rowid, item_name, username)
+                VALUES ('delete', old.id, old.item_name, old.username);
+                INSERT INTO items_fts(rowid, item_name, username)
+                VALUES (new.id, new.item_name, new.username);
+            END
+            """)
+
+    backfill_item_search(cursor)
+
+
+# Number of items added to the search index by each statement of the backfill
+BACKFILL_BATCH_SIZE = 5000
+
+
+def backfill_item_search(cursor: sqlite3.Cursor, batch_size: int = BACKFILL_BATCH_SIZE):
+    '''Adds the items that existed before the search index to it
+    Walks the items in id order a batch at a time so no statement has to hold the whole vault'''
+
+    last_id = 0
+
+    while True:
+        cursor.execute("""
+                SELECT MAX(id) FROM (
+                    SELECT id FROM items WHERE id > ? ORDER BY id LIMIT ?
+                )
+                """, (last_id, batch_size))
+
+        batch_end = cursor.fetchone()[0]
+
+        if batch_end is None:
+            break
+
+        cursor.execute("""
+                INSERT INTO items_fts(rowid, item_name, username)
+                SELECT id, item_name, username FROM items
+                WHERE id > ? AND id <= ?
+                """, (last_id, batch_end))
+
+        last_id = batch_end
+
+
+# Version 4
+# Folders, each one belongs to a user and can sit inside another folder
+# Deleting a folder deletes the folders inside it, the items in them are kept and just lose their folder
+# item_count is the number of items directly in the folder, the triggers keep it up to date
+# So showing the count of every folder never has to count the items
+def add_folders(cursor: sqlite3.Cursor):
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS folders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                parent_id INTEGER,
+                name TEXT NOT NULL,
+                item_count INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY(parent_id) REFERENCES folders(id) ON DELETE CASCADE
+            )
+            """)
+
+    cursor.execute("""
+            ALTER TABLE items
+            ADD COLUMN folder_id INTEGER REFERENCES folders(id) ON DELETE SET NULL
+            """)
+
+    # Used to list the folders inside a folder and to walk down the tree
+    cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_folders_user_parent
+            ON folders(user_id, parent_id)
+            """)
+
+    # Used for listing the items of a folder in order, like idx_items_user_id for the whole vault
+    cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_items_user_folder
+            ON items(user_id, folder_id, id)
+            """)
+
+    cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS items_folder_count_insert
+            AFTER INSERT ON items WHEN new.folder_id IS NOT NULL BEGIN
+                UPDATE folders SET item_count = item_count + 1 WHERE id = new.folder_id;
+            END
+            """)
+
+    cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS items_folder_count_delete
+            AFTER DELETE ON items WHEN old.folder_id IS NOT NULL BEGIN
+                UPDATE folders SET item_count = item_count - 1 WHERE id = old.folder_id;
+            END
+            """)
+
+    # Also runs when a deleted folder sets the folder of its items to NULL
+    cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS items_folder_count_move
+            AFTER UPDATE OF folder_id ON items WHEN old.folder_id IS NOT new.folder_id BEGIN
+                UPDATE folders SET item_count = item_count - 1 WHERE id = old.folder_id;
+                UPDATE folders SET item_count = item_count + 1 WHERE id = new.folder_id;
+            END
+            """)
+
+
+# Version 5
+# Progress of a key rotation, see rotation.py
+# There is a row for every table being re-encrypted while a rotation runs and none otherwise
+# last_id is the id of the last row that was re-encrypted, it is saved in the same transaction as the rows
+def add_key_rotation(cursor: sqlite3.Cursor):
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS key_rotation (
+                table_name TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL DEFAULT 0
+            )
+            """)
+
+
+# Version 6
+# Every user gets their own data key for their items, see encrypt.wrap_data_key
+#   ^ users.data_key is the data key encrypted with a key derived from the master password and key_salt
+#   ^ items.user_key is 1 once the password of the item is encrypted with the data key of its user
+#     ^ Items from before this version stay 0 (the vault key) until they are moved over, see rotation.py
+# Users from before this version get a data key the next time they log in
+def add_user_data_keys(cursor: sqlite3.Cursor):
+    cursor.execute("ALTER TABLE users ADD COLUMN data_key TEXT")
+    cursor.execute("ALTER TABLE users ADD COLUMN key_salt BLOB")
+    cursor.execute("ALTER TABLE items ADD COLUMN user_key INTEGER NOT NULL DEFAULT 0")
+
+
+# Version 7
+# Lets several processes (app windows, cli.py, agent.py) share one vault file without overwriting each other
+#   ^ items.version goes up by one every time Database changes an item
+#     ^ update_item and delete_item can be given the version that was read and fail if it has moved on
+#     ^ Re-encrypting a password (rotation.py) doesn't change what the user sees so it leaves the version alone
+#   ^ users.item_changes goes up every time one of their items is added, deleted or gets a new version
+#     ^ The app reads it to notice changes made by another process without reading the items
+def add_item_versions(cursor: sqlite3.Cursor):
+    cursor.execute("ALTER TABLE items ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+    cursor.execute("ALTER TABLE users ADD COLUMN item_changes INTEGER NOT NULL DEFAULT 0")
+
+    cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS items_changes_insert AFTER INSERT ON items BEGIN
+                UPDATE users SET item_changes = item_changes + 1 WHERE id = new.user_id;
+            END
+            """)
+
+    cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS items_changes_delete AFTER DELETE ON items BEGIN
+                UPDATE users SET item_changes = item_changes + 1 WHERE id = old.user_id;
+            END
+            """)
+
+    cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS items_changes_update AFTER UPDATE OF version ON items BEGIN
+                UPDATE users SET item_changes = item_changes + 1 WHERE id = new.user_id;
+            END
+            """)
+
+
+# Version 8
+# The master password was also kept in users.password encrypted with the vault key, so anyone with the key file could read it
+# Unwrapping users.data_key checks the password now, so the copy of every user that has a data key is blanked
+# Users from before version 6 keep theirs until they next log in, see Database.unlock_data_key
+# The column is NOT NULL so it is set to '' instead of dropped
+def remove_user_passwords(cursor: sqlite3.Cursor):
+    cursor.execute("UPDATE users SET password='' WHERE data_key IS NOT NULL")
+
+
+MIGRATIONS = [
+    create_base_tables,
+    add_item_indexes,
+    add_item_search,
+    add_folders,
+    add_key_rotation,
+    add_user_data_keys,
+    add_item_versions,
+    remove_user_passwords,
+]
+
+# The version a fully migrated database will be on
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    '''Returns the schema version stored in the database file'''
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection):
+    '''Upgrades the database to the newest schema version
+    Databases that are already up to date are left alone'''
+
+    current_version = get_schema_version(conn)
+
+    if current_version > SCHEMA_VERSION:
+        raise sqlite3.DatabaseError(
+            f"Database schema version {current_version} is newer than this app supports ({SCHEMA_VERSION})")
+
+    for version in range(current_version, SCHEMA_VERSION):
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+
+            # Another process may have run this migration while we waited for the lock
+            if get_schema_version(conn) > version:
+                conn.rollback()
+                continue
+
+            MIGRATIONS[version](cursor)
+
+            # PRAGMA doesn't accept parameters, version is always an int we control
+            cursor.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+        finally:
+            cursor.close()
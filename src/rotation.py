@@ -0,0 +1,312 @@
+# This file handles rotating the vault key
+# A new key is made and every password in the users and items tables is encrypted again with it
+#
+# How it works:
+#   ^ The new key is put first in the key file and the old keys are kept after it
+#     ^ encrypt.py uses a MultiFernet so new values use the new key and old values can still be read
+#     ^ Other processes notice the new key file within a second (see encrypt.get_fernet)
+#   ^ Rows are re-encrypted in id order BATCH_SIZE at a time, one transaction per batch
+#     ^ The id of the last row done is saved in the key_rotation table in the same transaction
+#     ^ So after a crash the rotation carries on from the last batch that was committed
+#   ^ A row is only replaced if its password is still the one that was read
+#     ^ A row changed by the app in the meantime was already encrypted with the new key
+#   ^ The vault stays readable and writable the whole time, each batch only holds the write lock briefly
+#   ^ Every write goes through Database.write so a batch waits and tries again while another process writes
+#   ^ Starting a rotation reads the key file and writes the new one while holding the write lock
+#     ^ So two processes rotating at once can't both put a new key first and drop the other one
+#
+# The old keys stay in the key file so nothing encrypted with them is ever lost
+# retire=True (--retire) checks that every row can be read with the new key alone and then removes them
+# Only retire with the app closed, a process that hasn't seen the new key yet could still use an old one
+#
+# Items encrypted with the data key of their user (see encrypt.wrap_data_key) don't use the vault key
+# So they are left alone, move_to_data_key moves the older items of a user over to their data key
+#
+# This file can also be run on its own
+#   $ python ./rotation.py
+#   $ python ./rotation.py --retire
+
+import sqlite3
+from cryptography.fernet import Fernet, InvalidToken
+import encrypt
+from log import get_logger
+
+logger = get_logger(__name__)
+
+# The tables that hold encrypted passwords, they are rotated in this order
+ROTATED_TABLES = ("users", "items")
+
+# Extra conditions for the rows of a table that are encrypted with the vault key
+VAULT_KEY_FILTERS = {
+    # Only users from before data keys still have an encrypted password, see migrations.remove_user_passwords
+    "users": "AND password != ''",
+    "items": "AND user_key = 0",
+}
+
+# Rows re-encrypted per transaction
+BATCH_SIZE = 500
+
+
+class KeyRotationError(Exception):
+    '''Raised when the key can't be retired because a row can't be read with the new key'''
+
+
+def rotation_in_progress(conn: sqlite3.Connection) -> bool:
+    '''Returns True if a rotation was started and hasn't finished'''
+    return conn.execute("SELECT COUNT(*) FROM key_rotation").fetchone()[0] > 0
+
+
+def start_rotation(db) -> bool:
+    '''Makes a new key, puts it first in the key file and saves where every table starts
+    Returns False without making a key if another process started a rotation first'''
+    def start(cursor: sqlite3.Cursor) -> int | None:
+        if cursor.execute("SELECT COUNT(*) FROM key_rotation").fetchone()[0] > 0:
+            return None
+
+        # Read the file again, the cached keys could be missing a key another process just added
+        keys = encrypt.read_keys()
+
+        # The key file is written before the checkpoint
+        # A crash in between only leaves an unused key behind and the next run starts again
+        encrypt.write_keys([Fernet.generate_key()] + keys)
+        cursor.executemany("INSERT OR REPLACE INTO key_rotation(table_name, last_id) VALUES (?, 0)",
+                           [(table,) for table in ROTATED_TABLES])
+        return len(keys)
+
+    old_keys = db.write(start)
+    # Either way the key file may have a new key this process hasn't seen yet
+    encrypt.reload_keys_if_changed()
+
+    if old_keys is None:
+        logger.info("Another process already started a key rotation, carrying on with it")
+        return False
+
+    logger.info("Started key rotation, %s old keys kept", old_keys)
+    return True
+
+
+def get_checkpoint(conn: sqlite3.Connection, table: str) -> int | None:
+    '''Returns the id of the last row of the table that was re-encrypted or None if the table is done'''
+    result = conn.execute("SELECT last_id FROM key_rotation WHERE table_name=?", (table,)).fetchone()
+    return None if result is None else result[0]
+
+
+def read_batch(conn: sqlite3.Connection, table: str, after_id: int, batch_size: int):
+    # table is always one of ROTATED_TABLES
+    return conn.execute(f'''
+        SELECT id, password FROM {table}
+        WHERE id > ? AND password IS NOT NULL {VAULT_KEY_FILTERS.get(table, "")}
+        ORDER BY id
+        LIMIT ?
+        ''', (after_id, batch_size)).fetchall()
+
+
+def replace_passwords(db, table: str, rows, last_id: int | None):
+    '''Writes the (new password, id, old password) rows and moves the checkpoint to last_id in one transaction
+    A last_id of None leaves the checkpoint alone'''
+    def replace(cursor: sqlite3.Cursor):
+        cursor.executemany(f'''
+            UPDATE {table} SET password=?
+            WHERE id=? AND password=?
+            ''', rows)
+
+        if last_id is not None:
+            cursor.execute("UPDATE key_rotation SET last_id=? WHERE table_name=?", (last_id, table))
+
+    # Only rows still holding the old password are replaced so running it twice after a busy retry is fine
+    db.write(replace)
+
+
+def rotate_tokens(rows):
+    '''Returns (new password, id, old password) for every (id, password) row
+    Rows that can't be decrypted with any key are logged and left alone'''
+    fernet = encrypt.get_fernet()
+    result = []
+
+    for row_id, password in rows:
+        try:
+            result.append((fernet.rotate(password.encode()).decode(), row_id, password))
+        except InvalidToken:
+            logger.error("Row %s can't be decrypted with any key, it was not rotated", row_id)
+
+    return result
+
+
+def rotate_table(db, table: str, batch_size: int = BATCH_SIZE, progress=None) -> int:
+    '''Re-encrypts the rows of the table from its checkpoint on, returns the number of rows done'''
+    conn = db.conn
+    after_id = get_checkpoint(conn, table)
+    rotated = 0
+
+    while after_id is not None:
+        rows = read_batch(conn, table, after_id, batch_size)
+
+        if not rows:
+            # The table is done
+            db.write(lambda cursor: cursor.execute("DELETE FROM key_rotation WHERE table_name=?", (table,)))
+            break
+
+        # The crypto runs before the transaction so the write lock is only held for the updates
+        after_id = rows[-1][0]
+        replace_passwords(db, table, rotate_tokens(rows), after_id)
+
+        rotated += len(rows)
+
+        if progress is not None:
+            progress(table, rotated)
+
+    return rotated
+
+
+def retire_old_keys(db, batch_size: int = BATCH_SIZE):
+    '''Checks every row can be read with the newest key alone, rotates any that can't and then
+    removes the old keys from the key file'''
+    conn = db.conn
+    newest = encrypt.get_key()
+    primary = Fernet(newest)
+
+    for table in ROTATED_TABLES:
+        after_id = 0
+
+        while True:
+            rows = read_batch(conn, table, after_id, batch_size)
+
+            if not rows:
+                break
+
+            after_id = rows[-1][0]
+            stale = []
+
+            for row_id, password in rows:
+                try:
+                    primary.decrypt(password.encode())
+                except InvalidToken:
+                    stale.append((row_id, password))
+
+            if stale:
+                rotated = rotate_tokens(stale)
+
+                if len(rotated) != len(stale):
+                    raise KeyRotationError(f"Some rows of {table} can't be decrypted, the old keys were kept")
+
+                replace_passwords(db, table, rotated, None)
+
+    def retire(cursor: sqlite3.Cursor):
+        # Rows were only checked against the newest key, if another process rotated since then keep everything
+        if (cursor.execute("SELECT COUNT(*) FROM key_rotation").fetchone()[0] > 0
+                or encrypt.read_keys()[0] != newest):
+            raise KeyRotationError("Another key rotation was started, the old keys were kept")
+
+        encrypt.write_keys([newest])
+
+    db.write(retire)
+    encrypt.reload_keys_if_changed()
+    logger.info("Retired the old vault keys")
+
+
+def rotate_keys(db, batch_size: int = BATCH_SIZE, retire: bool = False, progress=None) -> int:
+    '''Rotates the vault key, carrying on from the checkpoint if a rotation was interrupted
+    progress is called with the table name and the number of its rows done so far
+    Returns the number of rows re-encrypted'''
+    # Does nothing if a rotation is already in progress, that one is carried on instead
+    start_rotation(db)
+    rotated = 0
+
+    for table in ROTATED_TABLES:
+        rotated += rotate_table(db, table, batch_size, progress)
+
+    # Decrypted values in the cache are still right, but nothing should outlive the old key
+    db.clear_cache()
+
+    if retire:
+        retire_old_keys(db, batch_size)
+
+    return rotated
+
+
+def resume_rotation(db, batch_size: int = BATCH_SIZE, progress=None) -> int:
+    '''Finishes a rotation that was interrupted, does nothing if there isn't one
+    Returns the number of rows re-encrypted'''
+    if not rotation_in_progress(db.conn):
+        return 0
+
+    logger.info("Resuming an interrupted key rotation")
+    return rotate_keys(db, batch_size, progress=progress)
+
+
+def move_to_data_key(db, user_id: int, data_key: bytes, batch_size: int = BATCH_SIZE, progress=None) -> int:
+    '''Encrypts the items of the user that still use the vault key with their data key instead
+    Items are marked with user_key as they are done so running it again carries on where it stopped
+    progress is called with the number of items done so far
+    Returns the number of items moved'''
+    conn = db.conn
+    fernet = encrypt.get_user_fernet(data_key)
+    after_id = 0
+    moved = 0
+
+    while True:
+        rows = conn.execute('''
+            SELECT id, password FROM items
+            WHERE user_id = ? AND user_key = 0 AND id > ? AND password IS NOT NULL
+            ORDER BY id
+            LIMIT ?
+            ''', (user_id, after_id, batch_size)).fetchall()
+
+        if not rows:
+            break
+
+        after_id = rows[-1][0]
+        updates = []
+
+        for row_id, password in rows:
+            try:
+                # rotate decrypts with any key and encrypts with the first, the data key
+                updates.append((fernet.rotate(password.encode()).decode(), row_id, password))
+            except InvalidToken:
+                logger.error("Row %s can't be decrypted with any key, it was not moved", row_id)
+
+        # Items changed in the meantime were already saved with the data key
+        db.write(lambda cursor: cursor.executemany('''
+            UPDATE items SET password=?, user_key=1
+            WHERE id=? AND password=?
+            ''', updates))
+
+        moved += len(updates)
+
+        if progress is not None:
+            progress(moved)
+
+    return moved
+
+
+def main():
+    import argparse
+    from database import Database
+
+    parser = argparse.ArgumentParser(
+        description="Rotate the vault key and re-encrypt every password with the new one")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--retire", action="store_true",
+                        help="Remove the old keys once every row uses the new one (close the app first)")
+    args = parser.parse_args()
+
+    db = Database()
+
+    def progress(table: str, count: int):
+        print(f"\rRe-encrypted {count} rows of {table}", end="", flush=True)
+
+    try:
+        rotated = rotate_keys(db, args.batch_size, args.retire, progress)
+
+    except (KeyRotationError, sqlite3.Error, OSError) as e:
+        print(f"\nKey rotation failed: {e}")
+        raise SystemExit(1)
+
+    finally:
+        db.close()
+
+    print(f"\rRe-encrypted {rotated} rows with the new key")
+
+
+if __name__ == "__main__":
+    main()
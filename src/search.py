@@ -0,0 +1,268 @@
+# This file holds the in memory index used to search item names as the user types
+# It is built once per session and kept up to date as items are added and deleted
+#
+# How it works:
+#   ^ Every name is lower cased and split into trigrams (every 3 letters in a row)
+#   ^ Each word is padded with spaces first so the start of a word gets its own trigrams
+#     ^ That lets one and two letter queries match the start of words
+#   ^ A trigram maps to the set of ids of the names that contain it
+#   ^ Names that contain the rarest trigram of every query word are checked for the query itself
+#     ^ Trigrams of the same word mostly occur together, intersecting all of them costs more than it filters
+#   ^ If only a few names contain the query, names sharing most of the trigrams are added as fuzzy matches
+#   ^ A sorted list of the names finds prefix matches with a binary search
+#
+# Results are ranked exact match, then prefix, then start of a word, then anywhere in the name, then fuzzy
+#   ^ Shorter names first within each rank
+#   ^ Every exact, prefix and start of a word match is ranked
+#   ^ Broad queries can match most of the vault mid word, to stay fast while typing only the first
+#     CANDIDATE_FACTOR times as many of those as there are results still wanted are ranked
+
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from itertools import compress, filterfalse, islice, repeat, tee
+from operator import contains, itemgetter, lshift, or_
+
+# Trigrams found in more names than this are skipped when looking for fuzzy matches
+# They say little about the name and counting them would be slow
+MAX_FUZZY_POSTINGS = 5_000
+
+# Share of the query trigrams a name needs to be a fuzzy match
+FUZZY_THRESHOLD = 0.5
+
+# Fuzzy matches are only looked for when fewer names than this contain the query
+# They are there to catch typos, with more real matches than this they would only bury them
+FUZZY_MAX_MATCHES = 10
+
+# How many names containing the query are ranked for each result asked for
+CANDIDATE_FACTOR = 2
+
+# Bits below the name length in the sort keys of TrigramIndex.shortest_containing, enough for any list of names
+POSITION_BITS = 32
+POSITION_MASK = (1 << POSITION_BITS) - 1
+
+
+def word_trigrams(text: str) -> set[str]:
+    '''Returns the trigrams of every word in the text, padded so word starts are included'''
+    trigrams = set()
+
+    for word in text.split():
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    return trigrams
+
+
+def query_trigrams(query: str) -> set[str]:
+    '''Returns the trigrams a name must contain to contain the query'''
+    return set().union(*query_word_trigrams(query))
+
+
+def query_word_trigrams(query: str) -> list[set[str]]:
+    '''Returns the trigrams a name must contain for every word of the query'''
+    words = query.split()
+    word_trigrams = []
+
+    for index, word in enumerate(words):
+        # The first word could start in the middle of a word in the name
+        # So only the trigrams inside it are required
+        if index == 0:
+            padded = word
+        # Any word after it starts a word in the name
+        else:
+            padded = f"  {word}"
+
+        # Every word before the last one is a whole word
+        if index < len(words) - 1:
+            padded += " "
+
+        word_trigrams.append({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+    # One or two letters can only be matched against the start of words
+    if len(words) == 1 and not word_trigrams[0]:
+        word_trigrams[0].add(f"  {words[0]}"[-3:])
+
+    return word_trigrams
+
+
+def word_start_trigram(query: str) -> str:
+    '''Returns the trigram every name with a word starting with the query has'''
+    padded = f"  {query}"
+    return padded[:3] if len(query) == 1 else padded[1:4]
+
+
+class TrigramIndex:
+    '''Maps trigrams of item names to item ids for fast search as you type'''
+
+    def __init__(self, items=()):
+        # id -> (lower case name, name)
+        self.names = {}
+        self.postings = defaultdict(set)
+        # (lower case name, id) kept sorted for prefix searches
+        self.sorted_names = []
+
+        self.add_many(items)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, item_id: int, item_name: str):
+        '''Adds an item to the index, replacing it if it is already there'''
+        if item_id in self.names:
+            self.remove(item_id)
+
+        lowered = item_name.lower()
+        self.names[item_id] = (lowered, item_name)
+        insort(self.sorted_names, (lowered, item_id))
+
+        for trigram in word_trigrams(lowered):
+            self.postings[trigram].add(item_id)
+
+    def add_many(self, items):
+        '''Adds many (id, item_name) tuples at once, faster than calling add for each one'''
+        postings = self.postings
+        added = []
+
+        for item_id, item_name in items:
+            if item_id in self.names:
+                self.remove(item_id)
+
+            lowered = item_name.lower()
+            self.names[item_id] = (lowered, item_name)
+            added.append((lowered, item_id))
+
+            for trigram in word_trigrams(lowered):
+                postings[trigram].add(item_id)
+
+        # One sort instead of an insert into the sorted list for every item
+        self.sorted_names.extend(added)
+        self.sorted_names.sort()
+
+    def remove(self, item_id: int):
+        '''Removes an item from the index if it is there'''
+        entry = self.names.pop(item_id, None)
+
+        if entry is None:
+            return
+
+        position = bisect_left(self.sorted_names, (entry[0], item_id))
+        del self.sorted_names[position]
+
+        for trigram in word_trigrams(entry[0]):
+            ids = self.postings.get(trigram)
+
+            if ids is not None:
+                ids.discard(item_id)
+
+                if not ids:
+                    del self.postings[trigram]
+
+    def search(self, query: str, limit: int = 500) -> list[tuple[int, str]]:
+        '''Returns up to limit (id, item_name) tuples that match the query, best matches first'''
+        query = " ".join(query.lower().split())
+
+        if query == "":
+            return []
+
+        # Names that start with the query come first and are already in order
+        ranked = self.prefix_matches(query, limit)
+
+        if len(ranked) >= limit:
+            return [(item_id, item_name) for _, _, _, item_id, item_name in ranked]
+
+        word_trigrams = query_word_trigrams(query)
+        # The rarest trigram of every word, the candidates are checked for the whole query anyway
+        postings = sorted((min((self.postings.get(trigram, set()) for trigram in trigrams), key=len)
+                           for trigrams in word_trigrams if trigrams), key=len)
+
+        # Names containing those trigrams, starting from the rarest one keeps this small
+        if postings and postings[0]:
+            candidates = postings[0].intersection(*postings[1:])
+        else:
+            candidates = set()
+
+        # Every name where a word starts with the query is ranked, they all come before names containing it elsewhere
+        # Those names have the trigram of a space and the first two letters, so they are a small part of the candidates
+        seen = {entry[3] for entry in ranked}
+        word_starts = candidates & self.postings.get(word_start_trigram(query), set())
+        word_starts.difference_update(seen)
+        ranked.extend(self.shortest_containing(word_starts, " " + query, 2, limit - len(ranked)))
+
+        # Only the first CANDIDATE_FACTOR times as many as are still wanted of the names containing it anywhere else
+        if len(ranked) < limit:
+            seen.update(word_starts)
+            elsewhere = filterfalse(seen.__contains__, candidates)
+            wanted = limit - len(ranked)
+            ranked.extend(self.shortest_containing(elsewhere, query, 3, wanted, wanted * CANDIDATE_FACTOR))
+
+        trigrams = set().union(*word_trigrams)
+
+        if len(ranked) < FUZZY_MAX_MATCHES and len(trigrams) > 1:
+            fuzzy = sorted(self.fuzzy_matches(trigrams, {entry[3] for entry in ranked}))
+            ranked.extend(fuzzy[:limit - len(ranked)])
+
+        return [(item_id, item_name) for _, _, _, item_id, item_name in ranked]
+
+    def shortest_containing(self, item_ids, text: str, rank: int, count: int, scan: int | None = None) -> list:
+        '''Returns ranked entries for up to count of the names that contain text, shortest first
+        With scan only the first that many names containing text are looked at, in no particular order'''
+        names = self.names
+        # map, compress and sorted keep the per name work out of the interpreter loop
+        item_ids, checked_ids = tee(item_ids)
+        found = compress(item_ids, map(contains, map(itemgetter(0), map(names.__getitem__, checked_ids)), repeat(text)))
+
+        if scan is not None:
+            found = islice(found, scan)
+
+        found = list(found)
+
+        # One small int per name sorts many times faster than tuples holding the names
+        # The length goes above the position in found, so when more names of one length than fit are found
+        # the ones kept are whichever were found first
+        lengths = map(len, map(itemgetter(0), map(names.__getitem__, found)))
+        keys = sorted(map(or_, map(lshift, lengths, repeat(POSITION_BITS)), range(len(found))))[:count]
+
+        best = []
+
+        for key in keys:
+            item_id = found[key & POSITION_MASK]
+            lowered, item_name = names[item_id]
+            best.append((rank, len(lowered), lowered, item_id, item_name))
+
+        # Names of the same length in order
+        best.sort()
+        return best
+
+    def prefix_matches(self, query: str, limit: int) -> list:
+        '''Returns ranked entries for up to limit names that start with the query'''
+        ranked = []
+        position = bisect_left(self.sorted_names, (query,))
+
+        for lowered, item_id in self.sorted_names[position:position + limit]:
+            if not lowered.startswith(query):
+                break
+
+            rank = 0 if lowered == query else 1
+            ranked.append((rank, len(lowered), lowered, item_id, self.names[item_id][1]))
+
+        # Exact matches first, then shorter names
+        ranked.sort()
+        return ranked
+
+    def fuzzy_matches(self, trigrams: set[str], exclude: set[int]):
+        '''Yields ranked entries for names that share most of the query trigrams'''
+        counts = Counter()
+
+        for trigram in trigrams:
+            ids = self.postings.get(trigram)
+
+            if ids is not None and len(ids) <= MAX_FUZZY_POSTINGS:
+                counts.update(ids)
+
+        needed = max(1, int(len(trigrams) * FUZZY_THRESHOLD + 0.5))
+
+        for item_id, shared in counts.items():
+            if shared >= needed and item_id not in exclude:
+                lowered, item_name = self.names[item_id]
+                # Fuzzy matches come last, the more trigrams they share the better
+                yield (4 + (1 - shared / len(trigrams)), len(lowered), lowered, item_id, item_name)
+
@@ -0,0 +1,14 @@
+from dataclasses import dataclass, field
+from item_store import ItemStore
+
+
+# A session is created whenever a user successfully logs in
+# It holds everything we know about the logged in user
+@dataclass()
+class Session:
+    user_id: int
+    user_name: str
+    # The unwrapped data key of the user, kept out of the repr so it never ends up in a log
+    data_key: bytes | None = field(default=None, repr=False)
+    # Filled in by the main page once it is shown
+    items: ItemStore = field(default_factory=ItemStore)
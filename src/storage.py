@@ -0,0 +1,117 @@
+# This file holds the settings used when connecting to the database file
+# A profile is applied every time a connection is opened
+#
+# Profiles:
+# 1 - default
+#   ^ WAL journal so readers never wait on a writer and commits don't rewrite the whole journal
+#   ^ synchronous NORMAL which is safe with WAL and avoids an fsync on every commit
+#   ^ Memory mapped reads and a larger page cache
+#
+# 2 - network
+#   ^ For vault files kept on a network filesystem where WAL and mmap aren't safe
+#   ^ Uses the rollback journal and waits longer when the file is locked
+#
+# The profile can be picked with the ARCANUM_STORAGE_PROFILE environment variable
+#
+# Several processes can have the same vault open (app windows, cli.py, agent.py)
+#   ^ sqlite itself waits up to busy_timeout for a lock another connection holds
+#   ^ Database.write tries a whole transaction again busy_retries times if that isn't enough
+#     ^ busy_delays gives the waits between the tries, they double and are random
+#     ^ So processes that found the lock taken at the same moment don't all try again at the same moment
+
+import os
+import random
+import sqlite3
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class StorageProfile:
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    # Bytes of the file that are memory mapped, 0 turns mmap off
+    mmap_size: int = 256 * 1024 * 1024
+    # Negative numbers are in KiB, so this is a 16MB page cache
+    cache_size: int = -16_000
+    # How long to wait in milliseconds when another connection holds a lock
+    busy_timeout: int = 5_000
+    # Times a write that still found the database locked is tried again
+    busy_retries: int = 3
+    # Seconds waited before the first retry, it doubles for every retry after it
+    busy_backoff: float = 0.05
+    # Number of prepared statements sqlite3 keeps per connection
+    cached_statements: int = 256
+    # Only takes effect on new database files
+    auto_vacuum: str = "INCREMENTAL"
+    # Seconds between maintenance runs in the app
+    maintenance_interval: int = 60 * 60
+    # Max number of free pages given back to the filesystem per maintenance run
+    incremental_vacuum_pages: int = 1_000
+    # Seconds between checks in the app for items changed by another process
+    change_check_interval: float = 2.0
+
+
+PROFILES = {
+    "default": StorageProfile(),
+    "network": StorageProfile(
+        journal_mode="DELETE",
+        synchronous="FULL",
+        mmap_size=0,
+        busy_timeout=30_000,
+        busy_backoff=0.5,
+        change_check_interval=10.0,
+    ),
+}
+
+
+def get_profile(name: str | None = None) -> StorageProfile:
+    '''Returns the profile with the given name
+    If no name is given the ARCANUM_STORAGE_PROFILE environment variable is used'''
+    if name is None:
+        name = os.environ.get("ARCANUM_STORAGE_PROFILE", "default")
+
+    if name not in PROFILES:
+        raise ValueError(f"Unknown storage profile: {name}")
+
+    return PROFILES[name]
+
+
+def connect(database_file: str, profile: StorageProfile) -> sqlite3.Connection:
+    '''Opens a connection to the database file and applies the profile to it'''
+    conn = sqlite3.connect(
+        database_file,
+        timeout=profile.busy_timeout / 1000,
+        cached_statements=profile.cached_statements,
+    )
+
+    # PRAGMA doesn't accept parameters, every value here comes from the profile
+    # auto_vacuum has to be set before any tables are created to have an effect
+    conn.execute(f"PRAGMA auto_vacuum = {profile.auto_vacuum}")
+    conn.execute(f"PRAGMA journal_mode = {profile.journal_mode}")
+    conn.execute(f"PRAGMA synchronous = {profile.synchronous}")
+    conn.execute(f"PRAGMA mmap_size = {int(profile.mmap_size)}")
+    conn.execute(f"PRAGMA cache_size = {int(profile.cache_size)}")
+    conn.execute(f"PRAGMA busy_timeout = {int(profile.busy_timeout)}")
+
+    return conn
+
+
+def is_busy(error: sqlite3.Error) -> bool:
+    '''Returns True if the error only means another connection held a lock for too long'''
+    # The extended codes (e.g. SQLITE_BUSY_SNAPSHOT) keep the primary code in the low byte
+    code = getattr(error, "sqlite_errorcode", None)
+
+    if code is None:
+        return False
+
+    return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+
+def busy_delays(profile: StorageProfile):
+    '''Yields the seconds to sleep before each retry of a write that found the database locked
+    Every wait is a random amount between half and all of a backoff that doubles each time
+    The last value is None as there is no retry after the last try'''
+    for attempt in range(profile.busy_retries):
+        yield profile.busy_backoff * 2 ** attempt * random.uniform(0.5, 1.0)
+
+    yield None